@@ -0,0 +1,72 @@
+"""
+Peak memory and time of moffee make on generated decks of growing size.
+Each build runs in a fresh process, so peak resident memory is measured per deck.
+
+Usage:
+
+    python benchmarks/bench_build_memory.py [--slides 500 2000 5000] [--optimize]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "moffee", "templates", "base"
+)
+
+
+def deck(slides: int) -> str:
+    return "\n---\n".join(
+        f"# Slide {i}\n\nSome **text** with a [link](https://example.com/{i}) and `code`.\n\n"
+        f'- item one\n- item two "quoted" here\n\n```python\nprint({i})\n```\n'
+        for i in range(slides)
+    )
+
+
+def run(doc_path: str, output_dir: str, optimize: bool):
+    from moffee.builder import build
+
+    start = time.perf_counter()
+    build(doc_path, output_dir, TEMPLATE_DIR, optimize=optimize)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    size = os.path.getsize(os.path.join(output_dir, "index.html")) / 1024
+    print(f"{seconds * 1000:>10.0f} ms{peak:>10.0f} MiB{size:>10.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slides", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--run", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(*args.run, optimize=args.optimize)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for slides in args.slides:
+            doc_path = os.path.join(temp_dir, f"deck-{slides}.md")
+            with open(doc_path, "w", encoding="utf8") as f:
+                f.write(deck(slides))
+            print(f"{slides:>6} slides", end="", flush=True)
+            command = [
+                sys.executable,
+                __file__,
+                "--run",
+                doc_path,
+                os.path.join(temp_dir, "out"),
+            ]
+            subprocess.run(
+                command + (["--optimize"] if args.optimize else []), check=True
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Conversion time of plain-prose decks with the full extension set versus adaptive extension profiles.
+
+Usage:
+
+    python benchmarks/bench_extension_profile.py [--slides 200] [--repeat 5]
+"""
+
+import argparse
+import time
+
+from markupsafe import Markup
+
+from moffee.compositor import composite
+from moffee.markdown import get_converter, md
+
+SLIDE = """
+## Slide {i}
+Plain prose paragraph number {i}, written with *some emphasis* and **strong words**
+but none of the extended syntax, as most talks are.
+
+- first point of slide {i}
+- second point
+- third point
+
+Closing sentence for slide {i}.
+"""
+
+
+def full(text):
+    return Markup(get_converter().convert(text))
+
+
+def bench(convert, texts, repeat):
+    convert(texts[0])  # warm up converters
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            convert(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slides", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    document = "\n---\n".join(SLIDE.format(i=i) for i in range(args.slides))
+    texts = [page.raw_md for page in composite(document)]
+    print(f"{len(texts)} chunks, best of {args.repeat}")
+    for name, convert in [("full", full), ("adaptive", md)]:
+        seconds = bench(convert, texts, args.repeat)
+        print(
+            f"{name:<10}{seconds * 1000:>10.1f} ms{len(texts) / seconds:>10.0f} chunks/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Conversion time of a code-heavy deck with a cold and a warm highlight cache.
+
+Usage:
+
+    python benchmarks/bench_highlight.py [--slides 100] [--repeat 5]
+"""
+
+import argparse
+import time
+
+from moffee.compositor import composite
+from moffee.markdown import md
+from moffee.utils.md_highlight_ext import highlight_cache
+
+SLIDE = """
+## Example {i}
+
+```python
+def handler_{i}(request):
+    data = request.json()
+    if not data.get("items"):
+        raise ValueError("no items in request {i}")
+    return {{"total": sum(item["price"] * item["count"] for item in data["items"])}}
+```
+
+Call it with `#!python handler_{i}(request)`.
+"""
+
+
+def convert(texts):
+    start = time.perf_counter()
+    for text in texts:
+        md(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slides", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    document = "\n---\n".join(SLIDE.format(i=i) for i in range(args.slides))
+    texts = [page.raw_md for page in composite(document)]
+    md(texts[0])  # warm up converters and lexers
+
+    cold = float("inf")
+    warm = float("inf")
+    for _ in range(args.repeat):
+        highlight_cache.clear()
+        cold = min(cold, convert(texts))
+        warm = min(warm, convert(texts))
+    print(f"{len(texts)} chunks, best of {args.repeat}")
+    print(f"cold cache{cold * 1000:>10.1f} ms")
+    print(f"warm cache{warm * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Throughput of the markdown backends on a synthetic deck.
+
+Usage:
+
+    python benchmarks/bench_markdown_backends.py [--slides 200] [--repeat 5]
+"""
+
+import argparse
+import time
+
+from moffee.compositor import composite
+from moffee.markdown import backends
+
+SLIDE = """
+## Slide {i}
+Some **bold**, *italic*, ==marked== and ~~deleted~~ text with a link to https://example.com/{i}
+and a [[Wiki Page {i}]].
+
+- [ ] task {i}
+- [x] done {i}
+- plain item with `inline code`
+
+> [!note] Callout {i}
+> Body of the callout
+
+```python
+def slide_{i}():
+    return {i} ** 2
+```
+
+| col | value |
+|-----|-------|
+| a   | {i}   |
+"""
+
+
+def chunks(slides: int):
+    document = "\n---\n".join(SLIDE.format(i=i) for i in range(slides))
+    return [page.raw_md for page in composite(document)]
+
+
+def bench(convert, texts, repeat):
+    convert(texts[0])  # warm up converters and lexers
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            convert(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slides", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = chunks(args.slides)
+    size = sum(len(t) for t in texts) / 1024
+    print(f"{len(texts)} chunks, {size:.0f} KiB of markdown, best of {args.repeat}")
+    for name, convert in backends.items():
+        seconds = bench(convert, texts, args.repeat)
+        print(
+            f"{name:<16}{seconds * 1000:>10.1f} ms{len(texts) / seconds:>10.0f} chunks/s"
+            f"{size / seconds:>10.0f} KiB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
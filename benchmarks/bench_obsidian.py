@@ -0,0 +1,66 @@
+"""
+Scaling of Obsidian callout processing with nesting depth and callout length.
+
+Usage:
+
+    python benchmarks/bench_obsidian.py [--repeat 3]
+"""
+
+import argparse
+import time
+
+from markdown import Markdown
+
+
+def nested(depth: int) -> str:
+    lines = []
+    for level in range(depth):
+        prefix = "> " * level
+        lines.append(f"{prefix}> [!note] Level {level}")
+        lines.append(f"{prefix}> Text of level {level}")
+    return "\n".join(lines)
+
+
+def chain(depth: int) -> str:
+    """Callouts each opening directly inside the previous one"""
+    return "\n".join("> " * level + "[!note] Level" for level in range(1, depth + 1))
+
+
+def long(lines: int) -> str:
+    body = "\n".join(f"> Line {i} of a long callout" for i in range(lines))
+    return f"> [!tip] Long\n{body}"
+
+
+def many(callouts: int) -> str:
+    return "\n\n".join(
+        f"Paragraph {i}\n\n> [!note] Callout {i}\n> Body {i}" for i in range(callouts)
+    )
+
+
+def bench(text: str, repeat: int) -> float:
+    converter = Markdown(extensions=["moffee.utils.md_obsidian_ext"])
+    best = float("inf")
+    for _ in range(repeat):
+        converter.reset()
+        start = time.perf_counter()
+        converter.convert(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [(f"nested depth {n}", nested(n)) for n in (10, 20, 40, 80)]
+    cases += [(f"chain depth {n}", chain(n)) for n in (10, 40, 160)]
+    cases += [(f"long {n} lines", long(n)) for n in (1000, 4000, 16000)]
+    cases += [(f"{n} callouts", many(n)) for n in (100, 400, 1600)]
+    for name, text in cases:
+        seconds = bench(text, args.repeat)
+        print(f"{name:<20}{len(text) / 1024:>8.0f} KiB{seconds * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
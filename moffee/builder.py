@@ -1,10 +1,152 @@
-from typing import List
+from contextlib import ExitStack
+from contextvars import ContextVar, copy_context
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
 import os
-from jinja2 import Environment, FileSystemLoader
-from moffee.compositor import Page, PageOption, composite, parse_frontmatter
-from moffee.markdown import md
-from moffee.utils.md_helper import extract_title
-from moffee.utils.file_helper import redirect_paths, copy_assets, merge_directories
+import shutil
+from moffee.compositor import (
+    Chunk,
+    Page,
+    PageOption,
+    Type,
+    parse_frontmatter,
+)
+from moffee.utils.file_helper import (
+    STREAM_CHUNK_SIZE,
+    AssetRewriter,
+    StatCache,
+    path_redirector,
+    redirect_paths,
+    copy_files,
+    merge_directories,
+    list_runtime_files,
+    rewrite_assets,
+    safe_chunks,
+    temporary_path,
+    write_inlined,
+    write_inlined_chunks,
+)
+from moffee.utils.optimize import (
+    minify_html,
+    optimize_static_files,
+    precompress,
+    reference_renamer,
+    used_selectors,
+    write_shared_runtime,
+)
+from moffee.utils.style_classes import important_properties, share_styles
+from moffee.utils.scale_hint import scale_hint
+from moffee.utils.search_index import build_search_index, encode_search_index
+from moffee.utils.page_ir import option_from_ir, pages_from_ir, parse_document
+from moffee.utils.manifest import build_inputs, is_up_to_date, write_manifest
+from moffee.utils.output_swap import current_generation, link_unchanged, staged_output
+from moffee.utils.build_stats import (
+    BuildStats,
+    collect_stats,
+    stage,
+    incr,
+    timed,
+    timed_iter,
+)
+
+TEMPLATE_ROOT = os.path.join(os.path.dirname(__file__), "templates")
+
+
+@dataclass
+class RenderResult:
+    html: str
+    # output relative path -> absolute source path of every file the html refers to
+    assets: Dict[str, str] = field(default_factory=dict)
+
+
+def theme_dirs(theme: str) -> Tuple[str, str]:
+    """Base template directory and theme directory of a bundled theme"""
+    theme_dir = os.path.join(TEMPLATE_ROOT, theme)
+    if not os.path.isdir(theme_dir) or os.path.basename(theme_dir) != theme:
+        raise ValueError(f"Unknown theme: {theme}")
+    return os.path.join(TEMPLATE_ROOT, "base"), theme_dir
+
+
+_runtime_files = lru_cache(maxsize=None)(list_runtime_files)
+
+
+@lru_cache(maxsize=256)
+def _stylesheet_important_properties(path: str, mtime_ns: int) -> FrozenSet[str]:
+    with open(path, encoding="utf-8") as f:
+        return frozenset(important_properties(f.read()))
+
+
+def theme_important_properties(
+    template_dir: str, theme_dir: Optional[str] = None
+) -> Set[str]:
+    """Properties the stylesheets of a theme set with !important, see share_styles"""
+    properties = set()
+    for rel_path, source in _runtime_files(template_dir, theme_dir).items():
+        if rel_path.endswith(".css"):
+            properties |= _stylesheet_important_properties(
+                source, os.stat(source).st_mtime_ns
+            )
+    return properties
+
+
+# Markdown already converted for the current build, keyed by text, shared by the renders of several themes
+_converted_markdown: ContextVar[Optional[Dict[str, "Markup"]]] = ContextVar(
+    "moffee_converted_markdown", default=None
+)
+
+
+def _markdown_filter(convert: Callable[[str], "Markup"]) -> Callable[[str], "Markup"]:
+    """Jinja filter converting markdown, reusing the conversions of the current build if any"""
+
+    def markdown(text: str) -> "Markup":
+        converted = _converted_markdown.get()
+        if converted is None:
+            return convert(text)
+        if text in converted:
+            incr("markdown_hits")
+        else:
+            incr("markdown_misses")
+            converted[text] = convert(text)
+        return converted[text]
+
+    return markdown
+
+
+@lru_cache(maxsize=None)
+def get_environment(
+    template_dir: str,
+    theme_dir: Optional[str] = None,
+    auto_reload: bool = True,
+    markdown_backend: str = "python-markdown",
+) -> "Environment":
+    """
+    Shared jinja2 environment for a template directory, optionally overlaid by a theme directory.
+    Environments are cached so compiled templates are reused across renders and threads.
+    """
+    from jinja2 import ChoiceLoader, Environment, FileSystemLoader
+    from moffee.markdown import get_backend
+
+    loaders = [FileSystemLoader(template_dir)]
+    if theme_dir:
+        loaders.insert(0, FileSystemLoader(theme_dir))
+    env = Environment(loader=ChoiceLoader(loaders), auto_reload=auto_reload)
+    env.filters["markdown"] = _markdown_filter(
+        timed("markdown", get_backend(markdown_backend))
+    )
+    return env
 
 
 def read_options(document_path) -> PageOption:
@@ -55,59 +197,934 @@ def retrieve_structure(pages: List[Page]) -> dict:
     return {"page_meta": page_meta, "headings": headings}
 
 
-def render_jinja2(document: str, template_dir) -> str:
-    """Run jinja2 templating to create html"""
-    # Setup Jinja 2
-    env = Environment(loader=FileSystemLoader(template_dir))
+def count_chunks(chunk: Chunk) -> int:
+    """Number of paragraph chunks in a chunk tree"""
+    if chunk.type == Type.PARAGRAPH:
+        return 1
+    return sum(count_chunks(child) for child in chunk.children)
+
 
-    env.filters["markdown"] = md
+def paragraphs(chunk: Chunk) -> Iterator[str]:
+    """Markdown of every paragraph chunk in a chunk tree"""
+    if chunk.type == Type.PARAGRAPH:
+        yield chunk.paragraph
+        return
+    for child in chunk.children:
+        yield from paragraphs(child)
 
-    template = env.get_template("index.html")
 
+def deck_data(document: str, important: Iterable[str] = ()) -> dict:
+    """
+    Data the templates render a document from, the same for every theme except for the shared styles
+
+    :param important: Properties the theme sets with !important, see theme_important_properties
+    """
     # Fill template
-    pages = composite(document)
-    title = extract_title(document) or "Untitled"
-    slide_struct = retrieve_structure(pages)
-    _, options = parse_frontmatter(document)
+    with stage("composite"):
+        ir = parse_document(document)
+        pages = pages_from_ir(ir)
+    options = option_from_ir(ir["options"])
+    title = ir["title"] or "Untitled"
+    slide_struct = ir["struct"]
     width, height = options.computed_slide_size
 
-    data = {
-        "title": title,
-        "struct": slide_struct,
-        "slide_width": width,
-        "slide_height": height,
-        "slides": [
+    slides = []
+    for page in pages:
+        chunk = page.chunk
+        incr("chunks", count_chunks(chunk))
+        with stage("scale_hints"):
+            hint = scale_hint(page, (width, height))
+        slides.append(
             {
                 "h1": page.h1,
                 "h2": page.h2,
                 "h3": page.h3,
-                "chunk": page.chunk,
+                "chunk": chunk,
                 "layout": page.option.layout,
                 "styles": page.option.styles,
+                "scale_hint": hint,
             }
-            for page in pages
-        ],
+        )
+    incr("slides", len(slides))
+    with stage("search_index"):
+        search_index = encode_search_index(
+            build_search_index(pages, slide_struct["page_meta"])
+        )
+
+    data = {
+        "title": title,
+        "struct": slide_struct,
+        "slide_width": width,
+        "slide_height": height,
+        "slides": slides,
+        "search_index": search_index,
     }
+    _share_styles(data, document, options.styles, important)
+
+    return data
+
+
+def _share_styles(
+    data: dict, document: str, deck_styles: dict, important: Iterable[str]
+):
+    """
+    Turn front matter styles and repeated deco styles into shared classes instead of style attributes:
+    set the style rules of data and the classes and inline styles of its slides, see share_styles
+    """
+    data["style_rules"], slide_styles = share_styles(
+        deck_styles,
+        [slide["styles"] for slide in data["slides"]],
+        set(important) | important_properties(document),
+    )
+    for slide, slide_style in zip(data["slides"], slide_styles):
+        slide["style_class"] = slide_style.classes
+        slide["inline_styles"] = slide_style.inline
+
+
+def _template_data(
+    document: str,
+    template_dir,
+    theme_dir=None,
+    auto_reload: bool = True,
+    markdown_backend: Optional[str] = None,
+) -> Tuple["Template", dict]:
+    """Template and data to render a document with"""
+    _, options = parse_frontmatter(document)
+    markdown_backend = markdown_backend or options.markdown_backend
+    env = get_environment(template_dir, theme_dir, auto_reload, markdown_backend)
+    important = theme_important_properties(template_dir, theme_dir)
+    return env.get_template("index.html"), deck_data(document, important)
+
+
+def render_jinja2(
+    document: str,
+    template_dir,
+    theme_dir=None,
+    auto_reload: bool = True,
+    markdown_backend: Optional[str] = None,
+) -> str:
+    """
+    Run jinja2 templating to create html
+
+    :param markdown_backend: Markdown backend, defaults to the markdown_backend option in front matter
+    """
+    template, data = _template_data(
+        document, template_dir, theme_dir, auto_reload, markdown_backend
+    )
+    with stage("jinja"):
+        return template.render(data)
+
+
+def stream_jinja2(
+    document: str,
+    template_dir,
+    theme_dir=None,
+    markdown_backend: Optional[str] = None,
+) -> Iterator[str]:
+    """
+    Like render_jinja2, but generate the html in chunks as the template renders,
+    so it never has to be held in memory as a whole. Chunks are cut as by safe_chunks.
+    """
+    template, data = _template_data(
+        document, template_dir, theme_dir, markdown_backend=markdown_backend
+    )
+    return _generate(template, data)
+
+
+def _generate(template: "Template", data: dict) -> Iterator[str]:
+    # Templates yield many small strings, time them by chunk to keep the overhead low
+    return timed_iter("jinja", safe_chunks(template.generate(data)))
+
+
+def render(
+    document: str,
+    theme: Optional[str] = None,
+    document_path: Optional[str] = None,
+    markdown_backend: Optional[str] = None,
+) -> RenderResult:
+    """
+    Render a markdown document to html in memory, without writing any file.
+    Safe to call concurrently from multiple threads.
+
+    Local paths are only resolved when document_path is given, relative to it and its resource_dir.
+    Documents from untrusted sources should be rendered without document_path.
+
+    :param document: Markdown document as a string
+    :param theme: Theme name, defaults to the theme in the front matter
+    :param document_path: Optional path the document is considered to live at
+    :param markdown_backend: Markdown backend, defaults to the one in the front matter
+    :return: RenderResult with the html and the files it refers to, keyed by their output relative path
+    """
+    _, options = parse_frontmatter(document)
+    template_dir, theme_dir = theme_dirs(theme or options.theme)
+
+    html = render_jinja2(
+        document,
+        template_dir,
+        theme_dir,
+        auto_reload=False,
+        markdown_backend=markdown_backend,
+    )
+    assets = dict(_runtime_files(template_dir, theme_dir))
+    if document_path:
+        stat_cache = StatCache()
+        html = redirect_paths(
+            html,
+            document_path=document_path,
+            resource_dir=options.resource_dir,
+            stat_cache=stat_cache,
+        )
+        html, doc_assets = rewrite_assets(html, "assets", stat_cache)
+        assets.update(doc_assets)
+
+    return RenderResult(html=html, assets=assets)
+
+
+def _optimize_images(
+    html: str, options: PageOption, webp: bool
+) -> Tuple[str, Dict[str, str]]:
+    from moffee.utils.images import optimize_images
+
+    return optimize_images(html, options.computed_slide_size, webp=webp)
+
+
+def _optimize_output(
+    output_dir: str, used: Set[str], template_dir: str, theme_dir: Optional[str]
+) -> Dict[str, str]:
+    """Minify and rename the runtime files for static hosting, dropping the templates only needed to render"""
+    layouts_dir = os.path.join(output_dir, "layouts")
+    if os.path.isdir(layouts_dir):
+        shutil.rmtree(layouts_dir)
+    return optimize_static_files(
+        output_dir, used, list_runtime_files(template_dir, theme_dir)
+    )
+
+
+def _write_chunks(path: str, chunks: Iterable[str]):
+    temporary = temporary_path(path)
+    with open(temporary, "w", encoding="utf-8", newline="") as f:
+        for chunk in chunks:
+            with stage("write"):
+                f.write(chunk)
+    os.replace(temporary, path)
 
-    return template.render(data)
+
+def _remote_downloader(
+    download_remote: bool, stack: ExitStack
+) -> Optional[Callable[[str], str]]:
+    """Downloader of remote assets if enabled, closed along with stack"""
+    if not download_remote:
+        return None
+    from moffee.utils.remote import RemoteDownloader
+
+    return stack.enter_context(RemoteDownloader())
 
 
 def build(
-    document_path: str, output_dir: str, template_dir: str, theme_dir: str = None
+    document_path: str,
+    output_dir: str,
+    template_dir: str,
+    theme_dir: str = None,
+    hooks: Optional[List[Callable[[BuildStats], None]]] = None,
+    force: bool = False,
+    markdown_backend: Optional[str] = None,
+    optimize_images: bool = False,
+    webp: bool = False,
+    optimize: bool = False,
+    download_remote: bool = False,
+) -> BuildStats:
+    """
+    Render document, create output directories and write result html.
+    Nothing is done when output_dir holds a build of the same document, templates, assets and moffee version,
+    as recorded in its manifest.
+
+    :param force: Build even if the output is up to date
+    :param markdown_backend: Markdown backend, defaults to the one in the front matter
+    :param optimize_images: Downscale and recompress images to the slide size, requires Pillow
+    :param webp: With optimize_images, also provide WebP versions of images
+    :param optimize: Minify html, css and js, give static files content hashed names
+                     and write precompressed copies, for static hosting
+    :param download_remote: Download remote images, stylesheets and scripts and refer to local copies,
+                            see moffee.utils.remote
+    :param hooks: Optional callables receiving the BuildStats of this build once it finishes,
+                  e.g. to forward timings to a metrics pipeline.
+    :return: Timings and counters collected during the build
+    """
+    with collect_stats() as stats:
+        with stage("total"):
+            _build(
+                document_path,
+                output_dir,
+                template_dir,
+                theme_dir,
+                force,
+                markdown_backend,
+                optimize_images,
+                webp,
+                optimize,
+                download_remote,
+            )
+
+    for hook in hooks or []:
+        hook(stats)
+    return stats
+
+
+def build_themes(
+    document_path: str,
+    output_dir: str,
+    themes: List[str],
+    hooks: Optional[List[Callable[[BuildStats], None]]] = None,
+    force: bool = False,
+    markdown_backend: Optional[str] = None,
+    optimize_images: bool = False,
+    webp: bool = False,
+    optimize: bool = False,
+    download_remote: bool = False,
+) -> BuildStats:
+    """
+    Build document in several bundled themes, each into output_dir/<theme>.
+    The document is parsed and its markdown converted once, then themes are rendered in parallel
+    from the shared page data. Assets are copied once into output_dir/assets.
+    Themes whose output is up to date are skipped, see build for the other parameters.
+
+    :param themes: Names of bundled themes
+    :return: Timings and counters collected during the build
+    """
+    with collect_stats() as stats:
+        with stage("total"):
+            _build_themes(
+                document_path,
+                output_dir,
+                themes,
+                force,
+                markdown_backend,
+                optimize_images,
+                webp,
+                optimize,
+                download_remote,
+            )
+
+    for hook in hooks or []:
+        hook(stats)
+    return stats
+
+
+def _build_themes(
+    document_path: str,
+    output_dir: str,
+    themes: List[str],
+    force: bool,
+    markdown_backend: Optional[str],
+    optimize_images: bool,
+    webp: bool,
+    optimize: bool,
+    download_remote: bool,
 ):
-    """Render document, create output directories and write result html."""
-    with open(document_path, encoding="utf8") as f:
-        document = f.read()
-    asset_dir = os.path.join(output_dir, "assets")
+    from moffee.markdown import get_backend
+
+    dirs = {theme: theme_dirs(theme) for theme in themes}
+    with stage("read"):
+        with open(document_path, encoding="utf8") as f:
+            document = f.read()
+        options = read_options(document_path)
+
+    with stage("manifest"):
+        pending = {}
+        for theme, (template_dir, theme_dir) in dirs.items():
+            inputs = build_inputs(
+                document,
+                document_path,
+                template_dir,
+                theme_dir,
+                markdown_backend=markdown_backend,
+                optimize_images=optimize_images,
+                webp=webp,
+                optimize=optimize,
+                download_remote=download_remote,
+            )
+            if not force and is_up_to_date(os.path.join(output_dir, theme), inputs):
+                incr("manifest_hits")
+            else:
+                incr("manifest_misses")
+                pending[theme] = inputs
+    if not pending:
+        return
+
+    markdown_backend = markdown_backend or options.markdown_backend
+    data = deck_data(document)
+    convert = timed("markdown", get_backend(markdown_backend))
+    converted = {}
+    for slide in data["slides"]:
+        for text in paragraphs(slide["chunk"]):
+            if text not in converted:
+                converted[text] = convert(text)
+
+    # Paths are probed once for all themes
+    stat_cache = StatCache()
+    redirect = path_redirector(document_path, options.resource_dir, stat_cache)
+    rewrite = AssetRewriter(
+        os.path.join(output_dir, "assets"),
+        url_prefix="../assets",
+        stat_cache=stat_cache,
+    )
+
+    def build_theme(
+        theme: str, staging_dir: str, download: Optional[Callable[[str], str]]
+    ):
+        template_dir, theme_dir = dirs[theme]
+        env = get_environment(
+            template_dir, theme_dir, markdown_backend=markdown_backend
+        )
+        # Which styles can be shared depends on the theme
+        theme_data = dict(data, slides=[dict(slide) for slide in data["slides"]])
+        _share_styles(
+            theme_data,
+            document,
+            options.styles,
+            theme_important_properties(template_dir, theme_dir),
+        )
+        html = _generate(env.get_template("index.html"), theme_data)
+        _write_deck(
+            staging_dir,
+            html,
+            redirect,
+            rewrite,
+            options,
+            pending[theme],
+            template_dir,
+            theme_dir,
+            optimize_images,
+            webp,
+            optimize,
+            copy_assets=False,
+            download=download,
+        )
+
+    token = _converted_markdown.set(converted)
+    try:
+        # Themes are swapped in once all of them and the assets they share are written
+        with ExitStack() as staging, ThreadPoolExecutor(
+            max_workers=len(pending)
+        ) as pool:
+            staging_dirs = {
+                theme: staging.enter_context(
+                    staged_output(os.path.join(output_dir, theme))
+                )
+                for theme in pending
+            }
+            # Remote assets are downloaded once for all themes
+            download = _remote_downloader(download_remote, staging)
+            # Tasks run in a copy of this context, to share the conversions and record build stats
+            futures = [
+                pool.submit(
+                    copy_context().run,
+                    build_theme,
+                    theme,
+                    staging_dirs[theme],
+                    download,
+                )
+                for theme in pending
+            ]
+            for future in futures:
+                future.result()
+            with stage("copy_assets"):
+                copy_files(rewrite.mapping)
+    finally:
+        _converted_markdown.reset(token)
+
+
+SITE_RUNTIME_DIR = "runtime"
+SITE_ASSET_DIR = "assets"
+
+
+def site_layout(document_paths: List[str], output_dir: str) -> Dict[str, str]:
+    """
+    Output directory of each deck of a site: output_dir/<path relative to the common directory of
+    the documents, without extension>, e.g. talks/intro.md -> output_dir/intro.
+
+    :return: Mapping from document path to deck output directory
+    """
+    sources = [os.path.abspath(path) for path in document_paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in sources])
+    layout: Dict[str, str] = {}
+    for path, source in zip(document_paths, sources):
+        rel_path = Path(os.path.splitext(os.path.relpath(source, root))[0])
+        if rel_path.parts[0] in (SITE_RUNTIME_DIR, SITE_ASSET_DIR):
+            raise ValueError(
+                f"{path} would be written to the shared {rel_path.parts[0]} directory"
+            )
+        deck_dir = os.path.join(output_dir, rel_path)
+        if deck_dir in layout.values():
+            raise ValueError(f"Several documents would be written to {deck_dir}")
+        layout[path] = deck_dir
+    return layout
+
+
+def build_site(
+    document_paths: List[str],
+    output_dir: str,
+    hooks: Optional[List[Callable[[BuildStats], None]]] = None,
+    force: bool = False,
+    markdown_backend: Optional[str] = None,
+    optimize_images: bool = False,
+    webp: bool = False,
+    optimize: bool = False,
+    download_remote: bool = False,
+) -> BuildStats:
+    """
+    Build several documents into one site, each deck in its own directory (see site_layout) in the theme
+    of its front matter. Runtime files are written once to output_dir/runtime under content hashed names,
+    and assets to output_dir/assets, which all decks refer to.
+    Decks whose output is up to date are skipped, see build for the other parameters.
+
+    :param document_paths: Markdown documents of the site
+    :return: Timings and counters collected during the build
+    """
+    with collect_stats() as stats:
+        with stage("total"):
+            _build_site(
+                document_paths,
+                output_dir,
+                force,
+                markdown_backend,
+                optimize_images,
+                webp,
+                optimize,
+                download_remote,
+            )
+
+    for hook in hooks or []:
+        hook(stats)
+    return stats
 
-    merge_directories(template_dir, output_dir, theme_dir)
-    options = read_options(document_path)
-    output_html = render_jinja2(document, output_dir)
-    output_html = redirect_paths(
-        output_html, document_path=document_path, resource_dir=options.resource_dir
+
+def _build_site(
+    document_paths: List[str],
+    output_dir: str,
+    force: bool,
+    markdown_backend: Optional[str],
+    optimize_images: bool,
+    webp: bool,
+    optimize: bool,
+    download_remote: bool,
+):
+    layout = site_layout(document_paths, output_dir)
+    # Runtime files of each theme, written before checking manifests so that up to date decks keep theirs
+    runtimes: Dict[str, Dict[str, str]] = {}
+    with ExitStack() as stack:
+        # The site is swapped in as a whole, as decks may be nested in each other.
+        # It starts from the current output, so that up to date decks are kept
+        previous = current_generation(output_dir)
+        site_dir = stack.enter_context(staged_output(output_dir, keep_previous=True))
+        runtime_dir = os.path.join(site_dir, SITE_RUNTIME_DIR)
+        asset_dir = os.path.join(site_dir, SITE_ASSET_DIR)
+        previous_asset_dir = previous and os.path.join(previous, SITE_ASSET_DIR)
+        # Decks often share remote assets, they are downloaded once for the site
+        download = _remote_downloader(download_remote, stack)
+        for document_path, deck_dir in layout.items():
+            deck_dir = os.path.join(site_dir, os.path.relpath(deck_dir, output_dir))
+            with stage("read"):
+                with open(document_path, encoding="utf8") as f:
+                    document = f.read()
+                options = read_options(document_path)
+            template_dir, theme_dir = theme_dirs(options.theme)
+            if options.theme not in runtimes:
+                with stage("runtime"):
+                    runtimes[options.theme] = write_shared_runtime(
+                        runtime_dir,
+                        list_runtime_files(template_dir, theme_dir),
+                        minify=optimize,
+                    )
+
+            with stage("manifest"):
+                inputs = build_inputs(
+                    document,
+                    document_path,
+                    template_dir,
+                    theme_dir,
+                    markdown_backend=markdown_backend,
+                    optimize_images=optimize_images,
+                    webp=webp,
+                    optimize=optimize,
+                    download_remote=download_remote,
+                    site=True,
+                )
+                if not force and is_up_to_date(deck_dir, inputs):
+                    incr("manifest_hits")
+                    continue
+                incr("manifest_misses")
+
+            to_root = Path(os.path.relpath(site_dir, deck_dir)).as_posix()
+            runtime_urls = {
+                rel_path: f"{to_root}/{SITE_RUNTIME_DIR}/{new_path}"
+                for rel_path, new_path in runtimes[options.theme].items()
+            }
+            html = stream_jinja2(
+                document, template_dir, theme_dir, markdown_backend=markdown_backend
+            )
+            # Not shared across decks, as decks written earlier may be among the paths probed
+            stat_cache = StatCache()
+            _write_deck(
+                deck_dir,
+                html,
+                path_redirector(document_path, options.resource_dir, stat_cache),
+                AssetRewriter(
+                    asset_dir,
+                    url_prefix=f"{to_root}/{SITE_ASSET_DIR}",
+                    stat_cache=stat_cache,
+                ),
+                options,
+                inputs,
+                template_dir,
+                theme_dir,
+                optimize_images,
+                webp,
+                optimize,
+                runtime_urls=runtime_urls,
+                download=download,
+                previous_asset_dir=previous_asset_dir,
+            )
+
+        if optimize and os.path.isdir(runtime_dir):
+            with stage("compress"):
+                precompress(runtime_dir)
+
+
+def _build(
+    document_path: str,
+    output_dir: str,
+    template_dir: str,
+    theme_dir: str,
+    force: bool,
+    markdown_backend: Optional[str],
+    optimize_images: bool,
+    webp: bool,
+    optimize: bool,
+    download_remote: bool,
+):
+    with stage("read"):
+        with open(document_path, encoding="utf8") as f:
+            document = f.read()
+        options = read_options(document_path)
+
+    with stage("manifest"):
+        inputs = build_inputs(
+            document,
+            document_path,
+            template_dir,
+            theme_dir,
+            markdown_backend=markdown_backend,
+            optimize_images=optimize_images,
+            webp=webp,
+            optimize=optimize,
+            download_remote=download_remote,
+        )
+        if not force and is_up_to_date(output_dir, inputs):
+            incr("manifest_hits")
+            return
+        incr("manifest_misses")
+
+    html = stream_jinja2(
+        document, template_dir, theme_dir, markdown_backend=markdown_backend
     )
-    output_html = copy_assets(output_html, asset_dir).replace(asset_dir, "assets")
+    stat_cache = StatCache()
+    with ExitStack() as stack:
+        previous = current_generation(output_dir)
+        staging_dir = stack.enter_context(staged_output(output_dir))
+        _write_deck(
+            staging_dir,
+            html,
+            path_redirector(document_path, options.resource_dir, stat_cache),
+            AssetRewriter(
+                os.path.join(staging_dir, "assets"),
+                url_prefix="assets",
+                stat_cache=stat_cache,
+            ),
+            options,
+            inputs,
+            template_dir,
+            theme_dir,
+            optimize_images,
+            webp,
+            optimize,
+            download=_remote_downloader(download_remote, stack),
+            previous_asset_dir=previous and os.path.join(previous, "assets"),
+        )
+
+
+def _process_chunks(
+    html: Iterable[str],
+    redirect: Callable[[str], str],
+    rewrite: Callable[[str], str],
+    options: PageOption,
+    optimize_images: bool,
+    webp: bool,
+    originals: Dict[str, str],
+    download: Optional[Callable[[str], str]] = None,
+) -> Iterator[str]:
+    """
+    Resolve paths, download remote assets, optimize images and rewrite asset URLs in rendered html.
+    The html goes through every step piece by piece, so memory use doesn't grow with the deck.
+
+    :param originals: Updated with the source image of every optimized image
+    :param download: Replaces remote assets by local copies, see RemoteDownloader
+    """
+    for chunk in html:
+        with stage("redirect_paths"):
+            chunk = redirect(chunk)
+        if download is not None:
+            with stage("remote_assets"):
+                chunk = download(chunk)
+        if optimize_images:
+            with stage("images"):
+                chunk, chunk_originals = _optimize_images(chunk, options, webp)
+                originals.update(chunk_originals)
+        with stage("rewrite_assets"):
+            chunk = rewrite(chunk)
+        yield chunk
+
+
+def _write_deck(
+    output_dir: str,
+    html: Iterable[str],
+    redirect: Callable[[str], str],
+    rewrite: AssetRewriter,
+    options: PageOption,
+    inputs: dict,
+    template_dir: str,
+    theme_dir: Optional[str],
+    optimize_images: bool,
+    webp: bool,
+    optimize: bool,
+    copy_assets: bool = True,
+    runtime_urls: Optional[Dict[str, str]] = None,
+    download: Optional[Callable[[str], str]] = None,
+    previous_asset_dir: Optional[str] = None,
+):
+    """
+    Write rendered html, runtime files and assets to output_dir, with its manifest.
+
+    :param html: Rendered html in chunks, see stream_jinja2
+    :param copy_assets: Copy the assets collected by rewrite, False when the caller copies them
+    :param runtime_urls: URLs of runtime files written elsewhere, keyed by their path in the templates.
+                         The runtime files are then not written to output_dir, see build_site
+    :param download: Replaces remote assets by local copies, see RemoteDownloader
+    :param previous_asset_dir: Assets of the build being replaced, linked when unchanged, see link_unchanged
+    """
+    with stage("templates"):
+        if runtime_urls is None:
+            merge_directories(template_dir, output_dir, theme_dir)
+        else:
+            # Other decks of a site may be nested in output_dir, so it is not cleared
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+    Path(rewrite.target_dir).mkdir(parents=True, exist_ok=True)
+    rename_runtime = reference_renamer(runtime_urls or {})
+    # Shared stylesheets can't be pruned for one deck
+    prune = optimize and runtime_urls is None
+    originals: Dict[str, str] = {}
+    used: Set[str] = set()
+
+    def output_chunks() -> Iterator[str]:
+        for chunk in _process_chunks(
+            html,
+            redirect,
+            lambda chunk: rename_runtime(rewrite(chunk)),
+            options,
+            optimize_images,
+            webp,
+            originals,
+            download,
+        ):
+            if prune:
+                used.update(used_selectors(chunk))
+            yield chunk
+
+    output_file = os.path.join(output_dir, "index.html")
+    # Optimized builds need the whole deck to prune stylesheets before the html can refer to them
+    html_file = output_file + ".unoptimized" if prune else output_file
+    chunks = output_chunks()
+    if optimize and not prune:
+        chunks = minify_html(chunks)
+    with stage("render"):
+        _write_chunks(html_file, chunks)
+    if copy_assets:
+        with stage("copy_assets"):
+            copy_files(
+                link_unchanged(rewrite.mapping, rewrite.target_dir, previous_asset_dir)
+            )
+
+    if prune:
+        with stage("optimize"):
+            rename = reference_renamer(
+                _optimize_output(output_dir, used, template_dir, theme_dir)
+            )
+            with open(html_file, encoding="utf-8", newline="") as f:
+                chunks = safe_chunks(iter(lambda: f.read(STREAM_CHUNK_SIZE), ""))
+                _write_chunks(output_file, minify_html(map(rename, chunks)))
+            os.unlink(html_file)
+    if optimize:
+        with stage("compress"):
+            precompress(output_dir)
+    incr("bytes_written", os.path.getsize(output_file))
+
+    with stage("manifest"):
+        # Assets are recorded by their URL, relative to the deck wherever they are written.
+        # Optimized images are recorded by their source, so changing the source triggers a rebuild
+        assets = {
+            url: originals.get(original_path, original_path)
+            for original_path, url in rewrite.urls.items()
+        }
+        write_manifest(output_dir, inputs, assets, rewrite.stat_cache.missing())
+
+
+def build_archive(
+    document_path: str,
+    output_file: str,
+    template_dir: str,
+    theme_dir: str = None,
+    hooks: Optional[List[Callable[[BuildStats], None]]] = None,
+    markdown_backend: Optional[str] = None,
+    optimize_images: bool = False,
+    webp: bool = False,
+    download_remote: bool = False,
+) -> BuildStats:
+    """
+    Render document straight into a zip or tar archive laid out like the output directory of build,
+    without writing the files anywhere else. See build for the other parameters.
+
+    :param output_file: Path of the archive, its suffix (.zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz) sets the format
+    :return: Timings and counters collected during the build
+    """
+    from moffee.utils.archive import open_archive
+
+    with collect_stats() as stats, ExitStack() as stack:
+        with stage("total"):
+            with stage("read"):
+                with open(document_path, encoding="utf8") as f:
+                    document = f.read()
+                options = read_options(document_path)
+            Path(os.path.dirname(os.path.abspath(output_file))).mkdir(
+                parents=True, exist_ok=True
+            )
+            temporary = temporary_path(output_file)
+            archive = open_archive(temporary)
+            try:
+                with stage("templates"):
+                    for rel_path, source in list_runtime_files(
+                        template_dir, theme_dir
+                    ).items():
+                        archive.add_file(rel_path, source)
+                stat_cache = StatCache()
+                rewrite = AssetRewriter("assets", stat_cache=stat_cache)
+                html = stream_jinja2(
+                    document, template_dir, theme_dir, markdown_backend=markdown_backend
+                )
+                chunks = _process_chunks(
+                    html,
+                    path_redirector(document_path, options.resource_dir, stat_cache),
+                    rewrite,
+                    options,
+                    optimize_images,
+                    webp,
+                    {},
+                    _remote_downloader(download_remote, stack),
+                )
+                with stage("render"):
+                    archive.add_chunks("index.html", chunks)
+                with stage("copy_assets"):
+                    for new_path, original_path in rewrite.mapping.items():
+                        archive.add_file(Path(new_path).as_posix(), original_path)
+                        incr("assets_copied")
+                archive.close()
+                os.replace(temporary, output_file)
+            except BaseException:
+                archive.close()
+                os.unlink(temporary)
+                raise
+            incr("bytes_written", os.path.getsize(output_file))
+
+    for hook in hooks or []:
+        hook(stats)
+    return stats
+
+
+def build_single_file(
+    document_path: str,
+    output_file: str,
+    template_dir: str,
+    theme_dir: str = None,
+    hooks: Optional[List[Callable[[BuildStats], None]]] = None,
+    markdown_backend: Optional[str] = None,
+    optimize_images: bool = False,
+    webp: bool = False,
+    download_remote: bool = False,
+) -> BuildStats:
+    """
+    Render document into one self-contained html file, with stylesheets, scripts and local assets embedded.
+    The html is processed in chunks like in build, assets are streamed into the file,
+    and assets referenced more than once are embedded once.
+
+    :param output_file: Path of the html file to write
+    :param markdown_backend: Markdown backend, defaults to the one in the front matter
+    :param optimize_images: Downscale and recompress images to the slide size, requires Pillow
+    :param webp: Ignored, embedding WebP alternatives would store every image twice
+    :param download_remote: Download remote images, stylesheets and scripts and embed them too
+    :param hooks: Optional callables receiving the BuildStats of this build once it finishes
+    :return: Timings and counters collected during the build
+    """
+    with collect_stats() as stats:
+        with stage("total"):
+            with stage("read"):
+                with open(document_path, encoding="utf8") as f:
+                    document = f.read()
+                options = read_options(document_path)
+            output_dir = os.path.dirname(os.path.abspath(output_file))
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            html = stream_jinja2(
+                document, template_dir, theme_dir, markdown_backend=markdown_backend
+            )
+            stat_cache = StatCache()
+            # Assets are counted before they are embedded, so the processed html is read twice
+            processed = temporary_path(output_file + ".processed")
+            try:
+                with ExitStack() as stack:
+                    chunks = _process_chunks(
+                        html,
+                        path_redirector(
+                            document_path, options.resource_dir, stat_cache
+                        ),
+                        lambda chunk: chunk,
+                        options,
+                        optimize_images,
+                        False,
+                        {},
+                        _remote_downloader(download_remote, stack),
+                    )
+                    with stage("render"):
+                        _write_chunks(processed, chunks)
+
+                def processed_chunks() -> Iterator[str]:
+                    with open(processed, encoding="utf-8", newline="") as f:
+                        yield from safe_chunks(
+                            iter(lambda: f.read(STREAM_CHUNK_SIZE), "")
+                        )
+
+                with stage("inline"):
+                    temporary = temporary_path(output_file)
+                    with open(temporary, "w", encoding="utf-8", newline="") as f:
+                        write_inlined_chunks(
+                            processed_chunks,
+                            list_runtime_files(template_dir, theme_dir),
+                            f,
+                            stat_cache=stat_cache,
+                        )
+                    os.replace(temporary, output_file)
+                    incr("bytes_written", os.path.getsize(output_file))
+            finally:
+                if os.path.exists(processed):
+                    os.unlink(processed)
 
-    output_file = os.path.join(output_dir, f"index.html")
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(output_html)
+    for hook in hooks or []:
+        hook(stats)
+    return stats
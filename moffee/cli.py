@@ -2,30 +2,156 @@ from moffee import __version__
 import click
 import os
 from functools import partial
-from moffee.builder import build, read_options
-from livereload import Server
-import tempfile
 
+# Heavy modules (jinja2, markdown, livereload...) are imported by the commands needing them,
+# keeping --help, --version and daemon forwarded builds fast. See tests/test_startup.py.
 
-def run(md, output=None, live=False):
+
+def print_stats(stats):
+    print(stats.format())
+
+
+def is_archive(output: str) -> bool:
+    from moffee.utils.archive import archive_suffix
+
+    return archive_suffix(output) is not None
+
+
+def run(
+    md,
+    output=None,
+    live=False,
+    stats=False,
+    profile=False,
+    profile_output=None,
+    force=False,
+    markdown_backend=None,
+    single_file=False,
+    optimize_images=False,
+    webp=False,
+    optimize=False,
+    themes=None,
+    download_remote=False,
+):
     """Process the markdown file to render slides."""
+    import tempfile
+    from moffee import daemon
+
     if not output:
         output = tempfile.mkdtemp()
+    if single_file and os.path.isdir(output):
+        output = os.path.join(output, "index.html")
+    archive = not single_file and is_archive(output)
+    output_file = (
+        output if single_file or archive else os.path.join(output, "index.html")
+    )
+    if themes:
+        output_file = ", ".join(
+            os.path.join(output, theme, "index.html") for theme in themes
+        )
+    instrumented = stats or profile or profile_output
+    if not live and not instrumented and not os.environ.get("MOFFEE_NO_DAEMON"):
+        response = daemon.forward_make(
+            md,
+            output,
+            force=force,
+            markdown_backend=markdown_backend,
+            single_file=single_file,
+            optimize_images=optimize_images,
+            webp=webp,
+            optimize=optimize,
+            themes=themes,
+            download_remote=download_remote,
+        )
+        if response is not None:
+            print(f"Generated html written to {output_file}")
+            return
+
+    from moffee.builder import (
+        build,
+        build_archive,
+        build_single_file,
+        build_themes,
+        read_options,
+    )
+
     template_dir = os.path.join(os.path.dirname(__file__), "templates")
     options = read_options(md)
     base_template_dir = os.path.join(template_dir, "base")
     theme_template_dir = os.path.join(template_dir, options.theme)
-    render_handler = partial(
-        build,
-        document_path=md,
-        output_dir=output,
-        template_dir=base_template_dir,
-        theme_dir=theme_template_dir,
-    )
+    if themes:
+        render_handler = partial(
+            build_themes,
+            document_path=md,
+            output_dir=output,
+            themes=themes,
+            hooks=[print_stats] if instrumented else None,
+            force=force,
+            markdown_backend=markdown_backend,
+            optimize_images=optimize_images,
+            webp=webp,
+            optimize=optimize,
+            download_remote=download_remote,
+        )
+    elif archive:
+        render_handler = partial(
+            build_archive,
+            document_path=md,
+            output_file=output,
+            template_dir=base_template_dir,
+            theme_dir=theme_template_dir,
+            hooks=[print_stats] if instrumented else None,
+            markdown_backend=markdown_backend,
+            optimize_images=optimize_images,
+            webp=webp,
+            download_remote=download_remote,
+        )
+    elif single_file:
+        render_handler = partial(
+            build_single_file,
+            document_path=md,
+            output_file=output,
+            template_dir=base_template_dir,
+            theme_dir=theme_template_dir,
+            hooks=[print_stats] if instrumented else None,
+            markdown_backend=markdown_backend,
+            optimize_images=optimize_images,
+            webp=webp,
+            download_remote=download_remote,
+        )
+    else:
+        render_handler = partial(
+            build,
+            document_path=md,
+            output_dir=output,
+            template_dir=base_template_dir,
+            theme_dir=theme_template_dir,
+            hooks=[print_stats] if instrumented else None,
+            force=force,
+            markdown_backend=markdown_backend,
+            optimize_images=optimize_images,
+            webp=webp,
+            optimize=optimize,
+            download_remote=download_remote,
+        )
+
+    if profile or profile_output:
+        import cProfile
+        import pstats
 
-    render_handler()
-    print(f"Generated html written to {os.path.join(output, 'index.html')}")
+        profiler = cProfile.Profile()
+        profiler.runcall(render_handler)
+        if profile_output:
+            profiler.dump_stats(profile_output)
+            print(f"Profile written to {profile_output}")
+        else:
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    else:
+        render_handler()
+    print(f"Generated html written to {output_file}")
     if live:
+        from livereload import Server
+
         server = Server()
         server.watch(md, render_handler)
         server.watch(base_template_dir, render_handler)
@@ -34,6 +160,23 @@ def run(md, output=None, live=False):
         server.serve(root=output)
 
 
+markdown_backend_option = click.option(
+    "--markdown-backend",
+    type=click.Choice(["python-markdown", "markdown-it"]),
+    default=None,
+    help="Markdown engine. Overrides the markdown_backend front matter option (python-markdown by default).",
+)
+
+
+download_remote_option = click.option(
+    "--download-remote",
+    is_flag=True,
+    help="Download remote images, stylesheets and scripts and refer to local copies, "
+    "so the slides load without network access. Downloads are cached and revalidated on each build. "
+    "MathJax, mermaid and the fonts and icons imported by theme stylesheets stay remote.",
+)
+
+
 @click.group(
     help="""
 Render markdown file into slides.
@@ -69,11 +212,242 @@ Example usage:
     "--output",
     metavar="<output-path>",
     default=None,
-    help="Output file path. If not specified, a temporary directory will be used.",
+    help="Output file path. If not specified, a temporary directory will be used. "
+    "Paths ending with .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz are written as archives.",
+)
+@click.option(
+    "--single-file",
+    is_flag=True,
+    help="Write one self-contained html file with stylesheets, scripts and images embedded. "
+    "The output path then names the html file.",
+)
+@click.option(
+    "--themes",
+    metavar="<theme,...>",
+    default=None,
+    help="Build the slides in several themes at once, separated by commas, each into <output-path>/<theme>. "
+    "The markdown is parsed once and assets are shared.",
+)
+@click.option(
+    "--optimize-images",
+    is_flag=True,
+    help="Downscale images to twice the slide size and recompress them. Requires Pillow.",
+)
+@click.option(
+    "--webp",
+    is_flag=True,
+    help="Also provide WebP versions of images. Implies --optimize-images. "
+    "With --single-file, only the recompressed originals are embedded.",
 )
-def make(markdown, output):
+@click.option(
+    "--optimize",
+    is_flag=True,
+    help="Prepare the output for static hosting: minify html, css and js, add content hashes "
+    "to static file names and write precompressed .gz (and .br with brotli installed) files. "
+    "Ignored with --single-file.",
+)
+@click.option(
+    "--stats",
+    is_flag=True,
+    help="Report wall and CPU time per build stage, slide counts and asset counts.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Run the build under cProfile and print the most expensive calls along with --stats.",
+)
+@click.option(
+    "--profile-output",
+    metavar="<profile-path>",
+    default=None,
+    help="Write the cProfile dump to this file instead of printing it. Implies --profile.",
+)
+@click.option(
+    "-f",
+    "--force",
+    is_flag=True,
+    help="Rebuild even if the output is up to date with the markdown file, its assets and the theme.",
+)
+@download_remote_option
+@markdown_backend_option
+def make(
+    markdown,
+    output,
+    single_file,
+    themes,
+    optimize_images,
+    webp,
+    optimize,
+    stats,
+    profile,
+    profile_output,
+    force,
+    download_remote,
+    markdown_backend,
+):
     """Generate slides from a markdown file."""
-    run(markdown, output, live=False)
+    if themes is not None:
+        themes = [theme.strip() for theme in themes.split(",") if theme.strip()]
+        if not themes:
+            raise click.BadParameter("no theme given", param_hint="--themes")
+        template_dir = os.path.join(os.path.dirname(__file__), "templates")
+        unknown = [
+            t for t in themes if not os.path.isdir(os.path.join(template_dir, t))
+        ]
+        if unknown:
+            raise click.BadParameter(
+                f"unknown theme {', '.join(unknown)}", param_hint="--themes"
+            )
+        if single_file:
+            raise click.UsageError("--themes can't be combined with --single-file")
+    if output and is_archive(output) and not single_file:
+        if themes:
+            raise click.UsageError("--themes can't be combined with an archive output")
+        if optimize:
+            raise click.UsageError(
+                "--optimize can't be combined with an archive output"
+            )
+    run(
+        markdown,
+        output,
+        live=False,
+        stats=stats,
+        profile=profile,
+        profile_output=profile_output,
+        force=force,
+        markdown_backend=markdown_backend,
+        single_file=single_file,
+        optimize_images=optimize_images or webp,
+        webp=webp,
+        optimize=optimize,
+        themes=themes,
+        download_remote=download_remote,
+    )
+
+
+@cli.command(
+    help="""
+Build several markdown files into one static site.
+
+Each deck is written to its own directory under the output directory,
+named after its path relative to the common directory of the markdown
+files. Stylesheets and scripts are written once to <output-path>/runtime
+with content hashed names, and assets to <output-path>/assets, so that
+decks share them and browsers cache them across decks.
+
+Example usage:
+
+\b
+  python moffee.py site talks/*.md -o public/
+"""
+)
+@click.argument("markdown", metavar="<markdown-file>...", nargs=-1, required=True)
+@click.option(
+    "-o",
+    "--output",
+    metavar="<output-path>",
+    required=True,
+    help="Output directory of the site.",
+)
+@click.option(
+    "--optimize-images",
+    is_flag=True,
+    help="Downscale images to twice the slide size and recompress them. Requires Pillow.",
+)
+@click.option(
+    "--webp",
+    is_flag=True,
+    help="Also provide WebP versions of images. Implies --optimize-images. "
+    "With --single-file, only the recompressed originals are embedded.",
+)
+@click.option(
+    "--optimize",
+    is_flag=True,
+    help="Minify html, css and js and write precompressed .gz (and .br with brotli installed) files. "
+    "Shared stylesheets are not pruned.",
+)
+@click.option(
+    "--stats",
+    is_flag=True,
+    help="Report wall and CPU time per build stage, slide counts and asset counts.",
+)
+@click.option(
+    "-f",
+    "--force",
+    is_flag=True,
+    help="Rebuild every deck, even those up to date.",
+)
+@download_remote_option
+@markdown_backend_option
+def site(
+    markdown,
+    output,
+    optimize_images,
+    webp,
+    optimize,
+    stats,
+    force,
+    download_remote,
+    markdown_backend,
+):
+    """Build several markdown files into one static site."""
+    from moffee.builder import build_site
+
+    try:
+        build_site(
+            list(markdown),
+            output,
+            hooks=[print_stats] if stats else None,
+            force=force,
+            markdown_backend=markdown_backend,
+            optimize_images=optimize_images or webp,
+            webp=webp,
+            optimize=optimize,
+            download_remote=download_remote,
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    print(f"Generated site written to {output}")
+
+
+@cli.command(
+    help="""
+Parse a markdown file into its page IR, as JSON.
+
+The IR holds the document options, its pages with their options, headings,
+markdown and chunk trees, and the heading structure of the deck. External
+tools can read it instead of paginating the markdown themselves. Parsed
+documents are cached by content hash, persistently with MOFFEE_CACHE_DIR set.
+
+Example usage:
+
+\b
+  python moffee.py parse example.md -o example.json
+"""
+)
+@click.argument("markdown", metavar="<markdown-file>")
+@click.option(
+    "-o",
+    "--output",
+    metavar="<output-path>",
+    default=None,
+    help="File to write the IR to. Printed if not specified.",
+)
+@click.option(
+    "--indent", type=int, default=None, help="Indent the JSON by this many spaces."
+)
+def parse(markdown, output, indent):
+    """Parse a markdown file into its page IR."""
+    from moffee.utils.page_ir import dumps_ir, parse_document
+
+    with open(markdown, encoding="utf8") as f:
+        text = dumps_ir(parse_document(f.read()), indent=indent)
+    if output is None:
+        click.echo(text)
+    else:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"IR written to {output}")
 
 
 @cli.command(
@@ -91,9 +465,100 @@ Example usage:
 """
 )
 @click.argument("markdown", metavar="<markdown-file>")
-def live(markdown):
+@markdown_backend_option
+def live(markdown, markdown_backend):
     """Launch live mode to update html outputs."""
-    run(markdown, output=None, live=True)
+    run(markdown, output=None, live=True, markdown_backend=markdown_backend)
+
+
+@cli.command(
+    help="""
+Run an HTTP server that renders markdown into slides.
+
+Rendering happens in a pool of pre-warmed worker processes. POST a JSON body
+with "markdown" (and optionally "frontmatter", "theme" and "format") to
+/render. Use format "html" to receive a single self-contained page.
+
+Example usage:
+
+\b
+  python moffee.py serve --port 8080 --workers 4
+"""
+)
+@click.option("--host", default="127.0.0.1", help="Address to listen on.")
+@click.option("--port", default=8080, help="Port to listen on.")
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Number of worker processes. Defaults to the number of CPUs.",
+)
+@click.option(
+    "--queue-size",
+    type=int,
+    default=None,
+    help="Number of requests allowed to wait for a worker before answering 503. Defaults to 4 per worker.",
+)
+def serve(host, port, workers, queue_size):
+    """Run an HTTP server that renders markdown into slides."""
+    from moffee.server import serve as serve_forever
+
+    serve_forever(host=host, port=port, workers=workers, queue_size=queue_size)
+
+
+@cli.group(
+    name="daemon",
+    help="""
+Manage the background build daemon.
+
+While the daemon is running, "make" forwards builds to it over a Unix
+socket and skips interpreter startup and template compilation. Builds fall
+back to running in-process whenever the daemon is unavailable. The daemon
+exits by itself after being idle. Set MOFFEE_NO_DAEMON=1 to never forward.
+""",
+)
+def daemon_group():
+    pass
+
+
+@daemon_group.command(name="start", help="Start the daemon in the background.")
+@click.option(
+    "--idle-timeout",
+    type=float,
+    default=None,
+    help="Seconds without requests after which the daemon exits. Defaults to 600.",
+)
+def daemon_start(idle_timeout):
+    from moffee import daemon
+
+    pid = daemon.start(idle_timeout or daemon.DEFAULT_IDLE_TIMEOUT)
+    if pid is None:
+        raise click.ClickException("Daemon did not start")
+    print(f"Daemon running with pid {pid} on {daemon.socket_path()}")
+
+
+@daemon_group.command(name="stop", help="Stop the running daemon.")
+def daemon_stop():
+    from moffee import daemon
+
+    if daemon.stop():
+        print("Daemon stopped")
+    else:
+        print("No daemon running")
+
+
+@daemon_group.command(name="status", help="Show whether the daemon is running.")
+def daemon_status():
+    from moffee import daemon
+
+    response = daemon.status()
+    if response is None:
+        print("No daemon running")
+    else:
+        print(
+            f"Daemon running with pid {response['pid']} (moffee {response['version']}) "
+            f"on {daemon.socket_path()}"
+        )
 
 
 if __name__ == "__main__":
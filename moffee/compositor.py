@@ -28,6 +28,7 @@ class PageOption:
     slide_height: int = DEFAULT_SLIDE_HEIGHT
     layout: str = "content"
     resource_dir: str = "."
+    markdown_backend: str = "python-markdown"
     styles: dict = field(default_factory=dict)
 
     @property
@@ -93,6 +94,10 @@ class Page:
     h1: Optional[str] = None
     h2: Optional[str] = None
     h3: Optional[str] = None
+    # Chunk tree with the raw_md it was split from
+    _chunk: Optional[Tuple[str, Chunk]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def __post_init__(self):
         self._preprocess()
@@ -118,9 +123,20 @@ class Page:
         - adjacent "===" create chunk with vertical direction
         "===" possesses higher priority than "<->"
 
+        The tree is split once and reused until raw_md changes.
+
         :return: Root of the chunk tree
         """
+        if self._chunk is None or self._chunk[0] != self.raw_md:
+            self._chunk = (self.raw_md, self._split_chunks())
+        return self._chunk[1]
+
+    @chunk.setter
+    def chunk(self, chunk: Chunk):
+        """Use a chunk tree split beforehand, e.g. loaded from the page IR"""
+        self._chunk = (self.raw_md, chunk)
 
+    def _split_chunks(self) -> Chunk:
         def split_by_div(text, type) -> List[Chunk]:
             strs = [""]
             current_escaped = False
@@ -0,0 +1,427 @@
+"""
+Optional background daemon keeping the build pipeline warm.
+
+The daemon listens on a Unix socket and performs builds on behalf of ``moffee make``,
+which saves interpreter startup, imports and template compilation on every call.
+Clients send one JSON line per request and read one JSON line back. Whenever the daemon
+is not running, is from another moffee version or fails, clients fall back to building
+in-process.
+
+The client side of this module only depends on the standard library so that forwarding
+stays cheap.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from moffee import __version__
+
+DEFAULT_IDLE_TIMEOUT = 600
+CONNECT_TIMEOUT = 0.5
+
+
+def _uid() -> str:
+    """uid of the user, in socket names"""
+    return str(os.getuid()) if hasattr(os, "getuid") else "user"
+
+
+def private_dir() -> str:
+    """Directory of the socket without XDG_RUNTIME_DIR, only accessible to the user"""
+    return os.path.join(tempfile.gettempdir(), f"moffee-{_uid()}")
+
+
+def socket_path() -> str:
+    """
+    Path of the daemon socket, can be overridden with MOFFEE_DAEMON_SOCKET.
+    Without XDG_RUNTIME_DIR it is in private_dir(), since any user can create files in the
+    temporary directory, including a socket where the daemon's would be.
+    """
+    if os.environ.get("MOFFEE_DAEMON_SOCKET"):
+        return os.environ["MOFFEE_DAEMON_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], f"moffee-{_uid()}.sock")
+    return os.path.join(private_dir(), "daemon.sock")
+
+
+def _is_own_socket(path: str) -> bool:
+    """Whether path is a socket created by the user, and not by another user"""
+    try:
+        path_stat = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISSOCK(path_stat.st_mode):
+        return False
+    return not hasattr(os, "getuid") or path_stat.st_uid == os.getuid()
+
+
+def _peer_uid(sock: socket.socket) -> Optional[int]:
+    """uid of the process at the other end of a connected Unix socket, None where unknown"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    return struct.unpack("3i", credentials)[1]
+
+
+def request(
+    payload: dict, path: Optional[str] = None, timeout: float = None
+) -> Optional[dict]:
+    """
+    Send a request to the daemon.
+
+    Daemons of other users are never reached: they would receive the paths being built,
+    and could answer without building anything.
+
+    :return: The daemon response, None if no daemon could be reached
+    """
+    path = path or socket_path()
+    if not hasattr(socket, "AF_UNIX") or not _is_own_socket(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(path)
+            # The socket may have been replaced since it was checked
+            peer_uid = _peer_uid(sock)
+            if peer_uid is not None and peer_uid != os.getuid():
+                return None
+            sock.settimeout(timeout)
+            sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+    except OSError:
+        return None
+    # A daemon stopped while answering leaves a truncated line
+    if not line.endswith(b"\n"):
+        return None
+    try:
+        response = json.loads(line)
+    except ValueError:
+        return None
+    return response if isinstance(response, dict) else None
+
+
+def build_environment() -> Dict[str, str]:
+    """Environment variables changing builds, such as MOFFEE_CACHE_DIR"""
+    return {
+        key: value for key, value in os.environ.items() if key.startswith("MOFFEE_")
+    }
+
+
+def forward_make(
+    markdown: str,
+    output: str,
+    force: bool = False,
+    markdown_backend: Optional[str] = None,
+    single_file: bool = False,
+    optimize_images: bool = False,
+    webp: bool = False,
+    optimize: bool = False,
+    themes: Optional[List[str]] = None,
+    download_remote: bool = False,
+    path: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    Ask a running daemon to build markdown into output.
+
+    :return: The daemon response if the build succeeded there, None to build in-process instead
+    """
+    response = request(
+        {
+            "command": "make",
+            "version": __version__,
+            "cwd": os.getcwd(),
+            "markdown": os.path.abspath(markdown),
+            "output": os.path.abspath(output),
+            "force": force,
+            "markdown_backend": markdown_backend,
+            "single_file": single_file,
+            "optimize_images": optimize_images,
+            "webp": webp,
+            "optimize": optimize,
+            "themes": themes,
+            "download_remote": download_remote,
+            "env": build_environment(),
+        },
+        path=path,
+    )
+    if not response or not response.get("ok"):
+        return None
+    return response
+
+
+@contextmanager
+def _environment(env: Optional[Dict[str, str]]):
+    """Replace the daemon's build environment by the client's during a build"""
+    if env is None:
+        yield
+        return
+    previous = build_environment()
+    for key in previous:
+        del os.environ[key]
+    os.environ.update(
+        {key: value for key, value in env.items() if key.startswith("MOFFEE_")}
+    )
+    try:
+        yield
+    finally:
+        for key in build_environment():
+            del os.environ[key]
+        os.environ.update(previous)
+
+
+def _make_private_dir(path: str):
+    """
+    Create path only accessible to the user, or check that it is.
+
+    :raises RuntimeError: If path belongs to another user or is accessible to others
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    path_stat = os.lstat(path)
+    if (
+        not stat.S_ISDIR(path_stat.st_mode)
+        or path_stat.st_uid != os.getuid()
+        or path_stat.st_mode & 0o077
+    ):
+        raise RuntimeError(f"{path} must be a directory only accessible to the user")
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    server: "DaemonServer"
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        self.server.touch()
+        try:
+            payload = json.loads(line)
+            response = self.server.dispatch(payload)
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        self.server.touch()
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self, path: Optional[str] = None, idle_timeout: float = DEFAULT_IDLE_TIMEOUT
+    ):
+        """
+        :param path: Socket path, defaults to socket_path()
+        :param idle_timeout: Seconds without requests after which the daemon shuts itself down
+        """
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self.last_active = time.monotonic()
+        # Builds change the working directory, so they run one at a time
+        self._build_lock = threading.Lock()
+        if os.path.dirname(self.path) == private_dir():
+            _make_private_dir(private_dir())
+        if os.path.lexists(self.path):
+            if request({"command": "ping"}, path=self.path) is not None:
+                raise RuntimeError(f"A daemon is already listening on {self.path}")
+            os.unlink(self.path)
+        # Created without access for other users, rather than restricted after bind
+        umask = os.umask(0o177)
+        try:
+            super().__init__(self.path, DaemonRequestHandler)
+        finally:
+            os.umask(umask)
+        self._warm_up()
+
+    def _warm_up(self):
+        from moffee.builder import render
+        from moffee.server import WARMUP_DOCUMENT, available_themes
+
+        for theme in available_themes():
+            render(WARMUP_DOCUMENT, theme=theme)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def dispatch(self, payload: dict) -> dict:
+        command = payload.get("command")
+        if command == "ping":
+            return {"ok": True, "version": __version__, "pid": os.getpid()}
+        if command == "stop":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        if command == "make":
+            if payload.get("version") != __version__:
+                return {"ok": False, "error": f"daemon runs moffee {__version__}"}
+            return self.make(
+                payload["markdown"],
+                payload["output"],
+                payload["cwd"],
+                payload.get("force", False),
+                payload.get("markdown_backend"),
+                payload.get("single_file", False),
+                payload.get("optimize_images", False),
+                payload.get("webp", False),
+                payload.get("optimize", False),
+                payload.get("themes"),
+                payload.get("download_remote", False),
+                payload.get("env"),
+            )
+        return {"ok": False, "error": f"unknown command: {command}"}
+
+    def make(
+        self,
+        markdown: str,
+        output: str,
+        cwd: str,
+        force: bool = False,
+        markdown_backend: Optional[str] = None,
+        single_file: bool = False,
+        optimize_images: bool = False,
+        webp: bool = False,
+        optimize: bool = False,
+        themes: Optional[List[str]] = None,
+        download_remote: bool = False,
+        env: Optional[Dict[str, str]] = None,
+    ) -> dict:
+        from moffee.utils.archive import archive_suffix
+        from moffee.builder import (
+            build,
+            build_archive,
+            build_single_file,
+            build_themes,
+            read_options,
+            theme_dirs,
+        )
+
+        with self._build_lock, _environment(env):
+            previous_cwd = os.getcwd()
+            os.chdir(cwd)
+            try:
+                options = read_options(markdown)
+                template_dir, theme_dir = theme_dirs(options.theme)
+                if themes:
+                    stats = build_themes(
+                        markdown,
+                        output,
+                        themes,
+                        force=force,
+                        markdown_backend=markdown_backend,
+                        optimize_images=optimize_images,
+                        webp=webp,
+                        optimize=optimize,
+                        download_remote=download_remote,
+                    )
+                elif archive_suffix(output) and not single_file:
+                    stats = build_archive(
+                        markdown,
+                        output,
+                        template_dir,
+                        theme_dir,
+                        markdown_backend=markdown_backend,
+                        optimize_images=optimize_images,
+                        webp=webp,
+                        download_remote=download_remote,
+                    )
+                elif single_file:
+                    stats = build_single_file(
+                        markdown,
+                        output,
+                        template_dir,
+                        theme_dir,
+                        markdown_backend=markdown_backend,
+                        optimize_images=optimize_images,
+                        webp=webp,
+                        download_remote=download_remote,
+                    )
+                else:
+                    stats = build(
+                        markdown,
+                        output,
+                        template_dir,
+                        theme_dir,
+                        force=force,
+                        markdown_backend=markdown_backend,
+                        optimize_images=optimize_images,
+                        webp=webp,
+                        optimize=optimize,
+                        download_remote=download_remote,
+                    )
+            finally:
+                os.chdir(previous_cwd)
+        return {"ok": True, "output": output, "stats": stats.as_dict()}
+
+    def _watch_idle(self):
+        while True:
+            time.sleep(min(1.0, self.idle_timeout / 4))
+            if time.monotonic() - self.last_active > self.idle_timeout:
+                self.shutdown()
+                return
+
+    def serve_until_idle(self):
+        """Serve requests until stopped or idle for idle_timeout seconds"""
+        watcher = threading.Thread(target=self._watch_idle, daemon=True)
+        watcher.start()
+        try:
+            self.serve_forever(poll_interval=0.2)
+        finally:
+            self.server_close()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def start(
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT, wait: float = 10.0
+) -> Optional[int]:
+    """
+    Start a detached daemon process and wait until it accepts requests.
+
+    :return: pid of the daemon, None if it did not come up in time
+    """
+    response = request({"command": "ping"})
+    if response is not None:
+        return response["pid"]
+    subprocess.Popen(
+        [sys.executable, "-m", "moffee.daemon", str(idle_timeout)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        response = request({"command": "ping"})
+        if response is not None:
+            return response["pid"]
+        time.sleep(0.05)
+    return None
+
+
+def stop() -> bool:
+    return request({"command": "stop"}) is not None
+
+
+def status() -> Optional[dict]:
+    return request({"command": "ping"})
+
+
+if __name__ == "__main__":
+    timeout = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_IDLE_TIMEOUT
+    DaemonServer(idle_timeout=timeout).serve_until_idle()
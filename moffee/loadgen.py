@@ -0,0 +1,124 @@
+"""
+Load generator for the render server (``moffee serve``).
+
+Example usage:
+
+    python -m moffee.loadgen example.md --url http://127.0.0.1:8080 -n 1000 -c 16
+"""
+
+import json
+import math
+import threading
+import time
+from http.client import HTTPConnection
+from typing import List, Optional
+from urllib.parse import urlparse
+
+import click
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of values, q in [0, 100]"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def run_load(
+    url: str,
+    document: str,
+    requests: int = 100,
+    concurrency: int = 8,
+    format: str = "deck",
+    theme: Optional[str] = None,
+) -> dict:
+    """
+    Send render requests to a running server from concurrent keep-alive connections.
+
+    :return: Summary with throughput (requests/s), latency percentiles (ms) and status counts
+    """
+    parsed = urlparse(url)
+    payload = {"markdown": document, "format": format}
+    if theme:
+        payload["theme"] = theme
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def take() -> bool:
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        conn = HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+        while take():
+            start = time.perf_counter()
+            try:
+                conn.request("POST", "/render", body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError:
+                conn.close()
+                conn = HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+                status = "error"
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "duration": duration,
+        "throughput": requests / duration if duration else 0.0,
+        "p50": percentile(latencies, 50) * 1000,
+        "p90": percentile(latencies, 90) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "statuses": statuses,
+    }
+
+
+@click.command(help="Measure throughput and latency of a running moffee render server.")
+@click.argument("markdown", metavar="<markdown-file>")
+@click.option("--url", default="http://127.0.0.1:8080", help="Server address.")
+@click.option("-n", "--requests", default=200, help="Total number of requests.")
+@click.option(
+    "-c", "--concurrency", default=8, help="Number of concurrent connections."
+)
+@click.option("--format", type=click.Choice(["deck", "html"]), default="deck")
+@click.option("--theme", default=None, help="Theme to request.")
+def main(markdown, url, requests, concurrency, format, theme):
+    with open(markdown, encoding="utf8") as f:
+        document = f.read()
+    result = run_load(url, document, requests, concurrency, format, theme)
+    print(
+        f"{result['requests']} requests in {result['duration']:.2f}s "
+        f"({result['throughput']:.1f} req/s, concurrency {result['concurrency']})"
+    )
+    print(
+        f"latency p50 {result['p50']:.1f}ms  p90 {result['p90']:.1f}ms  p99 {result['p99']:.1f}ms"
+    )
+    print(f"status codes: {result['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
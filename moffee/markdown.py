@@ -1,8 +1,15 @@
-from markdown import markdown
+import re
+import threading
+from typing import Callable, Dict, Tuple
+from markdown import Markdown
 from markupsafe import Markup
 import pymdownx.superfences
 
+from moffee.utils.build_stats import incr
+
 extensions = [
+    # Must come before superfences and inlinehilite
+    "moffee.utils.md_highlight_ext",
     "pymdownx.tasklist",
     "pymdownx.extra",
     "pymdownx.caret",
@@ -21,6 +28,8 @@ extensions = [
 ]
 
 extension_configs = {
+    # Only provide cached highlighting to other extensions, don't highlight indented code
+    "moffee.utils.md_highlight_ext": {"_enabled": False},
     "pymdownx.superfences": {
         "custom_fences": [
             {
@@ -29,11 +38,98 @@ extension_configs = {
                 "format": pymdownx.superfences.fence_div_format,
             }
         ]
-    }
+    },
 }
 
+_RE_TASK = re.compile(r"\[[ xX]\]")
+_RE_SETEXT = re.compile(r"^[=-]+[ \t]*$", re.MULTILINE)
+_RE_INDENTED = re.compile(r"^(?: {4}|\t)", re.MULTILINE)
 
-def md(text):
-    return Markup(
-        markdown(text, extensions=extensions, extension_configs=extension_configs)
+# Extensions that leave a text untouched unless their trigger syntax appears in it.
+# Checks are deliberately loose: a false positive only costs speed, a false negative changes output.
+optional_extensions: Dict[str, Callable[[str], bool]] = {
+    "pymdownx.tasklist": lambda text: _RE_TASK.search(text) is not None,
+    "pymdownx.caret": lambda text: "^" in text,
+    "pymdownx.tilde": lambda text: "~" in text,
+    "admonition": lambda text: "!!!" in text,
+    "pymdownx.saneheaders": lambda text: "#" in text,
+    "pymdownx.mark": lambda text: "==" in text,
+    "pymdownx.magiclink": lambda text: "://" in text or "www." in text or "@" in text,
+    "toc": lambda text: "#" in text
+    or "<h" in text
+    or "[TOC]" in text
+    or _RE_SETEXT.search(text) is not None,
+    "wikilinks": lambda text: "[[" in text,
+    "pymdownx.inlinehilite": lambda text: "`" in text
+    or _RE_INDENTED.search(text) is not None,
+    "moffee.utils.md_obsidian_ext": lambda text: "[!" in text,
+}
+
+
+def extension_profile(text: str) -> Tuple[str, ...]:
+    """Extensions needed to convert text exactly as the full extension list would"""
+    return tuple(
+        ext
+        for ext in extensions
+        if ext not in optional_extensions or optional_extensions[ext](text)
     )
+
+
+# Markdown instances are expensive to create and not thread-safe,
+# so every thread keeps its own warm converter per extension profile and resets it between documents.
+_local = threading.local()
+
+
+def get_converter(profile: Tuple[str, ...] = None) -> Markdown:
+    """Return this thread's Markdown converter for an extension profile, ready for a new document"""
+    profile = tuple(extensions) if profile is None else profile
+    converters = getattr(_local, "converters", None)
+    if converters is None:
+        converters = _local.converters = {}
+    converter = converters.get(profile)
+    if converter is None:
+        incr("converter_misses")
+        converter = Markdown(
+            extensions=list(profile),
+            extension_configs={
+                k: v for k, v in extension_configs.items() if k in profile
+            },
+        )
+        converters[profile] = converter
+    else:
+        incr("converter_hits")
+    return converter.reset()
+
+
+def md(text):
+    profile = extension_profile(text)
+    incr("extensions_skipped", len(extensions) - len(profile))
+    return Markup(get_converter(profile).convert(text))
+
+
+def md_it(text):
+    """Convert with the markdown-it-py backend"""
+    parser = getattr(_local, "markdown_it", None)
+    if parser is None:
+        from moffee.utils.md_it_ext import make_markdown_it
+
+        incr("converter_misses")
+        parser = _local.markdown_it = make_markdown_it()
+    else:
+        incr("converter_hits")
+    return Markup(parser.render(text))
+
+
+# Markdown backends selectable with the "markdown_backend" option, each converts markdown text to html
+backends: Dict[str, Callable[[str], Markup]] = {
+    "python-markdown": md,
+    "markdown-it": md_it,
+}
+
+
+def get_backend(name: str) -> Callable[[str], Markup]:
+    if name not in backends:
+        raise ValueError(
+            f"Unknown markdown backend: {name}, available: {', '.join(backends)}"
+        )
+    return backends[name]
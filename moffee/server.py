@@ -0,0 +1,294 @@
+"""
+HTTP render server backed by a pool of pre-warmed worker processes.
+
+Endpoints:
+
+- ``POST /render`` with a JSON body ``{"markdown": ..., "frontmatter": {...}, "theme": ..., "format": ...}``.
+  ``format`` is ``"deck"`` (default, JSON with the html and the runtime files it refers to)
+  or ``"html"`` (a single self-contained html page).
+- ``GET /runtime/<theme>/<path>`` serves the stylesheets and scripts referred to by decks.
+- ``GET /health`` reports worker and queue status.
+
+Requests wait for a free worker in a bounded queue. When the queue is full, the server
+answers ``503`` with a ``Retry-After`` header instead of piling up work.
+"""
+
+import json
+import mimetypes
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functools import lru_cache
+from typing import Dict, Optional
+
+import yaml
+
+from moffee.builder import TEMPLATE_ROOT, render, theme_dirs
+from moffee.compositor import parse_frontmatter
+from moffee.utils.file_helper import inline_runtime, list_runtime_files
+
+MAX_BODY_SIZE = 8 * 1024 * 1024
+WARMUP_DOCUMENT = """
+# Warm up
+Text with **emphasis**, a [[link]] and https://example.com
+```python
+print("warm")
+```
+> [!note]
+> callout
+"""
+
+
+def available_themes():
+    return sorted(
+        name
+        for name in os.listdir(TEMPLATE_ROOT)
+        if name != "base" and os.path.isdir(os.path.join(TEMPLATE_ROOT, name))
+    )
+
+
+def apply_frontmatter(document: str, frontmatter: Optional[dict]) -> str:
+    """Merge frontmatter into the document's own front matter, frontmatter wins on confliction"""
+    if not frontmatter:
+        return document
+    merged = {}
+    stripped = document.strip()
+    if stripped.startswith("---"):
+        parts = stripped.split("---", 2)
+        if len(parts) >= 3:
+            try:
+                merged = yaml.safe_load(parts[1]) or {}
+            except yaml.YAMLError:
+                merged = {}
+            document = parts[2]
+    merged.update(frontmatter)
+    return f"---\n{yaml.safe_dump(merged)}---\n{document}"
+
+
+@lru_cache(maxsize=None)
+def runtime_files(theme: str) -> Dict[str, str]:
+    return list_runtime_files(*theme_dirs(theme))
+
+
+def render_request(document: str, theme: Optional[str], format: str) -> dict:
+    """Render a request in a worker process, returns a json serializable response"""
+    theme = theme or parse_frontmatter(document)[1].theme
+    result = render(document, theme=theme)
+    if format == "html":
+        return {"html": inline_runtime(result.html, result.assets)}
+    return {
+        "html": result.html,
+        "assets": {path: f"/runtime/{theme}/{path}" for path in result.assets},
+    }
+
+
+_startup_barrier = None
+
+
+def _warm_worker(themes, barrier=None):
+    """Worker initializer: compile templates, build converters and read runtime files once"""
+    global _startup_barrier
+    _startup_barrier = barrier
+    for theme in themes:
+        render_request(WARMUP_DOCUMENT, theme, "html")
+
+
+def _wait_for_workers():
+    """Block until every worker is warm, so each worker takes exactly one of these calls"""
+    _startup_barrier.wait()
+
+
+class RenderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        queue_timeout: float = 1.0,
+    ):
+        """
+        :param address: (host, port) to listen on
+        :param workers: Number of worker processes, defaults to the number of CPUs
+        :param queue_size: Number of requests allowed to wait for a worker, defaults to 4 per worker
+        :param queue_timeout: Seconds a request may wait for a queue slot before being rejected
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size if queue_size is not None else 4 * self.workers
+        self.queue_timeout = queue_timeout
+        self.themes = available_themes()
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        # Start and warm up all workers before accepting connections. The pool reuses idle
+        # workers, so the calls must block until all of them are running to reach every worker
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_warm_worker,
+            initargs=(self.themes, multiprocessing.Barrier(self.workers)),
+        )
+        for future in [
+            self.pool.submit(_wait_for_workers) for _ in range(self.workers)
+        ]:
+            future.result()
+
+        super().__init__(address, RenderRequestHandler)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(
+        self, document: str, theme: Optional[str], format: str
+    ) -> Optional[dict]:
+        """Render through the worker pool, returns None when the queue is full"""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            return None
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            return self.pool.submit(render_request, document, theme, format).result()
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: RenderServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_body(status, body, "application/json", headers)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(
+                HTTPStatus.OK,
+                {
+                    "status": "ok",
+                    "workers": self.server.workers,
+                    "queue_size": self.server.queue_size,
+                    "pending": self.server.pending,
+                },
+            )
+            return
+
+        parts = self.path.split("?", 1)[0].split("/", 3)
+        if len(parts) == 4 and parts[1] == "runtime" and parts[2] in self.server.themes:
+            files = runtime_files(parts[2])
+            if parts[3] in files:
+                with open(files[parts[3]], "rb") as f:
+                    body = f.read()
+                content_type = mimetypes.guess_type(parts[3])[0] or "text/plain"
+                self.send_body(HTTPStatus.OK, body, content_type)
+                return
+
+        self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != "/render":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+
+        value = (self.headers.get("Content-Length") or "0").strip()
+        # Stricter than int, which accepts signs and underscores
+        if not (value.isascii() and value.isdigit()):
+            self.close_connection = True
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": "invalid Content-Length"})
+            return
+        length = int(value)
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self.send_json(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "body too large"}
+            )
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+            markdown = request.get("markdown", "")
+            if not isinstance(markdown, str):
+                raise TypeError("markdown must be a string")
+            document = apply_frontmatter(markdown, request.get("frontmatter"))
+        except (ValueError, AttributeError, TypeError) as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": f"invalid request: {e}"})
+            return
+
+        theme = request.get("theme")
+        format = request.get("format", "deck")
+        if theme is not None and theme not in self.server.themes:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": f"unknown theme: {theme}"})
+            return
+        if format not in ("deck", "html"):
+            self.send_json(
+                HTTPStatus.BAD_REQUEST, {"error": f"unknown format: {format}"}
+            )
+            return
+
+        start = time.perf_counter()
+        try:
+            response = self.server.submit(document, theme, format)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+        if response is None:
+            self.send_json(
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                {"error": "render queue is full"},
+                headers={"Retry-After": "1"},
+            )
+            return
+
+        headers = {"X-Render-Time": f"{(time.perf_counter() - start) * 1000:.2f}ms"}
+        if format == "html":
+            body = response["html"].encode("utf-8")
+            self.send_body(HTTPStatus.OK, body, "text/html; charset=utf-8", headers)
+        else:
+            self.send_json(HTTPStatus.OK, response, headers)
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    workers: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    queue_timeout: float = 1.0,
+):
+    """Run the render server until interrupted"""
+    server = RenderServer((host, port), workers, queue_size, queue_timeout)
+    print(
+        f"Serving on http://{host}:{server.server_address[1]} "
+        f"with {server.workers} workers (queue size {server.queue_size})"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -32,6 +32,30 @@ window.addEventListener('load', function () {
             const availableWidth = containerWidth - paddingLeft - paddingRight - offsetX;
             const availableHeight = containerHeight - paddingTop - paddingBottom - offsetY;
 
+            // Scale estimated at build time: content is laid out at that scale and measured once more,
+            // which corrects the estimate without stepping through scales
+            const hint = parseFloat(element.dataset.scaleHint);
+            if (hint > 0 && hint < 1 && contentHeight > availableHeight) {
+                let hintScale = hint;
+                for (let i = 0; i < 2; i++) {
+                    element.style.transform = `scale(${hintScale})`;
+                    element.style.width = `${availableWidth / hintScale}px`;
+                    const measured = Math.min(1, availableHeight / element.scrollHeight);
+                    if (Math.abs(measured - hintScale) < 0.01) {
+                        break;
+                    }
+                    hintScale = measured;
+                }
+                element.style.transform = `scale(${hintScale})`;
+                element.style.width = `${availableWidth / hintScale}px`;
+                // Smaller scales only widen the layout, so shrinking to this measurement always fits
+                hintScale = Math.min(hintScale, availableHeight / element.scrollHeight);
+                element.style.transform = `scale(${hintScale})`;
+                element.style.width = `${availableWidth / hintScale}px`;
+                element.style.height = `${availableHeight / hintScale}px`;
+                return;
+            }
+
             let scale = availableHeight / contentHeight;
 
             // Width has to be adjusted so that text is always full width
@@ -165,3 +189,169 @@ function fullscreenCheck() {
 }
 
 window.addEventListener('resize', fullscreenCheck);
+
+
+// Slide search, using the index embedded at build time instead of walking the DOM
+const MAX_SEARCH_RESULTS = 50;
+let searchIndex = null;
+let searchOverlay = null;
+let searchSelected = 0;
+
+function loadSearchIndex() {
+    // Decoded the first time the overlay opens
+    if (searchIndex === null) {
+        const encoded = document.getElementById('search-index').textContent.trim();
+        const bytes = Uint8Array.from(atob(encoded), c => c.charCodeAt(0));
+        const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+        searchIndex = new Response(stream).json();
+    }
+    return searchIndex;
+}
+
+// Lowercase words without accents, as tokens in moffee/utils/search_index.py
+function searchTokens(text) {
+    return text.normalize('NFKD').replace(/\p{M}/gu, '').toLowerCase().match(/[\p{L}\p{N}_]+/gu) || [];
+}
+
+// Position of the first token not sorting before prefix
+function lowerBound(tokens, prefix) {
+    let low = 0;
+    let high = tokens.length;
+    while (low < high) {
+        const middle = (low + high) >> 1;
+        if (tokens[middle] < prefix) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    return low;
+}
+
+// Ids of the slides containing a word starting with each word of the query
+function searchSlides(index, query) {
+    let matches = null;
+    for (const prefix of searchTokens(query)) {
+        const found = new Set();
+        for (let i = lowerBound(index.tokens, prefix); i < index.tokens.length && index.tokens[i].startsWith(prefix); i++) {
+            index.postings[i].forEach(id => found.add(id));
+        }
+        matches = matches === null ? found : new Set([...matches].filter(id => found.has(id)));
+        if (matches.size === 0) {
+            break;
+        }
+    }
+    const ids = matches === null ? [] : [...matches].sort((a, b) => a - b);
+    // A slide number jumps to that slide
+    const number = parseInt(query.trim(), 10);
+    if (String(number) === query.trim() && number >= 1 && number <= index.slides.length) {
+        const position = ids.indexOf(number - 1);
+        if (position !== -1) {
+            ids.splice(position, 1);
+        }
+        ids.unshift(number - 1);
+    }
+    return ids.slice(0, MAX_SEARCH_RESULTS);
+}
+
+function createSearchOverlay() {
+    searchOverlay = document.createElement('div');
+    searchOverlay.className = 'search-overlay';
+    searchOverlay.hidden = true;
+    const input = document.createElement('input');
+    input.className = 'search-input';
+    input.type = 'search';
+    input.placeholder = 'Search slides or type a slide number';
+    const results = document.createElement('ol');
+    results.className = 'search-results';
+    searchOverlay.append(input, results);
+    document.body.appendChild(searchOverlay);
+
+    input.addEventListener('input', () => updateSearch(input.value));
+    input.addEventListener('keydown', event => {
+        // Keys typed in the search don't navigate the slideshow
+        event.stopPropagation();
+        const items = results.children;
+        if (event.key === 'Escape') {
+            closeSearch();
+        } else if (event.key === 'ArrowDown' && items.length) {
+            selectSearchResult((searchSelected + 1) % items.length);
+            event.preventDefault();
+        } else if (event.key === 'ArrowUp' && items.length) {
+            selectSearchResult((searchSelected + items.length - 1) % items.length);
+            event.preventDefault();
+        } else if (event.key === 'Enter' && items.length) {
+            jumpToSlide(parseInt(items[searchSelected].dataset.slide, 10));
+        }
+    });
+    searchOverlay.addEventListener('click', event => {
+        const item = event.target.closest('.search-result');
+        if (item) {
+            jumpToSlide(parseInt(item.dataset.slide, 10));
+        } else if (event.target === searchOverlay) {
+            closeSearch();
+        }
+    });
+}
+
+async function updateSearch(query) {
+    const index = await loadSearchIndex();
+    const results = searchOverlay.querySelector('.search-results');
+    results.replaceChildren(...searchSlides(index, query).map(id => {
+        const [path, snippet] = index.slides[id];
+        const item = document.createElement('li');
+        item.className = 'search-result';
+        item.dataset.slide = id;
+        const title = document.createElement('strong');
+        title.textContent = `${id + 1}${path ? ' · ' + path : ''}`;
+        const text = document.createElement('span');
+        text.textContent = snippet;
+        item.append(title, text);
+        return item;
+    }));
+    selectSearchResult(0);
+}
+
+function selectSearchResult(position) {
+    const items = searchOverlay.querySelector('.search-results').children;
+    if (items[searchSelected]) {
+        items[searchSelected].classList.remove('selected');
+    }
+    searchSelected = position;
+    if (items[position]) {
+        items[position].classList.add('selected');
+        items[position].scrollIntoView({ block: 'nearest' });
+    }
+}
+
+function openSearch() {
+    if (searchOverlay === null) {
+        createSearchOverlay();
+    }
+    searchOverlay.hidden = false;
+    const input = searchOverlay.querySelector('.search-input');
+    input.select();
+    input.focus();
+    updateSearch(input.value);
+}
+
+function closeSearch() {
+    searchOverlay.hidden = true;
+}
+
+function jumpToSlide(index) {
+    closeSearch();
+    if (isPresentationMode) {
+        showSlide(index);
+    } else {
+        slides[index].scrollIntoView({ block: 'center' });
+    }
+}
+
+document.addEventListener('keydown', event => {
+    const typing = event.target.closest && event.target.closest('input, textarea, [contenteditable]');
+    if (!typing && (event.key === '/' || (event.key === 'k' && (event.ctrlKey || event.metaKey)))) {
+        event.preventDefault();
+        openSearch();
+    }
+});
@@ -0,0 +1,123 @@
+"""
+Writing builds straight into zip or tar archives, without an intermediate output directory.
+
+zipfile and tarfile are imported by the writers, so that the cli can check output paths cheaply.
+"""
+
+import os
+import time
+from typing import Iterable, Optional
+
+# Archive suffixes and the tarfile mode writing them, None for zip
+ARCHIVE_FORMATS = {
+    ".zip": None,
+    ".tar": "w",
+    ".tar.gz": "w:gz",
+    ".tgz": "w:gz",
+    ".tar.bz2": "w:bz2",
+    ".tar.xz": "w:xz",
+}
+# Files that are compressed already and gain nothing from deflate
+STORED_EXTENSIONS = {
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".webp",
+    ".avif",
+    ".ico",
+    ".woff",
+    ".woff2",
+    ".mp3",
+    ".mp4",
+    ".ogg",
+    ".webm",
+    ".gz",
+    ".br",
+    ".zip",
+    ".pdf",
+}
+# Size up to which index.html is kept in memory before tar archives spill it to a temporary file
+SPOOL_SIZE = 1 << 20
+
+
+def archive_suffix(path: str) -> Optional[str]:
+    """Archive suffix of path, e.g. ".tar.gz", None if path doesn't name an archive"""
+    name = os.path.basename(path).lower()
+    for suffix in sorted(ARCHIVE_FORMATS, key=len, reverse=True):
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+class ZipWriter:
+    def __init__(self, path: str):
+        import zipfile
+
+        self.archive = zipfile.ZipFile(path, "w")
+
+    @staticmethod
+    def compress_type(arcname: str) -> int:
+        import zipfile
+
+        ext = os.path.splitext(arcname)[1].lower()
+        return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+    def add_file(self, arcname: str, source: str):
+        self.archive.write(source, arcname, compress_type=self.compress_type(arcname))
+
+    def add_chunks(self, arcname: str, chunks: Iterable[str]):
+        import zipfile
+
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        info.compress_type = self.compress_type(arcname)
+        info.external_attr = 0o644 << 16
+        with self.archive.open(info, "w") as f:
+            for chunk in chunks:
+                f.write(chunk.encode("utf-8"))
+
+    def close(self):
+        self.archive.close()
+
+
+class TarWriter:
+    def __init__(self, path: str, mode: str):
+        import tarfile
+
+        self.archive = tarfile.open(path, mode)
+
+    def add_file(self, arcname: str, source: str):
+        self.archive.add(source, arcname, recursive=False)
+
+    def add_chunks(self, arcname: str, chunks: Iterable[str]):
+        import tarfile
+        import tempfile
+
+        # Tar headers come before the data and hold its size
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as f:
+            for chunk in chunks:
+                f.write(chunk.encode("utf-8"))
+            info = tarfile.TarInfo(arcname)
+            info.size = f.tell()
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            f.seek(0)
+            self.archive.addfile(info, f)
+
+    def close(self):
+        self.archive.close()
+
+
+def open_archive(path: str):
+    """
+    Open an archive for writing, in the format given by the suffix of path.
+    Zip archives deflate each file unless it is compressed already, tar archives are compressed as a whole.
+
+    :return: Writer with add_file(arcname, source), add_chunks(arcname, chunks) and close()
+    """
+    suffix = archive_suffix(path)
+    if suffix is None:
+        raise ValueError(f"{path} is not a zip or tar archive")
+    if ARCHIVE_FORMATS[suffix] is None:
+        return ZipWriter(path)
+    return TarWriter(path, ARCHIVE_FORMATS[suffix])
@@ -0,0 +1,161 @@
+"""
+Lightweight per-stage timing and counters for builds.
+
+Stages and counters are recorded on the ``BuildStats`` that is active in the
+current context (see ``collect_stats``). When no stats are being collected,
+``stage`` and ``incr`` are cheap no-ops, so library code can be instrumented
+unconditionally.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+_current_stats: ContextVar[Optional["BuildStats"]] = ContextVar(
+    "moffee_build_stats", default=None
+)
+
+T = TypeVar("T")
+_DONE = object()
+
+
+@dataclass
+class StageTiming:
+    # cpu is the time of the thread running the stage, so renders in other threads don't add to it
+    # and work the stage hands off to a pool (image optimization, downloads) isn't included
+    wall: float = 0.0
+    cpu: float = 0.0
+    calls: int = 0
+
+
+@dataclass
+class BuildStats:
+    stages: Dict[str, StageTiming] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+    # Stages and counters may be recorded from worker threads running in a copy of the build's context
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage. Repeated stages with the same name accumulate."""
+        timing = self.stages.setdefault(name, StageTiming())
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                timing.wall += time.perf_counter() - wall_start
+                timing.cpu += time.thread_time() - cpu_start
+                timing.calls += 1
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def hit_rate(self, cache: str) -> Optional[float]:
+        """
+        Hit rate of a cache recorded with ``<cache>_hits`` and ``<cache>_misses`` counters.
+
+        :param cache: Cache name
+        :return: Ratio of hits to lookups, None if the cache was never queried
+        """
+        hits = self.counters.get(f"{cache}_hits", 0)
+        lookups = hits + self.counters.get(f"{cache}_misses", 0)
+        if lookups == 0:
+            return None
+        return hits / lookups
+
+    @property
+    def caches(self) -> List[str]:
+        names = set()
+        for key in self.counters:
+            for suffix in ("_hits", "_misses"):
+                if key.endswith(suffix):
+                    names.add(key[: -len(suffix)])
+        return sorted(names)
+
+    def as_dict(self) -> dict:
+        """Plain dictionary suitable for JSON serialization or metrics export."""
+        return {
+            "stages": {
+                name: {"wall": t.wall, "cpu": t.cpu, "calls": t.calls}
+                for name, t in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "hit_rates": {name: self.hit_rate(name) for name in self.caches},
+        }
+
+    def format(self) -> str:
+        """Human readable report of stages, counters and cache hit rates."""
+        lines = [f"{'stage':<20}{'wall (ms)':>12}{'cpu (ms)':>12}{'calls':>8}"]
+        for name, t in self.stages.items():
+            lines.append(
+                f"{name:<20}{t.wall * 1000:>12.2f}{t.cpu * 1000:>12.2f}{t.calls:>8}"
+            )
+        if self.counters:
+            lines.append("")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<32}{value:>12}")
+        for name in self.caches:
+            lines.append(f"{name + ' hit rate':<32}{self.hit_rate(name):>12.1%}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def collect_stats(stats: Optional[BuildStats] = None) -> Iterator[BuildStats]:
+    """Activate a BuildStats for the enclosed code, creating one if not given."""
+    stats = stats if stats is not None else BuildStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def current_stats() -> Optional[BuildStats]:
+    return _current_stats.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage on the active BuildStats, if any."""
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    with stats.stage(name):
+        yield
+
+
+def incr(name: str, n: int = 1):
+    """Increase a counter on the active BuildStats, if any."""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.incr(name, n)
+
+
+def timed(name: str, func: Callable) -> Callable:
+    """Wrap func so every call is accounted to stage name."""
+
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def timed_iter(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    """Iterate over iterable, accounting the time spent producing each item to stage name."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
@@ -0,0 +1,153 @@
+"""
+Content-addressed caches with an in-process LRU and an optional persistent layer on disk.
+
+The persistent layer is enabled by pointing MOFFEE_CACHE_DIR at a directory.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from moffee.utils.build_stats import incr
+from moffee.utils.file_helper import temporary_path
+
+
+def cache_dir() -> Optional[str]:
+    """Directory of the persistent cache layer, None when disabled"""
+    return os.environ.get("MOFFEE_CACHE_DIR") or None
+
+
+_process_dir: Optional[str] = None
+_process_dir_lock = threading.Lock()
+
+
+def process_cache_dir() -> str:
+    """Directory for cached files: MOFFEE_CACHE_DIR, or a temporary directory removed when the process exits"""
+    global _process_dir
+    directory = cache_dir()
+    if directory is not None:
+        return directory
+    with _process_dir_lock:
+        if _process_dir is None:
+            _process_dir = tempfile.mkdtemp(prefix="moffee-cache-")
+            atexit.register(shutil.rmtree, _process_dir, ignore_errors=True)
+    return _process_dir
+
+
+def cache_key(*parts) -> str:
+    """Stable key for json serializable parts"""
+    data = json.dumps(parts, sort_keys=True, default=repr, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class Cache:
+    """Thread-safe text cache, hits and misses are counted as <name>_hits and <name>_misses"""
+
+    def __init__(self, name: str, maxsize: int = 1024):
+        self.name = name
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Optional[str]:
+        directory = cache_dir()
+        if directory is None:
+            return None
+        return os.path.join(directory, self.name, key[:2], key)
+
+    def _remember(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = f.read()
+        except OSError:
+            return None
+        self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: str):
+        self._remember(key, value)
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so concurrent readers never see partial entries
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(value)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        value = self.get(key)
+        if value is not None:
+            incr(f"{self.name}_hits")
+            return value
+        incr(f"{self.name}_misses")
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drop in-process entries, the persistent layer is left untouched"""
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache:
+    """
+    Cache of generated files, stored in process_cache_dir().
+    Hits and misses are counted as <name>_hits and <name>_misses.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def get_or_create(
+        self, key: str, filename: str, create: Callable[[str], None]
+    ) -> str:
+        """
+        :param key: Key of the file, see cache_key
+        :param filename: Name the cached file gets
+        :param create: Called with a temporary path to write the file to when it is not cached yet
+        :return: Path of the cached file
+        """
+        directory = os.path.join(process_cache_dir(), self.name, key[:2], key)
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            incr(f"{self.name}_hits")
+            return path
+        incr(f"{self.name}_misses")
+        os.makedirs(directory, exist_ok=True)
+        # Created by create like any file, so it gets the usual mode and not the 0600 of mkstemp,
+        # which copies into build output would keep
+        tmp = temporary_path(path)
+        try:
+            create(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return path
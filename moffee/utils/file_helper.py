@@ -1,11 +1,105 @@
+import base64
+import io
+import mimetypes
 import os
 import re
 import shutil
-from urllib.parse import urlparse
+import hashlib
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+from urllib.parse import quote, urlparse
 from pathlib import Path
-import uuid
 
-from bs4 import BeautifulSoup
+from moffee.utils.build_stats import incr
+
+
+def temporary_path(path: str) -> str:
+    """
+    Unique path next to path, to write a file aside and rename it to path once complete.
+    Readers of path then never see a partially written file, also with concurrent writers.
+    """
+    directory, name = os.path.split(path)
+    # Keeps the extension, which may decide the file format
+    return os.path.join(directory, f".{os.getpid()}-{threading.get_ident()}-{name}")
+
+
+# Threads stat'ing and copying files, I/O bound so more than the CPUs are useful on network file systems
+IO_WORKERS = 16
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+_io_pool_pid: Optional[int] = None
+_io_pool_lock = threading.Lock()
+
+
+def io_pool() -> ThreadPoolExecutor:
+    """Thread pool shared by file operations, created again in forked processes"""
+    global _io_pool, _io_pool_pid
+    with _io_pool_lock:
+        if _io_pool is None or _io_pool_pid != os.getpid():
+            _io_pool = ThreadPoolExecutor(
+                max_workers=IO_WORKERS, thread_name_prefix="moffee-io"
+            )
+            _io_pool_pid = os.getpid()
+    return _io_pool
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+
+class StatCache:
+    """
+    Thread-safe cache of os.stat results, so that the steps of a build probing the same paths
+    (redirect_paths, asset rewriting, copying) stat each path once. Paths can be stat'ed
+    concurrently beforehand with prefetch, as each stat may take milliseconds on network file systems.
+    Probed paths are counted as paths_probed.
+    """
+
+    def __init__(self):
+        # Dict reads and writes are atomic, racing threads at worst stat a path twice
+        self._results: Dict[str, Optional[os.stat_result]] = {}
+
+    def stat(self, path: str) -> Optional[os.stat_result]:
+        """Result of os.stat, None when path doesn't exist"""
+        try:
+            return self._results[path]
+        except KeyError:
+            pass
+        result = self._results[path] = _stat(path)
+        incr("paths_probed")
+        return result
+
+    def exists(self, path: str) -> bool:
+        return self.stat(path) is not None
+
+    def isfile(self, path: str) -> bool:
+        result = self.stat(path)
+        return result is not None and stat.S_ISREG(result.st_mode)
+
+    def missing(self) -> List[str]:
+        """Paths probed that didn't exist, the build changes if any of them appears"""
+        # Copied first, other threads of the build may still be probing
+        return sorted(
+            path for path, result in list(self._results.items()) if result is None
+        )
+
+    def prefetch(self, paths: Iterable[str]):
+        """Stat the paths not cached yet in io_pool"""
+        missing = list(
+            dict.fromkeys(path for path in paths if path not in self._results)
+        )
+        if len(missing) < 2:
+            for path in missing:
+                self.stat(path)
+            return
+        for path, result in zip(missing, io_pool().map(_stat, missing)):
+            self._results[path] = result
+        incr("paths_probed", len(missing))
 
 
 def merge_directories(base_dir: str, output_dir: str, merge_dir: str = None):
@@ -22,7 +116,293 @@ def merge_directories(base_dir: str, output_dir: str, merge_dir: str = None):
         )
 
 
-def redirect_paths(document: str, document_path: str, resource_dir: str = ".") -> str:
+def list_runtime_files(base_dir: str, merge_dir: str = None) -> Dict[str, str]:
+    """
+    List files needed at runtime by a rendered deck (stylesheets, scripts...), as merge_directories would lay them out.
+    Templates (index.html and layouts) are only needed for rendering and are left out.
+
+    :param base_dir: Base template directory
+    :param merge_dir: Optional theme directory, overwrites base_dir on confliction
+    :return: Mapping from output relative path (always "/" separated) to absolute source path
+    """
+    files = {}
+    for root_dir in [base_dir, merge_dir]:
+        if not root_dir:
+            continue
+        for root, _, names in os.walk(root_dir):
+            for name in names:
+                source = os.path.join(root, name)
+                rel_path = Path(os.path.relpath(source, root_dir)).as_posix()
+                if rel_path == "index.html" or rel_path.startswith("layouts/"):
+                    continue
+                files[rel_path] = os.path.abspath(source)
+    return dict(sorted(files.items()))
+
+
+RE_TAG = re.compile(r"<(img|a|link|script|source|video|audio)\b[^>]*>", re.IGNORECASE)
+# Preceded by whitespace, or data-src and the like would match too
+RE_URL_ATTR = re.compile(r'(?<=\s)(src|href|srcset)="([^"]*)"', re.IGNORECASE)
+RE_SCRIPT_END = re.compile(r"\s*</script\s*>", re.IGNORECASE)
+
+# Base64 encodes 3 bytes into 4 characters, so blocks must be a multiple of 3 bytes
+DATA_URI_BLOCK_SIZE = 3 * (1 << 16)
+
+ASSET_LOADER = """<script>
+(function () {
+    var assets = JSON.parse(document.getElementById("moffee-assets").textContent);
+    ["src", "href", "srcset"].forEach(function (attr) {
+        document.querySelectorAll("[data-moffee-" + attr + "]").forEach(function (el) {
+            el.setAttribute(attr, assets[el.getAttribute("data-moffee-" + attr)]);
+        });
+    });
+})();
+</script>
+"""
+
+
+def write_data_uri(path: str, out: TextIO):
+    """Stream the file at path to out as a data URI, SVGs are url-encoded, anything else base64-encoded"""
+    mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if mime == "image/svg+xml":
+        out.write(f"data:{mime},")
+        with open(path, encoding="utf-8") as f:
+            for block in iter(lambda: f.read(DATA_URI_BLOCK_SIZE), ""):
+                out.write(quote(block, safe="/:=;,-_.!~*'()@+"))
+        return
+    with open(path, "rb") as f:
+        out.write(f"data:{mime};base64,")
+        for block in iter(lambda: f.read(DATA_URI_BLOCK_SIZE), b""):
+            out.write(base64.b64encode(block).decode("ascii"))
+
+
+def write_inlined(
+    document: str,
+    runtime_files: Dict[str, str],
+    out: TextIO,
+    inline_assets: bool = True,
+    stat_cache: Optional[StatCache] = None,
+):
+    """
+    Write an HTML document to out as a single self-contained file: runtime stylesheets and scripts are embedded,
+    local files referenced by the document are embedded as data URIs.
+    Files are streamed to out, and files referenced more than once are embedded only once.
+
+    :param document: HTML document to process
+    :param runtime_files: Mapping from output relative path to source path, see list_runtime_files
+    :param out: Text stream to write to
+    :param inline_assets: Whether to embed local files other than runtime files.
+                          Must be False for documents from untrusted sources.
+    :param stat_cache: Cache of the paths probed, usually shared with redirect_paths
+    """
+    write_inlined_chunks(
+        lambda: [document], runtime_files, out, inline_assets, stat_cache
+    )
+
+
+def write_inlined_chunks(
+    chunks: Callable[[], Iterable[str]],
+    runtime_files: Dict[str, str],
+    out: TextIO,
+    inline_assets: bool = True,
+    stat_cache: Optional[StatCache] = None,
+):
+    """
+    Like write_inlined, for a document read in chunks rather than held in memory.
+
+    :param chunks: Function returning the chunks of the document, cut as by safe_chunks.
+                   With inline_assets it is called twice, references are counted before writing.
+    """
+    stat_cache = stat_cache or StatCache()
+
+    def is_asset(url):
+        return inline_assets and not urlparse(url).scheme and stat_cache.isfile(url)
+
+    # Count references first, so files used several times can be embedded once
+    references: Dict[str, int] = {}
+    if inline_assets:
+        for chunk in chunks():
+            for tag in RE_TAG.finditer(chunk):
+                for attr in RE_URL_ATTR.finditer(tag.group(0)):
+                    url = attr.group(2)
+                    if url not in runtime_files and is_asset(url):
+                        references[url] = references.get(url, 0) + 1
+    shared: Dict[str, str] = {}
+
+    def write_tag(tag: str):
+        pos = 0
+        for attr in RE_URL_ATTR.finditer(tag):
+            url = attr.group(2)
+            if url in runtime_files or not is_asset(url):
+                continue
+            out.write(tag[pos : attr.start()])
+            if references[url] > 1:
+                key = shared.setdefault(url, str(len(shared)))
+                out.write(f'data-moffee-{attr.group(1).lower()}="{key}"')
+            else:
+                out.write(f'{attr.group(1)}="')
+                write_data_uri(url, out)
+                out.write('"')
+            incr("assets_inlined")
+            pos = attr.end()
+        out.write(tag[pos:])
+
+    def write_shared():
+        out.write('<script type="application/json" id="moffee-assets">{')
+        for i, (path, key) in enumerate(shared.items()):
+            out.write(f'{"," if i else ""}"{key}":"')
+            write_data_uri(path, out)
+            out.write('"')
+        out.write("}</script>\n")
+        out.write(ASSET_LOADER)
+
+    def read(path):
+        with open(runtime_files[path], encoding="utf-8") as f:
+            return f.read()
+
+    shared_written = False
+    for chunk in chunks():
+        pos = 0
+        for match in RE_TAG.finditer(chunk):
+            tag = match.group(0)
+            name = match.group(1).lower()
+            url = RE_URL_ATTR.search(tag)
+            url = url.group(2) if url else None
+            end = match.end()
+            out.write(chunk[pos : match.start()])
+
+            if name == "link" and url in runtime_files and 'rel="stylesheet"' in tag:
+                out.write(f"<style>\n{read(url)}\n</style>")
+            elif (
+                name == "script"
+                and url in runtime_files
+                and RE_SCRIPT_END.match(chunk, end)
+            ):
+                # A literal "</script>" would end the inline script early
+                code = re.sub(r"</(script)", r"<\\/\1", read(url), flags=re.IGNORECASE)
+                out.write(f"<script>\n{code}\n</script>")
+                end = RE_SCRIPT_END.match(chunk, end).end()
+            else:
+                write_tag(tag)
+            pos = end
+
+        body_end = chunk.rfind("</body>", pos) if shared and not shared_written else -1
+        if body_end == -1:
+            out.write(chunk[pos:])
+            continue
+        out.write(chunk[pos:body_end])
+        write_shared()
+        shared_written = True
+        out.write(chunk[body_end:])
+    if shared and not shared_written:
+        write_shared()
+
+
+def inline_runtime(document: str, runtime_files: Dict[str, str]) -> str:
+    """
+    Inline stylesheets and scripts that are part of the runtime files into the HTML document,
+    producing a single self-contained file. Other files referenced by the document are left untouched.
+
+    :param document: HTML document to process
+    :param runtime_files: Mapping from output relative path to source path, see list_runtime_files
+    :return: Document with runtime stylesheets and scripts embedded
+    """
+    out = io.StringIO()
+    write_inlined(document, runtime_files, out, inline_assets=False)
+    return out.getvalue()
+
+
+def path_redirector(
+    document_path: str,
+    resource_dir: str = ".",
+    stat_cache: Optional[StatCache] = None,
+) -> Callable[[str], str]:
+    """
+    Create a function redirecting all relative paths in (a chunk of) a document to absolute paths,
+    see redirect_paths. Paths are resolved once per distinct url.
+    Quoted strings never span lines, so documents can be processed in chunks cut at line breaks.
+
+    :param stat_cache: Cache of the paths probed, to share with later steps of the build
+    """
+    stat_cache = stat_cache or StatCache()
+
+    def is_absolute_url(url):
+        return bool(urlparse(url).netloc) or (
+            os.path.isabs(url) and stat_cache.exists(url)
+        )
+
+    def make_absolute(base, relative):
+        return os.path.abspath(os.path.normpath(os.path.join(base, relative)))
+
+    # Try different base paths to make the URL absolute
+    base_paths = [
+        os.path.dirname(document_path),
+        os.path.abspath(resource_dir),
+        os.path.join(os.path.dirname(document_path), resource_dir),
+    ]
+    resolved: Dict[str, str] = {}
+
+    def candidates(url) -> List[str]:
+        """Paths resolve probes for url, in order"""
+        if urlparse(url).netloc:
+            return []
+        paths = [url] if os.path.isabs(url) else []
+        return paths + [make_absolute(base, url) for base in base_paths]
+
+    def prefetch(urls):
+        # Probe the first candidate of every url at once, then the next of those not found...
+        # Paths are probed concurrently, but never more of them than resolve would
+        pending = [candidates(url) for url in urls]
+        while pending:
+            stat_cache.prefetch(paths[0] for paths in pending if paths)
+            pending = [
+                paths[1:]
+                for paths in pending
+                if paths and not stat_cache.exists(paths[0])
+            ]
+
+    def resolve(url):
+        if is_absolute_url(url):
+            return url
+
+        for base in base_paths:
+            absolute_url = make_absolute(base, url)
+            if stat_cache.exists(absolute_url) or is_absolute_url(absolute_url):
+                return absolute_url
+
+        return url
+
+    def replace_url(match):
+        url = match.group(1)
+        if not url:
+            return match.group(0)
+        if url not in resolved:
+            resolved[url] = resolve(url)
+        return match.group(0).replace(url, resolved[url])
+
+    # Regular expression to find markdown links
+    # Empty strings are matched too, or alt="" would pair its closing quote with the next opening one
+    url_pattern = re.compile(r'"([^"\n]*)"')
+
+    def redirect(document: str) -> str:
+        prefetch(
+            {
+                url
+                for url in url_pattern.findall(document)
+                if url and url not in resolved
+            }
+        )
+        # Substitute all URLs in the document using the replace_url function
+        return url_pattern.sub(replace_url, document)
+
+    return redirect
+
+
+def redirect_paths(
+    document: str,
+    document_path: str,
+    resource_dir: str = ".",
+    stat_cache: Optional[StatCache] = None,
+) -> str:
     """
     Redirect all relative paths in a document to absolute paths with some guessing.
     Following possible base paths will be tried:
@@ -34,49 +414,112 @@ def redirect_paths(document: str, document_path: str, resource_dir: str = ".") -
     :param document: Markdown document string
     :param document_path: Path to the document
     :param resource_dir: Optional resource path
+    :param stat_cache: Cache of the paths probed, to share with later steps of the build
     :return: Document string with all urls redirected.
     """
+    return path_redirector(document_path, resource_dir, stat_cache)(document)
 
-    def is_absolute_url(url):
-        return bool(urlparse(url).netloc) or (
-            os.path.isabs(url) and os.path.exists(url)
-        )
 
-    def make_absolute(base, relative):
-        return os.path.abspath(os.path.normpath(os.path.join(base, relative)))
+def asset_filename(path: str, path_stat: Optional[os.stat_result] = None) -> str:
+    """
+    Stable output name for an asset: a short hash of its location and version followed by the original name.
+    The same unchanged file always maps to the same name, a modified file gets a new one.
 
-    def replace_url(match):
-        url = match.group(1)
-        if is_absolute_url(url):
+    :param path: Path to an existing file
+    :param path_stat: Result of os.stat for path, if already known
+    :return: File name in the format hash_originalname.ext
+    """
+    path_stat = path_stat or os.stat(path)
+    key = f"{os.path.abspath(path)}:{path_stat.st_size}:{path_stat.st_mtime_ns}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+    return f"{digest}_{os.path.basename(path)}"
+
+
+# Attribute holding the url of each tag whose asset is copied to the output
+ASSET_ATTRS = {
+    "img": "src",
+    "link": "href",
+    "script": "src",
+    "a": "href",
+    "source": "srcset",
+}
+
+
+class AssetRewriter:
+    """
+    Rewrite URLs of local asset resources in HTML to target_dir/hash_originalname.ext, without copying.
+    Call it on a document, or on consecutive chunks of one that don't split tags (see safe_chunks).
+    """
+
+    def __init__(
+        self,
+        target_dir: str,
+        url_prefix: str = None,
+        stat_cache: Optional[StatCache] = None,
+    ):
+        """
+        :param target_dir: Target directory (or URL prefix) the assets are going to be served from
+        :param url_prefix: URL prefix written to the document instead of target_dir
+        :param stat_cache: Cache of the paths probed, usually shared with path_redirector
+        """
+        self.target_dir = target_dir
+        self.url_prefix = target_dir if url_prefix is None else url_prefix
+        self.stat_cache = stat_cache or StatCache()
+        # Mapping from original path to new URL, and from new path to original path
+        self.urls: Dict[str, str] = {}
+        self.mapping: Dict[str, str] = {}
+
+    def _replace_attr(self, match: re.Match) -> str:
+        original_path = match.group(2)
+
+        # Skip if it's an external URL or a non-file path
+        if urlparse(original_path).scheme or not self.stat_cache.isfile(original_path):
+            incr("assets_skipped")
             return match.group(0)
 
-        # Try different base paths to make the URL absolute
-        base_paths = [
-            os.path.dirname(document_path),
-            os.path.abspath(resource_dir),
-            os.path.join(os.path.dirname(document_path), resource_dir),
-        ]
+        if original_path not in self.urls:
+            new_filename = asset_filename(
+                original_path, self.stat_cache.stat(original_path)
+            )
+            self.urls[original_path] = Path(self.url_prefix, new_filename).as_posix()
+            self.mapping[os.path.join(self.target_dir, new_filename)] = original_path
+        return f'{match.group(1)}="{self.urls[original_path]}"'
 
-        for base in base_paths:
-            absolute_url = make_absolute(base, url)
-            if os.path.exists(absolute_url) or is_absolute_url(absolute_url):
-                return match.group(0).replace(url, absolute_url)
+    def _replace_tag(self, match: re.Match) -> str:
+        tag = match.group(0)
+        attr = ASSET_ATTRS.get(match.group(1).lower())
+        if attr is None:
+            return tag
+        return RE_URL_ATTR.sub(
+            lambda m: (
+                self._replace_attr(m) if m.group(1).lower() == attr else m.group(0)
+            ),
+            tag,
+        )
 
-        return match.group(0)
+    def __call__(self, chunk: str) -> str:
+        return RE_TAG.sub(self._replace_tag, chunk)
 
-    # Regular expression to find markdown links
-    # import ipdb; ipdb.set_trace(context=15)
-    url_pattern = re.compile(r'"(.+?)"')
 
-    # Substitute all URLs in the document using the replace_url function
-    redirected_document = url_pattern.sub(replace_url, document)
+def rewrite_assets(
+    document: str, target_dir: str, stat_cache: Optional[StatCache] = None
+) -> Tuple[str, Dict[str, str]]:
+    """
+    Update URLs of all local asset resources in an HTML document to target_dir/hash_originalname.ext, without copying.
 
-    return redirected_document
+    :param document: HTML document to process
+    :param target_dir: Target directory (or URL prefix) the assets are going to be served from
+    :param stat_cache: Cache of the paths probed, usually shared with redirect_paths
+    :return: Updated document and mapping from new path to original path
+    """
+    rewriter = AssetRewriter(target_dir, stat_cache=stat_cache)
+    document = rewriter(document)
+    return document, rewriter.mapping
 
 
 def copy_assets(document: str, target_dir: str) -> str:
     """
-    Copy all asset resources in an HTML document to target_dir, then update URLs to target_dir/uuid_originalname.ext
+    Copy all asset resources in an HTML document to target_dir, then update URLs to target_dir/hash_originalname.ext
 
     :param document: HTML document to process
     :param target_dir: Target directory
@@ -85,42 +528,73 @@ def copy_assets(document: str, target_dir: str) -> str:
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
 
-    soup = BeautifulSoup(document, "html.parser")
+    document, mapping = rewrite_assets(document, target_dir)
+    copy_files(mapping)
 
-    # Dictionary to store original path to new path mapping
-    path_mapping = {}
+    return document
 
-    # Tags and attributes to check for URLs
-    tag_attr_pairs = [
-        ("img", "src"),
-        ("link", "href"),
-        ("script", "src"),
-        ("a", "href"),
-    ]
 
-    for tag, attr in tag_attr_pairs:
-        for element in soup.find_all(tag):
-            if element.has_attr(attr):
-                original_path = element[attr]
+def _copy_file(new_path: str, original_path: str):
+    temporary = temporary_path(new_path)
+    shutil.copy2(original_path, temporary)
+    os.replace(temporary, new_path)
 
-                # Skip if it's an external URL or a non-file path
-                if urlparse(original_path).scheme or not os.path.isfile(original_path):
-                    continue
 
-                if original_path not in path_mapping:
-                    # Generate a new filename
-                    original_filename = os.path.basename(original_path)
-                    name, ext = os.path.splitext(original_filename)
-                    new_filename = f"{str(uuid.uuid4())[:8]}_{name}{ext}"
-                    new_path = os.path.join(target_dir, new_filename)
+def copy_files(mapping: Dict[str, str]):
+    """
+    Copy files from original path to new path, as returned by rewrite_assets.
+    Files are copied concurrently in io_pool.
+
+    :param mapping: Mapping from new path to original path
+    """
+    if len(mapping) < 2:
+        for new_path, original_path in mapping.items():
+            _copy_file(new_path, original_path)
+    else:
+        # Consuming the results raises the first error of the copies
+        for _ in io_pool().map(_copy_file, mapping.keys(), mapping.values()):
+            pass
+    # Counted here, build stats are not visible from the pool's threads
+    incr("assets_copied", len(mapping))
+
 
-                    # Copy the file
-                    shutil.copy2(original_path, new_path)
+# Size of the chunks produced by safe_chunks
+STREAM_CHUNK_SIZE = 1 << 16
 
-                    # Store the mapping
-                    path_mapping[original_path] = new_path
 
-                # Update the attribute with the new path
-                element[attr] = path_mapping[original_path]
+def _safe_cut(text: str) -> int:
+    """Position after the last line break of text that is outside of a tag, 0 if there is none"""
+    pos = text.rfind("\n")
+    while pos != -1:
+        tag_start = text.rfind("<", 0, pos)
+        if tag_start == -1 or text.find(">", tag_start, pos) != -1:
+            return pos + 1
+        pos = text.rfind("\n", 0, tag_start)
+    return 0
 
-    return str(soup)
+
+def safe_chunks(chunks: Iterable[str], size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Regroup a stream of HTML into chunks of about size characters, cut after line breaks outside of tags,
+    so that filters working on tags or quoted strings within a line can process each chunk on its own.
+    """
+    parts: List[str] = []
+    length = 0
+    threshold = size
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length < threshold:
+            continue
+        text = "".join(parts)
+        cut = _safe_cut(text)
+        if cut:
+            yield text[:cut]
+            text = text[cut:]
+        parts = [text]
+        length = len(text)
+        # Without a cut, wait for more text rather than searching the same text again
+        threshold = size if cut else length + size
+    text = "".join(parts)
+    if text:
+        yield text
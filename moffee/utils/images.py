@@ -0,0 +1,173 @@
+"""
+Optional image optimization: images larger than the slides are downscaled and recompressed,
+optionally with a WebP alternative. Requires Pillow (pip install moffee[images]).
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from moffee.utils.build_stats import incr
+from moffee.utils.cache import FileCache, cache_key
+from moffee.utils.manifest import hash_file
+
+# Pillow format used to save each optimizable extension, other images are left untouched
+FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".webp": "WEBP",
+}
+DEFAULT_SCALE = 2.0
+DEFAULT_QUALITY = 85
+MAX_WORKERS = 8
+
+RE_IMG = re.compile(r'<img\b[^>]*?\ssrc="([^"]*)"[^>]*>', re.IGNORECASE)
+
+image_cache = FileCache("images")
+
+
+@dataclass
+class OptimizedImage:
+    path: str
+    webp: Optional[str] = None
+
+
+def require_pillow():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "Image optimization requires Pillow, install it with: pip install moffee[images]"
+        ) from None
+
+
+def save(source: str, target: str, size: Tuple[int, int], format: str, quality: int):
+    """Save source to target in format, shrunk to fit in size"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # Rotate according to EXIF data, which is not kept
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        if format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(target, "JPEG", quality=quality, optimize=True, progressive=True)
+        elif format == "PNG":
+            image.save(target, "PNG", optimize=True)
+        else:
+            image.save(target, "WEBP", quality=quality, method=4)
+
+
+def optimize_image(
+    source: str,
+    size: Tuple[int, int],
+    quality: int = DEFAULT_QUALITY,
+    webp: bool = False,
+) -> Optional[OptimizedImage]:
+    """
+    Downscale and recompress one image, results are cached by source hash and target size.
+
+    :param size: Maximal width and height in pixels
+    :return: Optimized image, None if the original is already at least as good
+    """
+    from PIL import __version__ as pillow_version
+
+    name, ext = os.path.splitext(os.path.basename(source))
+    format = FORMATS[ext.lower()]
+    key = cache_key(pillow_version, hash_file(source), size, quality)
+
+    path = image_cache.get_or_create(
+        cache_key(key, format),
+        os.path.basename(source),
+        lambda target: save(source, target, size, format, quality),
+    )
+    original_size = os.path.getsize(source)
+    if os.path.getsize(path) >= original_size:
+        path = source
+
+    webp_path = None
+    if webp and format != "WEBP":
+        webp_path = image_cache.get_or_create(
+            cache_key(key, "WEBP"),
+            f"{name}.webp",
+            lambda target: save(source, target, size, "WEBP", quality),
+        )
+        if os.path.getsize(webp_path) >= os.path.getsize(path):
+            webp_path = None
+
+    if path == source and webp_path is None:
+        return None
+    incr("images_optimized")
+    incr("image_bytes_saved", original_size - os.path.getsize(path))
+    return OptimizedImage(path, webp_path)
+
+
+def optimize_images(
+    document: str,
+    slide_size: Tuple[int, int],
+    scale: float = DEFAULT_SCALE,
+    quality: int = DEFAULT_QUALITY,
+    webp: bool = False,
+) -> Tuple[str, Dict[str, str]]:
+    """
+    Replace local images in an HTML document with optimized copies, working in a thread pool.
+    With webp, images get a WebP alternative through a <picture> element.
+
+    :param document: HTML document with absolute image paths, see redirect_paths
+    :param slide_size: Slide width and height in CSS pixels
+    :param scale: Device pixels per CSS pixel to keep, e.g. 2 for high DPI screens
+    :param quality: JPEG and WebP quality
+    :return: Document referring to the optimized images, and mapping from optimized files to their source image
+    """
+    require_pillow()
+    size = (round(slide_size[0] * scale), round(slide_size[1] * scale))
+    sources = sorted(
+        {
+            src
+            for src in RE_IMG.findall(document)
+            if not urlparse(src).scheme
+            and os.path.splitext(src)[1].lower() in FORMATS
+            and os.path.isfile(src)
+        }
+    )
+    if not sources:
+        return document, {}
+
+    # Pillow releases the GIL while decoding, resizing and encoding
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(sources))) as pool:
+        # Tasks run in a copy of this context to account their work to the active build stats
+        futures = {
+            src: pool.submit(
+                copy_context().run, optimize_image, src, size, quality, webp
+            )
+            for src in sources
+        }
+        results: Dict[str, Optional[OptimizedImage]] = {
+            src: future.result() for src, future in futures.items()
+        }
+
+    originals = {}
+    for source, result in results.items():
+        if result is not None:
+            if result.path != source:
+                originals[result.path] = source
+            if result.webp:
+                originals[result.webp] = source
+
+    def replace(match):
+        tag = match.group(0)
+        result = results.get(match.group(1))
+        if result is None:
+            return tag
+        tag = tag.replace(f'src="{match.group(1)}"', f'src="{result.path}"', 1)
+        if result.webp:
+            tag = f'<picture><source srcset="{result.webp}" type="image/webp">{tag}</picture>'
+        return tag
+
+    return RE_IMG.sub(replace, document), originals
@@ -0,0 +1,130 @@
+"""
+Build manifest recording everything a build depends on, so unchanged decks can be skipped.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from moffee import __version__
+from moffee.utils.file_helper import temporary_path
+
+MANIFEST_NAME = ".moffee-manifest.json"
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_tree(directory: Optional[str]) -> Dict[str, str]:
+    """Hash of every file below directory, keyed by "/" separated relative path"""
+    hashes = {}
+    if not directory or not os.path.isdir(directory):
+        return hashes
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            hashes[Path(os.path.relpath(path, directory)).as_posix()] = hash_file(path)
+    return dict(sorted(hashes.items()))
+
+
+def build_inputs(
+    document: str,
+    document_path: str,
+    template_dir: str,
+    theme_dir: Optional[str] = None,
+    **options,
+) -> dict:
+    """
+    Everything a build depends on before its assets are known.
+
+    :param options: Additional build options affecting the output
+    """
+    return {
+        "moffee_version": __version__,
+        "document": {
+            "path": os.path.abspath(document_path),
+            "hash": hash_bytes(document.encode("utf-8")),
+        },
+        # Relative resource dirs are resolved against the working directory
+        "cwd": os.getcwd(),
+        "templates": hash_tree(template_dir),
+        "theme": hash_tree(theme_dir),
+        "options": options,
+    }
+
+
+def read_manifest(output_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(
+    output_dir: str, inputs: dict, assets: Dict[str, str], missing: List[str] = ()
+):
+    """
+    :param inputs: Result of build_inputs
+    :param assets: Mapping from output relative path to the source path of copied assets
+    :param missing: Paths probed while resolving the deck's urls that didn't exist, see StatCache.missing
+    """
+    manifest = dict(inputs)
+    manifest["assets"] = {}
+    for path, source in sorted(assets.items()):
+        source_stat = os.stat(source)
+        manifest["assets"][path] = {
+            "source": source,
+            "size": source_stat.st_size,
+            "mtime_ns": source_stat.st_mtime_ns,
+            "hash": hash_file(source),
+        }
+    manifest["missing"] = list(missing)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    temporary = temporary_path(path)
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary, path)
+
+
+def _is_unchanged(asset: dict) -> bool:
+    """Whether the source of an asset is unchanged, only hashed when its size or mtime changed"""
+    try:
+        source_stat = os.stat(asset["source"])
+        if source_stat.st_size == asset.get(
+            "size"
+        ) and source_stat.st_mtime_ns == asset.get("mtime_ns"):
+            return True
+        return hash_file(asset["source"]) == asset["hash"]
+    except OSError:
+        return False
+
+
+def is_up_to_date(output_dir: str, inputs: dict) -> bool:
+    """Whether output_dir holds a complete build of exactly these inputs and unchanged assets"""
+    manifest = read_manifest(output_dir)
+    if manifest is None:
+        return False
+    if any(manifest.get(key) != value for key, value in inputs.items()):
+        return False
+    if not os.path.isfile(os.path.join(output_dir, "index.html")):
+        return False
+    for path, asset in manifest.get("assets", {}).items():
+        # Paths are URLs, so ".." is resolved like browsers do, also when output_dir is a symlink
+        if not os.path.isfile(os.path.normpath(os.path.join(output_dir, path))):
+            return False
+        if not _is_unchanged(asset):
+            return False
+    # A file added where a url was looked up changes how it resolves
+    return not any(os.path.lexists(path) for path in manifest.get("missing", []))
@@ -0,0 +1,69 @@
+"""
+Caches syntax highlighting done by superfences and inlinehilite.
+
+Highlighted html is cached by a hash of the code, language and highlighter options,
+and Pygments lexers are looked up once per language and process.
+The extension must be registered before superfences and inlinehilite, which use
+the highlighter of the first highlight extension they find.
+"""
+
+import xml.etree.ElementTree as etree
+from typing import Dict, Tuple
+
+from pygments import __version__ as pygments_version
+from pymdownx.highlight import Highlight, HighlightExtension
+
+from moffee.utils.cache import Cache, cache_key
+
+highlight_cache = Cache("highlight", maxsize=4096)
+
+_lexers: Dict[Tuple[str, str], object] = {}
+
+
+class CachedHighlight(Highlight):
+    def __init__(self, md, **options):
+        super().__init__(md, **options)
+        self.options = options
+
+    def get_lexer(self, src, language, inline, stripnl):
+        # Guessed lexers depend on the source, everything else only on the language
+        if self.guess_lang:
+            return super().get_lexer(src, language, inline, stripnl)
+        key = cache_key(language, stripnl, self.get_extended_language(language or ""))
+        lexer = _lexers.get(key)
+        if lexer is None:
+            lexer = _lexers[key] = super().get_lexer(src, language, inline, stripnl)
+        return lexer
+
+    def highlight(self, src, language, *args, **kwargs):
+        if self.title_mode == "html":
+            # Titles are stored in the document's html stash, which cannot be cached
+            return super().highlight(src, language, *args, **kwargs)
+        if not (self.line_spans or self.line_anchors):
+            # Block counts only end up in line ids
+            kwargs.pop("code_block_count", None)
+        key = cache_key(pygments_version, self.options, src, language, args, kwargs)
+        inline = kwargs.get("inline", False)
+
+        if not inline:
+            return highlight_cache.get_or_compute(
+                key,
+                lambda: super(CachedHighlight, self).highlight(
+                    src, language, *args, **kwargs
+                ),
+            )
+
+        def compute():
+            el = super(CachedHighlight, self).highlight(src, language, *args, **kwargs)
+            return etree.tostring(el, encoding="unicode")
+
+        return etree.fromstring(highlight_cache.get_or_compute(key, compute))
+
+
+class CachedHighlightExtension(HighlightExtension):
+    def get_pymdownx_highlighter(self):
+        return CachedHighlight
+
+
+def makeExtension(**kwargs):
+    return CachedHighlightExtension(**kwargs)
@@ -0,0 +1,339 @@
+"""
+markdown-it-py backend producing the same html as moffee's Python-Markdown setup for the syntax moffee relies on:
+task lists, mark/insert/superscript (==, ^^, ^), delete/subscript (~~, ~), mermaid fences, highlighted code,
+admonitions (!!!), Obsidian callouts (> [!type]), wikilinks, bare links and heading ids.
+"""
+
+import re
+from functools import lru_cache
+from html import escape
+
+from markdown_it import MarkdownIt
+from markdown_it.rules_core import StateCore
+from markdown_it.rules_inline import StateInline
+from markdown_it.token import Token
+from mdit_py_plugins.admon import admon_plugin
+from mdit_py_plugins.deflist import deflist_plugin
+from mdit_py_plugins.footnote import footnote_plugin
+
+from markdown.extensions.toc import slugify, unique
+from pygments import __version__ as pygments_version, highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from moffee.utils.cache import cache_key
+from moffee.utils.md_highlight_ext import highlight_cache
+
+RE_CALLOUT = re.compile(r"\[!([\w\-]+)\] *(?: (.*?))? *$")
+RE_TASK = re.compile(r"\[([ xX])\] ")
+RE_WIKILINK = re.compile(r"\[\[([\w0-9_ -]+)\]\]")
+RE_MAGICLINK = re.compile(
+    r"(?<![\w/@.])(?:"
+    r"(?P<url>(?:https?|ftp)://[^\s<>\"']+?)"
+    r"|(?P<www>www\.[^\s<>\"']+?\.[^\s<>\"']+?)"
+    r"|(?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)"
+    r")(?=[.,:;!?)\]]*(?:\s|$))"
+)
+
+
+def _pair_rule(name: str, tag: str, marker: str, content: str):
+    """
+    Inline rule for markup enclosed in marker, e.g. ==mark==.
+    Content is tokenized again, so markup can nest.
+    """
+    pattern = re.compile(re.escape(marker) + content + re.escape(marker))
+
+    def rule(state: StateInline, silent: bool) -> bool:
+        start = state.pos
+        if not state.src.startswith(marker, start):
+            return False
+        # Leave doubled single-character markers (^^, ~~) to their own rules
+        if len(marker) == 1 and state.src.startswith(marker, start + 1):
+            return False
+        match = pattern.match(state.src, start, state.posMax)
+        if not match:
+            return False
+        if silent:
+            return True
+
+        old_max = state.posMax
+        state.pos = match.start(1)
+        state.posMax = match.end(1)
+        token = state.push(f"{name}_open", tag, 1)
+        token.markup = marker
+        state.md.inline.tokenize(state)
+        token = state.push(f"{name}_close", tag, -1)
+        token.markup = marker
+        state.pos = match.end()
+        state.posMax = old_max
+        return True
+
+    return rule
+
+
+def _wikilink_rule(state: StateInline, silent: bool) -> bool:
+    match = RE_WIKILINK.match(state.src, state.pos, state.posMax)
+    if not match:
+        return False
+    if not silent:
+        label = match.group(1).strip()
+        url = "/{}/".format(re.sub(r"([ ]+_)|(_[ ]+)|([ ]+)", "_", label))
+        token = state.push("link_open", "a", 1)
+        token.attrs = {"class": "wikilink", "href": url}
+        token = state.push("text", "", 0)
+        token.content = label
+        state.push("link_close", "a", -1)
+    state.pos = match.end()
+    return True
+
+
+def _obfuscate(text: str) -> str:
+    return "".join(f"&#{ord(c)};" for c in text)
+
+
+def _magiclink(state: StateCore):
+    """Turn bare urls and emails in text into links"""
+    for block in state.tokens:
+        if block.type != "inline" or not block.children:
+            continue
+        children = []
+        in_link = 0
+        for token in block.children:
+            if token.type == "link_open":
+                in_link += 1
+            elif token.type == "link_close":
+                in_link -= 1
+            if (
+                token.type != "text"
+                or in_link
+                or not RE_MAGICLINK.search(token.content)
+            ):
+                children.append(token)
+                continue
+
+            text = token.content
+            pos = 0
+            for match in RE_MAGICLINK.finditer(text):
+                if match.start() > pos:
+                    children.append(_text_token(text[pos : match.start()]))
+                if match.group("email"):
+                    # Python-Markdown's magiclink obfuscates emails with html entities
+                    html = _obfuscate(match.group(0))
+                    link = Token("html_inline", "", 0)
+                    link.content = f'<a href="{_obfuscate("mailto:")}{html}">{html}</a>'
+                    children.append(link)
+                else:
+                    url = match.group(0)
+                    href = url if match.group("url") else f"http://{url}"
+                    link_open = Token("link_open", "a", 1)
+                    link_open.attrs = {"href": href}
+                    children.extend(
+                        [link_open, _text_token(url), Token("link_close", "a", -1)]
+                    )
+                pos = match.end()
+            if pos < len(text):
+                children.append(_text_token(text[pos:]))
+        block.children = children
+
+
+def _text_token(content: str) -> Token:
+    token = Token("text", "", 0)
+    token.content = content
+    return token
+
+
+def _task_lists(state: StateCore):
+    tokens = state.tokens
+    for i, token in enumerate(tokens):
+        if token.type != "inline" or i < 2 or tokens[i - 2].type != "list_item_open":
+            continue
+        match = RE_TASK.match(token.content)
+        if not match or not token.children or token.children[0].type != "text":
+            continue
+
+        tokens[i - 2].attrSet("class", "task-list-item")
+        # Find the enclosing list
+        level = tokens[i - 2].level - 1
+        for j in range(i - 3, -1, -1):
+            if tokens[j].level == level and tokens[j].type in (
+                "bullet_list_open",
+                "ordered_list_open",
+            ):
+                tokens[j].attrSet("class", "task-list")
+                break
+
+        checked = " checked" if match.group(1) in "xX" else ""
+        checkbox = Token("html_inline", "", 0)
+        checkbox.content = f'<input type="checkbox" disabled{checked}/>'
+        first = token.children[0]
+        first.content = " " + first.content[len(match.group(0)) :]
+        token.children.insert(0, checkbox)
+
+
+def _callouts(state: StateCore):
+    """Turn Obsidian callouts (blockquotes starting with [!type]) into admonitions"""
+    tokens = state.tokens
+    converted = []
+    result = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.type == "blockquote_open":
+            match = None
+            if (
+                i + 2 < len(tokens)
+                and tokens[i + 1].type == "paragraph_open"
+                and tokens[i + 2].type == "inline"
+            ):
+                first_line = tokens[i + 2].content.split("\n", 1)[0]
+                match = RE_CALLOUT.match(first_line)
+            converted.append(bool(match))
+            if not match:
+                result.append(token)
+                i += 1
+                continue
+
+            klass = re.sub("  +", " ", match.group(1).lower())
+            title = match.group(2)
+            if title is None:
+                title = klass.split(" ", 1)[0].capitalize()
+            elif title == "":
+                title = None
+            html = f'<div class="admonition {escape(klass)}">\n'
+            if title:
+                html += (
+                    f'<p class="admonition-title">{escape(title, quote=False)}</p>\n'
+                )
+            opening = Token("html_block", "", 0)
+            opening.content = html
+            result.append(opening)
+
+            inline = tokens[i + 2]
+            rest = inline.content.split("\n", 1)[1] if "\n" in inline.content else ""
+            if rest:
+                # Drop the first line from the paragraph
+                children = inline.children or []
+                for k, child in enumerate(children):
+                    if child.type in ("softbreak", "hardbreak"):
+                        inline.children = children[k + 1 :]
+                        break
+                inline.content = rest
+                i += 1
+            else:
+                # The paragraph was the callout line only
+                i += 4
+            continue
+
+        if token.type == "blockquote_close" and converted:
+            if converted.pop():
+                closing = Token("html_block", "", 0)
+                closing.content = "</div>\n"
+                result.append(closing)
+                i += 1
+                continue
+        result.append(token)
+        i += 1
+    state.tokens = result
+
+
+def _heading_ids(state: StateCore):
+    """Add the same heading ids as Python-Markdown's toc extension"""
+    ids = set()
+    tokens = state.tokens
+    for i, token in enumerate(tokens):
+        if token.type != "heading_open":
+            continue
+        text = "".join(
+            child.content
+            for child in tokens[i + 1].children or []
+            if child.type in ("text", "code_inline")
+        )
+        token.attrSet("id", unique(slugify(text, "-"), ids))
+
+
+@lru_cache(maxsize=None)
+def _get_lexer(lang: str):
+    """Lexer for lang, None if Pygments doesn't know it"""
+    try:
+        return get_lexer_by_name(lang)
+    except ClassNotFound:
+        return None
+
+
+def _highlight(code: str, lang: str, **formatter_options) -> str:
+    key = cache_key("markdown-it", pygments_version, code, lang, formatter_options)
+    return highlight_cache.get_or_compute(
+        key,
+        lambda: highlight(code, _get_lexer(lang), HtmlFormatter(**formatter_options)),
+    )
+
+
+def _render_fence(self, tokens, idx, options, env):
+    token = tokens[idx]
+    lang = token.info.strip().split(" ", 1)[0] if token.info else ""
+    code = token.content
+    if lang == "mermaid":
+        return (
+            f'<div class="mermaid">{escape(code.rstrip(chr(10)), quote=False)}</div>\n'
+        )
+    if _get_lexer(lang or "text") is None:
+        lang = "text"
+    return _highlight(code, lang or "text", cssclass="highlight", wrapcode=True)
+
+
+def _render_code_inline(self, tokens, idx, options, env):
+    code = tokens[idx].content
+    match = re.match(r"#!([\w+#.-]+) (.*)$", code, re.S)
+    if match and _get_lexer(match.group(1)) is not None:
+        html = _highlight(match.group(2), match.group(1), nowrap=True)
+        return f'<code class="highlight">{html.rstrip(chr(10))}</code>'
+    return f"<code>{escape(code, quote=False)}</code>"
+
+
+def _render_image(self, tokens, idx, options, env):
+    # Same attribute order and raw alt text as Python-Markdown
+    token = tokens[idx]
+    attrs = dict(token.attrs)
+    attrs["alt"] = token.content
+    rendered = " ".join(
+        f'{name}="{escape(str(value))}"' for name, value in sorted(attrs.items())
+    )
+    return f"<img {rendered} />"
+
+
+def make_markdown_it() -> MarkdownIt:
+    """Build a markdown-it parser with moffee's syntax enabled"""
+    md = (
+        MarkdownIt("commonmark", {"breaks": True, "html": True})
+        .enable(["table", "strikethrough"])
+        .use(admon_plugin)
+        .use(footnote_plugin)
+        .use(deflist_plugin)
+    )
+
+    md.inline.ruler.before("emphasis", "wikilink", _wikilink_rule)
+    md.inline.ruler.before(
+        "emphasis", "mark", _pair_rule("mark", "mark", "==", r"(?=\S)(.+?)(?<=\S)")
+    )
+    md.inline.ruler.before(
+        "emphasis", "ins", _pair_rule("ins", "ins", "^^", r"(?=\S)(.+?)(?<=\S)")
+    )
+    md.inline.ruler.before(
+        "emphasis", "sup", _pair_rule("sup", "sup", "^", r"([^\s^]+)")
+    )
+    md.inline.ruler.before(
+        "strikethrough", "sub", _pair_rule("sub", "sub", "~", r"([^\s~]+)")
+    )
+
+    md.core.ruler.push("task_lists", _task_lists)
+    md.core.ruler.push("callouts", _callouts)
+    md.core.ruler.push("magiclink", _magiclink)
+    md.core.ruler.push("heading_ids", _heading_ids)
+
+    md.add_render_rule("fence", _render_fence)
+    md.add_render_rule("code_inline", _render_code_inline)
+    md.add_render_rule("image", _render_image)
+    md.add_render_rule("s_open", lambda self, tokens, idx, options, env: "<del>")
+    md.add_render_rule("s_close", lambda self, tokens, idx, options, env: "</del>")
+    return md
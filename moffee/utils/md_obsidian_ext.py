@@ -28,6 +28,12 @@ class ObsidianProcessor(BlockProcessor):
     CLASSNAME_TITLE = "admonition-title"
     RE = re.compile(r"(?:^|\n)> \[!([\w\-]+)\] *(?: (.*?))? *(?:\n|$)")
     RE_SPACES = re.compile("  +")
+    # Leading run of lines that are quoted or blank
+    RE_QUOTED = re.compile(
+        r"(?:>[^\n]*|[^\S\n]*(?=\n|\Z))(?:\n(?:>[^\n]*|[^\S\n]*(?=\n|\Z)))*"
+    )
+    # Anchored on the newline rather than ^ in multiline mode, which is much faster to search
+    RE_UNQUOTE = re.compile(r"\n(?:> ?|[^\S\n]+(?=\n|\Z))")
 
     def __init__(self, parser: blockparser.BlockParser):
         """Initialization."""
@@ -36,53 +42,80 @@ class ObsidianProcessor(BlockProcessor):
 
         self.current_sibling: etree.Element | None = None
         self.content_indent = 0
+        # Match found by the last test, reused by run
+        self._last: tuple[str, re.Match[str] | None] = ("", None)
 
     def test(self, parent: etree.Element, block: str) -> bool:
+        # Cheap substring check first, most blocks are not callouts
+        if "[!" not in block:
+            return False
+        m = self.RE.search(block)
+        self._last = (block, m)
+        return m is not None
 
+    def match(self, block: str) -> re.Match[str] | None:
+        last_block, m = self._last
+        if last_block is block:
+            return m
         return self.RE.search(block)
 
     def dequote(self, text: str) -> tuple[str, str]:
         """Remove a quote mark (>) from the front of each line of the given text."""
-        newtext = []
-        lines = text.split("\n")
-        for line in lines:
-            if line.startswith("> "):
-                newtext.append(line[2:])
-            elif line.startswith(">"):
-                newtext.append(line[1:])
-            elif not line.strip():
-                newtext.append("")
-            else:
-                break
-        return "\n".join(newtext), "\n".join(lines[len(newtext) :])
+        m = self.RE_QUOTED.match(text)
+        if not m:
+            return "", text
+        end = m.end()
+        return self.RE_UNQUOTE.sub("\n", "\n" + text[:end])[1:], text[end + 1 :]
+
+    def blocked(self, parent: etree.Element, block: str) -> bool:
+        """Whether a processor running before this one would take the block"""
+        for processor in self.parser.blockprocessors:
+            if processor is self:
+                return False
+            if processor.test(parent, block):
+                return True
+        return True
 
     def run(self, parent: etree.Element, blocks: list[str]) -> None:
         block = blocks.pop(0)
-        m = self.RE.search(block)
+        m = self.match(block)
 
         if not m:
             raise ValueError()
 
         if m.start() > 0:
             self.parser.parseBlocks(parent, [block[: m.start()]])
-        block = block[m.end() :]  # removes the first line
-        block, theRest = self.dequote(block)
-
-        klass, title = self.get_class_and_title(m)
-        div = etree.SubElement(parent, "div")
-        div.set("class", "{} {}".format(self.CLASSNAME, klass))
-        if title:
-            p = etree.SubElement(div, "p")
-            p.text = title
-            p.set("class", self.CLASSNAME_TITLE)
-
-        self.parser.parseChunk(div, block)
-
-        if theRest:
-            # This block contained unindented line(s) after the first indented
-            # line. Insert these lines as the first block of the master blocks
-            # list for future processing.
-            blocks.insert(0, theRest)
+
+        # Callouts directly nested in the first line of another callout are handled
+        # in this loop rather than by recursing through the parser for every level.
+        pending = []
+        while True:
+            block, theRest = self.dequote(block[m.end() :])  # removes the first line
+            if theRest:
+                # This block contained unindented line(s) after the first indented
+                # line. Insert these lines as the first block of the master blocks
+                # list for future processing.
+                blocks.insert(0, theRest)
+
+            klass, title = self.get_class_and_title(m)
+            div = etree.SubElement(parent, "div")
+            div.set("class", "{} {}".format(self.CLASSNAME, klass))
+            if title:
+                p = etree.SubElement(div, "p")
+                p.text = title
+                p.set("class", self.CLASSNAME_TITLE)
+
+            blocks = block.split("\n\n")
+            m = self.RE.match(blocks[0])
+            if not m or self.blocked(div, blocks[0]):
+                self.parser.parseBlocks(div, blocks)
+                break
+            pending.append((div, blocks))
+            parent = div
+            block = blocks.pop(0)
+
+        for div, blocks in reversed(pending):
+            self.parser.parseBlocks(div, blocks)
 
     def get_class_and_title(self, match: re.Match[str]) -> tuple[str, str | None]:
         klass, title = match.group(1).lower(), match.group(2)
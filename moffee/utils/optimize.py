@@ -0,0 +1,610 @@
+"""
+Output optimization for static hosting: minification of html, css and js, pruning of unused css,
+content hashed file names and precompressed .gz (and .br, when brotli is installed) files.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from moffee.utils.build_stats import incr
+from moffee.utils.file_helper import temporary_path
+from moffee.utils.manifest import MANIFEST_NAME
+
+# Elements whose content is written as is
+PRESERVED_TAGS = {"pre", "textarea", "script", "style", "code"}
+# Elements containing text that is not html, and may contain "<"
+RAW_TEXT_TAGS = {"script", "style"}
+COMPRESSIBLE = {".html", ".css", ".js", ".mjs", ".json", ".svg", ".txt", ".xml"}
+MIN_COMPRESS_SIZE = 256
+
+RE_TAG_NAME = re.compile(r"<(/?)([a-zA-Z][\w-]*)")
+RE_TAG_PARTS = re.compile(r"\"[^\"]*\"|'[^']*'|\s+|[^\s\"']+")
+RE_SPACE = re.compile(r"\s+")
+RE_MERMAID = re.compile(r"""\bclass=["'][^"']*\bmermaid\b""")
+# Unquoted url() values are tokens of their own, they may contain characters minified elsewhere
+RE_CSS_TOKEN = re.compile(
+    r"\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|url\([^\"')\s]*\)|/\*.*?\*/|\s+|[^\"'/\s]+|/",
+    re.S | re.I,
+)
+RE_CSS_PUNCT = re.compile(r"\s*([{};,>])\s*")
+RE_IDENT = re.compile(r"[\w$]")
+RE_CLASS_ATTR = re.compile(r"""\bclass=(?:"([^"]*)"|'([^']*)')""")
+RE_ID_ATTR = re.compile(r"""\bid=(?:"([^"]*)"|'([^']*)')""")
+RE_JS_STRING = re.compile(r"""["'`]([\w -]+)["'`]""")
+RE_SELECTOR_PART = re.compile(r"([.#]?)(-?[_a-zA-Z][\w-]*)")
+RE_PSEUDO = re.compile(r"::?[\w-]+")
+
+# Selectors always kept by prune_css: classes set at runtime by main.js
+CSS_SAFELIST = {".presentation-mode", ".active"}
+# Prefixes of elements whose content is rendered in the browser (mermaid diagrams, MathJax):
+# selectors mentioning them are kept whenever the container itself is in the document
+RUNTIME_CONTAINERS = (".mermaid", "mjx-")
+
+
+def _collapse(match: re.Match) -> str:
+    return "\n" if "\n" in match.group(0) else " "
+
+
+class HtmlMinifier:
+    """
+    Incremental html minifier: collapses whitespace between and within tags and drops comments.
+    Content of <pre>, <code>, <textarea>, <script>, <style> and mermaid diagrams is left untouched,
+    except that stylesheets are minified.
+
+    Feed text in chunks of any size, and call close() at the end.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        # Name and nesting depth of the element whose content is preserved
+        self.preserved: Optional[str] = None
+        self.depth = 0
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        return self._process(final=False)
+
+    def close(self) -> str:
+        return self._process(final=True)
+
+    def _process(self, final: bool) -> str:
+        buffer = self.buffer
+        out: List[str] = []
+        pos = 0
+        while pos < len(buffer):
+            if self.preserved in RAW_TEXT_TAGS:
+                match = re.compile(f"</{self.preserved}", re.IGNORECASE).search(
+                    buffer, pos
+                )
+                if match is None and not final:
+                    break
+                end = len(buffer) if match is None else match.start()
+                content = buffer[pos:end]
+                out.append(
+                    minify_css(content) if self.preserved == "style" else content
+                )
+                self.preserved = None
+                self.depth = 0
+                pos = end
+                continue
+
+            if buffer.startswith("<!--", pos):
+                end = buffer.find("-->", pos + 4)
+                if end == -1 and not final:
+                    break
+                end = len(buffer) if end == -1 else end + 3
+                if self.preserved:
+                    out.append(buffer[pos:end])
+                pos = end
+                continue
+
+            if buffer[pos] == "<":
+                end = buffer.find(">", pos)
+                if end == -1 and not final:
+                    break
+                end = len(buffer) if end == -1 else end + 1
+                out.append(self._tag(buffer[pos:end]))
+                pos = end
+                continue
+
+            end = buffer.find("<", pos)
+            if end == -1:
+                if not final:
+                    # Whitespace may continue in the next chunk
+                    break
+                end = len(buffer)
+            text = buffer[pos:end]
+            out.append(text if self.preserved else RE_SPACE.sub(_collapse, text))
+            pos = end
+
+        self.buffer = buffer[pos:]
+        return "".join(out)
+
+    def _tag(self, tag: str) -> str:
+        match = RE_TAG_NAME.match(tag)
+        if not match:
+            return tag
+        closing, name = match.group(1), match.group(2).lower()
+        if self.preserved:
+            if name == self.preserved:
+                self.depth += -1 if closing else 1
+                if self.depth == 0:
+                    self.preserved = None
+            return tag
+        if not closing and not tag.endswith("/>"):
+            if name in PRESERVED_TAGS or RE_MERMAID.search(tag):
+                self.preserved = name
+                self.depth = 1
+        # Collapse whitespace outside of attribute values
+        return "".join(
+            " " if part[0].isspace() else part for part in RE_TAG_PARTS.findall(tag)
+        )
+
+
+def minify_html(chunks: Iterable[str]) -> Iterator[str]:
+    """Minify html given as chunks of text, yielding minified chunks"""
+    minifier = HtmlMinifier()
+    for chunk in chunks:
+        out = minifier.feed(chunk)
+        if out:
+            yield out
+    out = minifier.close()
+    if out:
+        yield out
+
+
+def minify_css(css: str) -> str:
+    """Remove comments and unneeded whitespace from a stylesheet, strings and url() values are kept as they are"""
+    out = []
+    for token in RE_CSS_TOKEN.findall(css):
+        if token.startswith("/*"):
+            continue
+        if token[0] in "\"'" or token[:4].lower() == "url(":
+            # Keep strings out of the punctuation pass below
+            out.append(("string", token))
+        elif token.isspace():
+            out.append(("text", " "))
+        else:
+            out.append(("text", token))
+
+    result = []
+    text = []
+    for kind, token in out + [("string", "")]:
+        if kind == "text":
+            text.append(token)
+            continue
+        result.append(RE_CSS_PUNCT.sub(r"\1", "".join(text)).replace(";}", "}"))
+        result.append(token)
+        text = []
+    return "".join(result).strip()
+
+
+def used_selectors(document: str, scripts: Iterable[str] = ()) -> Set[str]:
+    """
+    Classes (as ".name"), ids (as "#name") and tag names used in a document.
+    Words in string literals of scripts count as classes and ids too, as scripts may add them at runtime.
+    """
+    used = {tag.lower() for _, tag in RE_TAG_NAME.findall(document)}
+    for match in RE_CLASS_ATTR.finditer(document):
+        used.update(
+            "." + name for name in (match.group(1) or match.group(2) or "").split()
+        )
+    for match in RE_ID_ATTR.finditer(document):
+        used.add("#" + (match.group(1) or match.group(2) or ""))
+    for script in scripts:
+        for match in RE_JS_STRING.finditer(script):
+            for word in match.group(1).split():
+                used.update(("." + word, "#" + word))
+    return used
+
+
+def _strip_brackets(selector: str) -> str:
+    """Drop attribute selectors and pseudo-class arguments, e.g. a[href]:not(.b) -> a:not"""
+    out = []
+    depth = 0
+    for char in selector:
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif depth == 0:
+            out.append(char)
+    return "".join(out)
+
+
+def selector_used(selector: str, used: Set[str]) -> bool:
+    """
+    Whether a selector may match an element of a document, given its used_selectors.
+    Only the presence of each class, id and tag is checked, not the structure.
+    """
+    if "\\" in selector:
+        # Escaped names are rare, keep them rather than unescaping
+        return True
+    parts = RE_SELECTOR_PART.findall(RE_PSEUDO.sub("", _strip_brackets(selector)))
+    names = [prefix + (name if prefix else name.lower()) for prefix, name in parts]
+    for container in RUNTIME_CONTAINERS:
+        if any(name.startswith(container) for name in names):
+            if container.startswith("."):
+                return container in used
+            return True
+    if any(name in CSS_SAFELIST for name in names):
+        return True
+    return all(name in used for name in names)
+
+
+def _split_selectors(prelude: str) -> List[str]:
+    """Split a selector list at top-level commas"""
+    selectors = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(prelude):
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+    selectors.append(prelude[start:])
+    return [selector.strip() for selector in selectors if selector.strip()]
+
+
+def _css_blocks(css: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Split a stylesheet without comments into (prelude, block content) rules
+    and (statement, None) at-rules like @import
+    """
+    pos = 0
+    start = 0
+    depth = 0
+    prelude = ""
+    length = len(css)
+    while pos < length:
+        char = css[pos]
+        if char in "\"'":
+            end = pos + 1
+            while end < length and css[end] != char:
+                end += 2 if css[end] == "\\" else 1
+            pos = end + 1
+            continue
+        if char == "{":
+            if depth == 0:
+                prelude = css[start:pos]
+                start = pos + 1
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                yield prelude.strip(), css[start:pos]
+                start = pos + 1
+        elif char == ";" and depth == 0:
+            if css[start:pos].strip():
+                yield css[start:pos].strip(), None
+            start = pos + 1
+        pos += 1
+    if css[start:].strip() and depth == 0:
+        yield css[start:].strip(), None
+
+
+def prune_css(css: str, used: Set[str]) -> str:
+    """
+    Remove the selectors of css that match nothing in a document, and the rules left without selectors.
+    Conditional group rules (@media, @supports) are pruned recursively, other at-rules are kept.
+
+    :param used: Classes, ids and tags of the document, see used_selectors
+    """
+    css = "".join(
+        token for token in RE_CSS_TOKEN.findall(css) if not token.startswith("/*")
+    )
+    out = []
+    for prelude, block in _css_blocks(css):
+        if block is None:
+            out.append(f"{prelude};")
+        elif prelude.startswith("@"):
+            if prelude.split(None, 1)[0].lower() in (
+                "@media",
+                "@supports",
+                "@container",
+                "@layer",
+            ):
+                block = prune_css(block, used)
+                if not block:
+                    continue
+            out.append(f"{prelude} {{{block}}}")
+        else:
+            selectors = _split_selectors(prelude)
+            kept = [selector for selector in selectors if selector_used(selector, used)]
+            incr("css_selectors_pruned", len(selectors) - len(kept))
+            if kept:
+                out.append(f"{', '.join(kept)} {{{block}}}")
+    return "\n".join(out)
+
+
+def _js_tokens(js: str) -> Iterator[str]:
+    """Split javascript into strings, template literals, regex literals, comments, whitespace and code"""
+    pos = 0
+    length = len(js)
+    # Whether a "/" at this point starts a regex literal rather than a division
+    regex_allowed = True
+    while pos < length:
+        char = js[pos]
+        if char in "\"'":
+            end = pos + 1
+            while end < length and js[end] != char and js[end] != "\n":
+                end += 2 if js[end] == "\\" else 1
+            yield js[pos : end + 1]
+            pos = end + 1
+            regex_allowed = False
+        elif char == "`":
+            end = pos + 1
+            depth = 0
+            while end < length and not (js[end] == "`" and depth == 0):
+                if js[end] == "\\":
+                    end += 1
+                elif js.startswith("${", end):
+                    depth += 1
+                elif js[end] == "}" and depth:
+                    depth -= 1
+                end += 1
+            yield js[pos : end + 1]
+            pos = end + 1
+            regex_allowed = False
+        elif js.startswith("//", pos):
+            end = js.find("\n", pos)
+            end = length if end == -1 else end
+            yield js[pos:end]
+            pos = end
+        elif js.startswith("/*", pos):
+            end = js.find("*/", pos + 2)
+            end = length if end == -1 else end + 2
+            yield js[pos:end]
+            pos = end
+        elif char == "/" and regex_allowed:
+            end = pos + 1
+            in_class = False
+            while end < length and js[end] != "\n":
+                if js[end] == "\\":
+                    end += 1
+                elif js[end] == "[":
+                    in_class = True
+                elif js[end] == "]":
+                    in_class = False
+                elif js[end] == "/" and not in_class:
+                    break
+                end += 1
+            end += 1
+            while end < length and RE_IDENT.match(js[end]):
+                end += 1
+            yield js[pos:end]
+            pos = end
+            regex_allowed = False
+        elif char.isspace():
+            end = pos
+            while end < length and js[end].isspace():
+                end += 1
+            yield js[pos:end]
+            pos = end
+        elif RE_IDENT.match(char):
+            end = pos
+            while end < length and RE_IDENT.match(js[end]):
+                end += 1
+            word = js[pos:end]
+            yield word
+            pos = end
+            regex_allowed = word in (
+                "return",
+                "typeof",
+                "case",
+                "do",
+                "else",
+                "in",
+                "of",
+            )
+        else:
+            yield char
+            pos += 1
+            regex_allowed = char not in ")]}"
+
+
+def minify_js(js: str) -> str:
+    """
+    Conservative javascript minifier: removes comments, indentation and blank lines.
+    Line breaks are kept so automatic semicolon insertion behaves the same.
+    """
+    out: List[str] = []
+    pending = ""
+    for token in _js_tokens(js):
+        if token.startswith("//") or token.startswith("/*"):
+            # A block comment spanning lines still separates statements
+            if token.startswith("/*") and "\n" in token:
+                pending = "\n"
+            elif not pending:
+                pending = " "
+            continue
+        if token.isspace():
+            if "\n" in token:
+                pending = "\n"
+            elif not pending:
+                pending = " "
+            continue
+        if pending and out:
+            previous = out[-1][-1]
+            if pending == "\n":
+                out.append("\n")
+            elif (RE_IDENT.match(previous) and RE_IDENT.match(token[0])) or (
+                previous in "+-" and token[0] == previous
+            ):
+                out.append(" ")
+        pending = ""
+        out.append(token)
+    return "".join(out)
+
+
+def content_hashed_name(path: str, content: bytes) -> str:
+    """Insert a hash of content into the file name, e.g. css/styles.css -> css/styles.0123456789.css"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:10]}{ext}"
+
+
+def optimize_static_files(
+    output_dir: str, used: Set[str], runtime_files: Iterable[str]
+) -> Dict[str, str]:
+    """
+    Minify the runtime stylesheets and scripts in output_dir and give them content hashed names.
+    Stylesheets lose the selectors matching nothing in the document, see prune_css.
+
+    :param output_dir: Output directory of a build
+    :param used: Classes, ids and tags of the document, see used_selectors
+    :param runtime_files: Output relative paths of the runtime files, see list_runtime_files
+    :return: Mapping from the original to the new path of each file, see reference_renamer
+    """
+    runtime_files = [
+        rel_path
+        for rel_path in runtime_files
+        if os.path.isfile(os.path.join(output_dir, rel_path))
+    ]
+    scripts = []
+    for rel_path in runtime_files:
+        if rel_path.lower().endswith(".js"):
+            with open(os.path.join(output_dir, rel_path), encoding="utf-8") as f:
+                scripts.append(f.read())
+    used = used | used_selectors("", scripts)
+
+    renamed: Dict[str, str] = {}
+    for rel_path in runtime_files:
+        path = os.path.join(output_dir, rel_path)
+        ext = os.path.splitext(rel_path)[1].lower()
+        if ext in (".css", ".js"):
+            with open(path, encoding="utf-8") as f:
+                source = f.read()
+            if ext == ".css":
+                minified = minify_css(prune_css(source, used))
+            else:
+                minified = minify_js(source)
+            incr("bytes_minified", len(source) - len(minified))
+            data = minified.encode("utf-8")
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+        new_path = content_hashed_name(rel_path, data)
+        with open(os.path.join(output_dir, new_path), "wb") as f:
+            f.write(data)
+        os.unlink(path)
+        renamed[rel_path] = new_path
+    return renamed
+
+
+def write_shared_runtime(
+    runtime_dir: str, runtime_files: Dict[str, str], minify: bool = False
+) -> Dict[str, str]:
+    """
+    Write runtime files to runtime_dir under content hashed names, for several decks to share.
+    Files already there are kept, so builds from the same templates refer to the same files.
+
+    :param runtime_files: Mapping from output relative path to source path, see list_runtime_files
+    :param minify: Minify stylesheets and scripts, without pruning as every deck uses them
+    :return: Mapping from the output relative path to the path in runtime_dir of each file
+    """
+    renamed: Dict[str, str] = {}
+    for rel_path, source in runtime_files.items():
+        ext = os.path.splitext(rel_path)[1].lower()
+        if minify and ext in (".css", ".js"):
+            with open(source, encoding="utf-8") as f:
+                text = f.read()
+            minified = minify_css(text) if ext == ".css" else minify_js(text)
+            incr("bytes_minified", len(text) - len(minified))
+            data = minified.encode("utf-8")
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        new_path = content_hashed_name(rel_path, data)
+        target = os.path.join(runtime_dir, new_path)
+        if os.path.isfile(target):
+            incr("runtime_hits")
+        else:
+            incr("runtime_misses")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temporary = temporary_path(target)
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, target)
+        renamed[rel_path] = new_path
+    return renamed
+
+
+def reference_renamer(renamed: Dict[str, str]) -> Callable[[str], str]:
+    """Create a function updating references to renamed files in (a chunk of) an HTML document"""
+    if not renamed:
+        return lambda document: document
+    pattern = re.compile(
+        r'\b(href|src)="(' + "|".join(re.escape(path) for path in renamed) + ')"'
+    )
+    return lambda document: pattern.sub(
+        lambda m: f'{m.group(1)}="{renamed[m.group(2)]}"', document
+    )
+
+
+def _is_current(path: str, variant: str) -> bool:
+    """Whether variant was compressed from the current content of path, see precompress"""
+    try:
+        return os.stat(variant).st_mtime_ns == os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def precompress(output_dir: str):
+    """
+    Write .gz, and .br when brotli is installed, next to every compressible file in output_dir.
+
+    Decks nested in output_dir, e.g. in a site, are left to their own build. Files compressed
+    already are skipped unless they changed since, and compressed copies that no longer save
+    space are removed, so none is ever stale.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    suffixes = [".gz", ".br"] if brotli is not None else [".gz"]
+
+    for root, dirs, names in os.walk(output_dir):
+        # Nested decks have a manifest of their own
+        dirs[:] = [
+            name
+            for name in dirs
+            if not os.path.isfile(os.path.join(root, name, MANIFEST_NAME))
+        ]
+        for name in names:
+            # The manifest is build metadata, not something to serve
+            if (
+                os.path.splitext(name)[1].lower() not in COMPRESSIBLE
+                or name == MANIFEST_NAME
+            ):
+                continue
+            path = os.path.join(root, name)
+            if all(_is_current(path, path + suffix) for suffix in suffixes):
+                continue
+            mtime = os.stat(path).st_mtime_ns
+            with open(path, "rb") as f:
+                data = f.read()
+            for suffix in suffixes:
+                if len(data) < MIN_COMPRESS_SIZE:
+                    compressed = None
+                elif suffix == ".gz":
+                    # mtime=0 keeps the output reproducible
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                else:
+                    compressed = brotli.compress(data)
+                variant = path + suffix
+                if compressed is not None and len(compressed) < len(data):
+                    temporary = temporary_path(variant)
+                    with open(temporary, "wb") as f:
+                        f.write(compressed)
+                    # Compressed copies have the mtime of their original, to tell when it changes
+                    os.utime(temporary, ns=(mtime, mtime))
+                    os.replace(temporary, variant)
+                    incr("files_precompressed")
+                elif os.path.lexists(variant):
+                    os.unlink(variant)
@@ -0,0 +1,248 @@
+"""
+Atomic replacement of build output directories.
+
+A build is written to a staging directory next to the output, in .<output name>.moffee. The output is
+a symlink to the current generation, and is switched to the new one with a single rename, so servers
+never see a partial deck. Files only present in the previous generation are carried over for a grace
+period, so browsers still get them while loading the previous deck. Concurrent builds of the same
+output each use their own staging directory, and the last one to finish wins.
+
+An output that is a symlink made by the user, e.g. into a web server's directory, is written through:
+its target becomes the output.
+"""
+
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from moffee.utils.build_stats import incr
+
+# Seconds during which files of a replaced generation stay available
+GRACE_PERIOD = 300
+# Staging directories left behind by builds that crashed are removed after this many seconds
+STALE_STAGING = 24 * 3600
+STAGING_PREFIX = "staging-"
+GENERATION_PREFIX = "gen-"
+# Lists the files carried over from previous generations and when they expire
+CARRIED_NAME = ".moffee-carried.json"
+
+
+def generations_dir(output_dir: str) -> str:
+    """Directory holding the staging directories and generations of output_dir"""
+    output_dir = os.path.abspath(output_dir)
+    return os.path.join(
+        os.path.dirname(output_dir), f".{os.path.basename(output_dir)}.moffee"
+    )
+
+
+def _is_generation_link(output_dir: str) -> bool:
+    """Whether output_dir is a symlink to one of its generations"""
+    return os.path.islink(output_dir) and os.path.dirname(
+        os.path.realpath(output_dir)
+    ) == os.path.realpath(generations_dir(output_dir))
+
+
+def _resolve_output(output_dir: str) -> str:
+    """
+    Where the output of output_dir goes. Symlinks made by the user, e.g. into a web server's
+    directory, are written through rather than replaced, one link at a time.
+    """
+    output_dir = os.path.abspath(output_dir)
+    # Like the ELOOP limit of the OS
+    for _ in range(40):
+        if not os.path.islink(output_dir) or _is_generation_link(output_dir):
+            return output_dir
+        output_dir = os.path.normpath(
+            os.path.join(os.path.dirname(output_dir), os.readlink(output_dir))
+        )
+    raise OSError(f"Too many levels of symbolic links: {output_dir}")
+
+
+def current_generation(output_dir: str) -> Optional[str]:
+    """Directory holding the current build of output_dir, None without one"""
+    output_dir = _resolve_output(output_dir)
+    if _is_generation_link(output_dir):
+        return os.path.realpath(output_dir) if os.path.isdir(output_dir) else None
+    if os.path.isdir(output_dir):
+        return output_dir
+    return None
+
+
+def _read_carried(generation: str) -> Dict[str, float]:
+    """Files of generation carried over from earlier ones, with their expiry time"""
+    try:
+        with open(os.path.join(generation, CARRIED_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _link_file(source: str, target: str):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _keep_previous(previous: str, staging_dir: str):
+    """
+    Link the files of previous into staging_dir, for builds updating part of the output.
+    Builds must then replace files rather than write to them, which would change previous too.
+    Files carried over from earlier generations are left to _carry_over, so they still expire.
+    """
+    carried = _read_carried(previous)
+    for root, _, names in os.walk(previous):
+        for name in names:
+            source = os.path.join(root, name)
+            rel_path = Path(os.path.relpath(source, previous)).as_posix()
+            if rel_path == CARRIED_NAME or rel_path in carried:
+                continue
+            _link_file(source, os.path.join(staging_dir, rel_path))
+
+
+def link_unchanged(
+    mapping: Dict[str, str], target_dir: str, previous_dir: Optional[str]
+) -> Dict[str, str]:
+    """
+    Hard-link the files of mapping that previous_dir has under the same name, rather than copying them again.
+    For files named after their version, like assets, so that replaced generations don't hold copies.
+
+    :param mapping: Mapping from new path in target_dir to original path, see copy_files
+    :param previous_dir: Counterpart of target_dir in the current generation of the output, see current_generation
+    :return: The part of mapping left to copy
+    """
+    if previous_dir is None:
+        return mapping
+    remaining = {}
+    for new_path, original_path in mapping.items():
+        source = os.path.join(previous_dir, os.path.relpath(new_path, target_dir))
+        try:
+            # Linked already when the build started from the previous files, see _keep_previous
+            if not (os.path.lexists(new_path) and os.path.samefile(source, new_path)):
+                os.link(source, new_path)
+        except OSError:
+            remaining[new_path] = original_path
+            continue
+        incr("assets_linked")
+    return remaining
+
+
+def _carry_over(previous: str, staging_dir: str, grace_period: float):
+    """Link files of previous missing from staging_dir into it, until their grace period expires"""
+    now = time.time()
+    expiries = _read_carried(previous)
+
+    carried = {}
+    for root, _, names in os.walk(previous):
+        for name in names:
+            source = os.path.join(root, name)
+            rel_path = Path(os.path.relpath(source, previous)).as_posix()
+            expires = expiries.get(rel_path, now + grace_period)
+            target = os.path.join(staging_dir, rel_path)
+            if rel_path == CARRIED_NAME or expires <= now or os.path.lexists(target):
+                continue
+            _link_file(source, target)
+            carried[rel_path] = expires
+            incr("files_carried")
+    if carried:
+        with open(os.path.join(staging_dir, CARRIED_NAME), "w", encoding="utf-8") as f:
+            json.dump(carried, f, indent=1)
+
+
+def _remove_expired(root: str, current: str, grace_period: float):
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith(GENERATION_PREFIX):
+            try:
+                expired = (
+                    path != current and now - os.path.getmtime(path) > grace_period
+                )
+            except OSError:
+                continue
+        elif name.startswith(STAGING_PREFIX):
+            # Copying templates sets the mtime of staging directories, so they are named after their creation time
+            created = name[len(STAGING_PREFIX) :].split("-", 1)[0]
+            expired = created.isdigit() and now - int(created) > STALE_STAGING
+        else:
+            expired = False
+        if expired:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def swap_output(output_dir: str, staging_dir: str, grace_period: float = GRACE_PERIOD):
+    """
+    Make a complete build in staging_dir the content of output_dir.
+
+    :param staging_dir: Directory created by staged_output
+    :param grace_period: Seconds during which files of the replaced build stay available
+    """
+    output_dir = _resolve_output(output_dir)
+    root = os.path.dirname(staging_dir)
+    previous = current_generation(output_dir)
+    if previous is not None:
+        _carry_over(previous, staging_dir, grace_period)
+
+    generation = os.path.join(
+        root, GENERATION_PREFIX + os.path.basename(staging_dir)[len(STAGING_PREFIX) :]
+    )
+    os.rename(staging_dir, generation)
+    # The mtime of generations tells when they were superseded
+    os.utime(generation)
+
+    if previous == output_dir:
+        # Output of an earlier moffee version, or of a system without symlinks: moved aside first
+        previous = os.path.join(root, f"{GENERATION_PREFIX}previous-{time.time_ns()}")
+        try:
+            os.rename(output_dir, previous)
+        except FileNotFoundError:
+            # Moved by a concurrent build
+            previous = None
+
+    parent, name = os.path.split(output_dir)
+    link = os.path.join(parent, f".{name}.{os.path.basename(generation)}.link")
+    try:
+        os.symlink(os.path.relpath(generation, parent), link)
+    except (OSError, NotImplementedError):
+        # Without symlinks, the output is moved into place, which leaves a short gap
+        os.rename(generation, output_dir)
+    else:
+        os.replace(link, output_dir)
+
+    if previous is not None and os.path.isdir(previous):
+        os.utime(previous)
+    _remove_expired(root, os.path.realpath(output_dir), grace_period)
+
+
+@contextmanager
+def staged_output(
+    output_dir: str, grace_period: float = GRACE_PERIOD, keep_previous: bool = False
+) -> Iterator[str]:
+    """
+    Create a staging directory for a build of output_dir, swapped in when the block succeeds
+    and removed when it fails.
+
+    :param keep_previous: Start from the files of the current output, see _keep_previous
+    """
+    output_dir = _resolve_output(output_dir)
+    root = generations_dir(output_dir)
+    os.makedirs(root, exist_ok=True)
+    # Not mkdtemp, whose 0700 mode would make the output unreadable to other users
+    staging_dir = os.path.join(
+        root, f"{STAGING_PREFIX}{int(time.time())}-{os.getpid()}-{os.urandom(4).hex()}"
+    )
+    os.mkdir(staging_dir)
+    try:
+        previous = current_generation(output_dir)
+        if keep_previous and previous is not None:
+            _keep_previous(previous, staging_dir)
+        yield staging_dir
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    swap_output(output_dir, staging_dir, grace_period)
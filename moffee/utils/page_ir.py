@@ -0,0 +1,146 @@
+"""
+Serializable intermediate representation (IR) of a composited document: its options, title,
+pages with their chunk trees, and heading structure, as plain json data.
+
+Parsing a document to its IR is cached by a hash of the document, so renders in several themes,
+live reloads and batch builds paginate each document once. With MOFFEE_CACHE_DIR set, the IR is
+kept across processes, see moffee.utils.cache. External tools can read the IR written by
+`moffee parse` and load it with pages_from_ir.
+"""
+
+import json
+from dataclasses import asdict, fields
+from typing import List, Optional, Union
+
+from moffee import __version__
+from moffee.compositor import (
+    Chunk,
+    Page,
+    PageOption,
+    composite,
+    parse_frontmatter,
+)
+from moffee.utils.cache import Cache, cache_key
+from moffee.utils.md_helper import extract_title
+
+# Version of the IR layout, increased whenever it changes
+IR_VERSION = 1
+HEADING_KEYS = ("h1", "h2", "h3")
+
+parse_cache = Cache("parse", maxsize=64)
+
+_DEFAULT_CHUNK = Chunk()
+
+
+def chunk_to_ir(chunk: Chunk) -> Union[str, dict]:
+    """
+    Compact IR of a chunk tree: paragraphs are their markdown,
+    nodes a dict of their children and the fields differing from a default Chunk.
+    """
+    data = {
+        name: getattr(chunk, name)
+        for name in ("paragraph", "direction", "type", "alignment")
+        if getattr(chunk, name) != getattr(_DEFAULT_CHUNK, name)
+    }
+    if list(data) == ["paragraph"] and not chunk.children:
+        return chunk.paragraph
+    if chunk.children:
+        data["children"] = [chunk_to_ir(child) for child in chunk.children]
+    return data
+
+
+def chunk_from_ir(data: Union[str, dict]) -> Chunk:
+    if isinstance(data, str):
+        return Chunk(paragraph=data)
+    children = [chunk_from_ir(child) for child in data.get("children", [])]
+    return Chunk(
+        children=children, **{k: v for k, v in data.items() if k != "children"}
+    )
+
+
+def document_to_ir(document: str) -> dict:
+    """
+    Composite document into its IR, without caching, see parse_document.
+
+    Pages leave out missing headings, and only record the options their decos change
+    from the document options.
+    """
+    # Imported here, the builder imports this module
+    from moffee.builder import retrieve_structure
+
+    _, options = parse_frontmatter(document)
+    document_options = asdict(options)
+    pages = composite(document)
+    ir_pages = []
+    for page in pages:
+        ir_page = {
+            key: getattr(page, key)
+            for key in HEADING_KEYS
+            if getattr(page, key) is not None
+        }
+        ir_page["markdown"] = page.raw_md
+        page_options = {
+            name: value
+            for name, value in asdict(page.option).items()
+            if value != document_options[name]
+        }
+        if page_options:
+            ir_page["options"] = page_options
+        ir_page["chunk"] = chunk_to_ir(page.chunk)
+        ir_pages.append(ir_page)
+
+    return {
+        "version": IR_VERSION,
+        "title": extract_title(document),
+        "options": document_options,
+        "pages": ir_pages,
+        "struct": retrieve_structure(pages),
+    }
+
+
+def dumps_ir(ir: dict, indent: Optional[int] = None) -> str:
+    """Json of an IR, compact unless indented"""
+    separators = None if indent else (",", ":")
+    # Front matter may hold yaml values json has no type for, such as dates
+    return json.dumps(
+        ir, ensure_ascii=False, indent=indent, separators=separators, default=str
+    )
+
+
+def parse_document(document: str) -> dict:
+    """
+    IR of document, cached by a hash of the document and the moffee version.
+    Hits and misses are counted as parse_hits and parse_misses.
+    """
+    key = cache_key(__version__, IR_VERSION, document)
+    return json.loads(
+        parse_cache.get_or_compute(key, lambda: dumps_ir(document_to_ir(document)))
+    )
+
+
+def option_from_ir(data: dict) -> PageOption:
+    names = {f.name for f in fields(PageOption)}
+    return PageOption(**{name: value for name, value in data.items() if name in names})
+
+
+def pages_from_ir(ir: dict) -> List[Page]:
+    """
+    Pages of an IR, as composite returns them, without paginating or splitting chunks again.
+
+    :raises ValueError: If the IR was written in another layout version
+    """
+    if ir.get("version") != IR_VERSION:
+        raise ValueError(
+            f"Unsupported IR version {ir.get('version')}, expected {IR_VERSION}"
+        )
+    pages = []
+    for ir_page in ir["pages"]:
+        option = option_from_ir({**ir["options"], **ir_page.get("options", {})})
+        page = Page(
+            raw_md=ir_page["markdown"],
+            option=option,
+            **{key: ir_page.get(key) for key in HEADING_KEYS},
+        )
+        page.chunk = chunk_from_ir(ir_page["chunk"])
+        pages.append(page)
+    return pages
@@ -0,0 +1,436 @@
+"""
+Download remote images, stylesheets and scripts at build time, so decks load without network round trips.
+
+Downloads are kept in process_cache_dir() (across runs with MOFFEE_CACHE_DIR set), and cached copies
+are revalidated with ETag and Last-Modified once per build. Transfers share keep-alive connections
+and run in a bounded thread pool. References are rewritten to the cached files, which the
+AssetRewriter then copies to the output like any local asset. Downloaded stylesheets would lose the
+files they refer to by relative url once copied, so their url() and @import targets are downloaded too
+and embedded as data URIs.
+"""
+
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from http.client import HTTPConnection, HTTPException, HTTPResponse, HTTPSConnection
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urljoin, urlparse
+
+from moffee import __version__
+from moffee.utils.build_stats import incr
+from moffee.utils.cache import cache_key, process_cache_dir
+from moffee.utils.file_helper import temporary_path
+
+MAX_WORKERS = 8
+TIMEOUT = 30
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+DOWNLOAD_BLOCK_SIZE = 1 << 16
+META_NAME = "meta.json"
+USER_AGENT = f"moffee/{__version__}"
+
+# Attribute holding the url of each tag whose target is downloaded
+REMOTE_ATTRS = {"img": "src", "link": "href", "script": "src"}
+# Links to other pages are not downloaded
+LINK_RELS = {"stylesheet", "icon", "apple-touch-icon", "preload"}
+# Tags with this attribute stay remote, e.g. scripts loading further files relative to their own url
+KEEP_ATTR = 'data-moffee-remote="keep"'
+
+RE_REMOTE_TAG = re.compile(r"<(img|link|script)\b[^>]*>", re.IGNORECASE)
+RE_ATTR = re.compile(r'(\s+)([\w-]+)(?:="([^"]*)")?')
+RE_UNSAFE_FILENAME = re.compile(r"[^\w.-]+")
+# url() references of a stylesheet, and @import rules with a plain string
+RE_CSS_REF = re.compile(r"""url\(\s*(["']?)([^"')]*?)\1\s*\)|@import\s+(["'])(.*?)\3""")
+# Directory of the cached copies of stylesheets with their references embedded
+LOCALIZED_DIR = "localized"
+
+
+class RemoteError(Exception):
+    pass
+
+
+def remote_url(url: str) -> Optional[str]:
+    """Absolute http(s) url of url, None for other urls. Protocol-relative urls use https"""
+    if url.startswith("//"):
+        url = "https:" + url
+    if urlparse(url).scheme in ("http", "https"):
+        return url
+    return None
+
+
+class ConnectionPool:
+    """Keep-alive HTTP and HTTPS connections, reused per host by the threads downloading"""
+
+    def __init__(self, timeout: float = TIMEOUT):
+        self.timeout = timeout
+        self._idle: Dict[Tuple[str, str], List[HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme: str, netloc: str) -> Tuple[HTTPConnection, bool]:
+        """An idle connection to netloc if any, else a new one, and whether it is reused"""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        connection_class = HTTPSConnection if scheme == "https" else HTTPConnection
+        return connection_class(netloc, timeout=self.timeout), False
+
+    @contextmanager
+    def get(self, url: str, headers: Dict[str, str]) -> Iterator[HTTPResponse]:
+        """GET url, the connection returns to the pool once the response is read"""
+        parsed = urlparse(url)
+        path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+        while True:
+            connection, reused = self._connection(parsed.scheme, parsed.netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                break
+            except (OSError, HTTPException):
+                connection.close()
+                # Servers close idle connections at any time, retry those on a new connection
+                if not reused:
+                    raise
+        try:
+            yield response
+            response.read()
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle.setdefault((parsed.scheme, parsed.netloc), []).append(
+                    connection
+                )
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+def tag_attrs(tag: str) -> Dict[str, str]:
+    """Attributes of an HTML tag by lowercase name, empty for attributes without value"""
+    return {
+        match.group(2).lower(): match.group(3) or "" for match in RE_ATTR.finditer(tag)
+    }
+
+
+def cached_filename(url: str, content_type: Optional[str]) -> str:
+    """Name of the downloaded file: the last url segment, with an extension guessed from content_type if missing"""
+    name = RE_UNSAFE_FILENAME.sub("_", unquote(os.path.basename(urlparse(url).path)))
+    name = name.strip("._")[-100:] or "index"
+    if not os.path.splitext(name)[1] and content_type:
+        name += mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return name
+
+
+def data_uri(path: str, mime: Optional[str] = None) -> str:
+    mime = mime or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        return f"data:{mime};base64," + base64.b64encode(f.read()).decode("ascii")
+
+
+def is_stylesheet(name: str, attrs: Dict[str, str]) -> bool:
+    return name == "link" and "stylesheet" in attrs.get("rel", "").lower().split()
+
+
+def matches_integrity(path: str, integrity: str) -> bool:
+    """Whether the file at path matches one of the hashes of a subresource integrity attribute"""
+    hashes = [item.split("-", 1) for item in integrity.split() if "-" in item]
+    with open(path, "rb") as f:
+        data = f.read()
+    for algorithm, expected in hashes:
+        if algorithm in ("sha256", "sha384", "sha512"):
+            digest = base64.b64encode(hashlib.new(algorithm, data).digest()).decode(
+                "ascii"
+            )
+            if digest == expected.split("?")[0]:
+                return True
+    return False
+
+
+class RemoteDownloader:
+    """
+    Replace http(s) urls of img, link and script tags in HTML by local copies of their targets.
+    Call it on a document, or on consecutive chunks of one that don't split tags (see safe_chunks).
+    Each url is fetched once per downloader, the urls of a chunk concurrently.
+
+    Downloads are counted as remote_misses, cached copies still current as remote_hits.
+    Targets that can't be fetched stay remote, or use the cached copy if any, with a warning,
+    and are counted as remote_failed.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, timeout: float = TIMEOUT):
+        self.connections = ConnectionPool(timeout)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="moffee-remote"
+        )
+        self._downloads: Dict[str, "Future[Optional[str]]"] = {}
+        self._stylesheets: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "RemoteDownloader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.connections.close()
+
+    def _directory(self, url: str) -> str:
+        key = cache_key(url)
+        return os.path.join(process_cache_dir(), "remote", key[:2], key)
+
+    def _read_meta(self, directory: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(directory, META_NAME), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(os.path.join(directory, meta.get("filename", ""))):
+            return None
+        return meta
+
+    def _save(
+        self, directory: str, url: str, location: str, response: HTTPResponse
+    ) -> str:
+        """
+        Write the body of response to the cache, then its validators
+
+        :param location: Url the body was fetched from, after redirects
+        """
+        os.makedirs(directory, exist_ok=True)
+        filename = cached_filename(url, response.getheader("Content-Type"))
+        path = os.path.join(directory, filename)
+        # Not mkstemp, whose 0600 mode would be kept by the copy into the output
+        temporary = temporary_path(path)
+        try:
+            with open(temporary, "wb") as f:
+                for block in iter(lambda: response.read(DOWNLOAD_BLOCK_SIZE), b""):
+                    f.write(block)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+        meta = {
+            "url": url,
+            "location": location,
+            "filename": filename,
+            "etag": response.getheader("ETag"),
+            "last_modified": response.getheader("Last-Modified"),
+        }
+        meta_path = os.path.join(directory, META_NAME)
+        temporary = temporary_path(meta_path)
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temporary, meta_path)
+        incr("remote_bytes", os.path.getsize(path))
+        return path
+
+    def download(self, url: str) -> Optional[str]:
+        """
+        Fetch url into the cache, revalidating a cached copy.
+
+        :return: Path of the local copy, None when url could not be fetched and was never cached
+        """
+        directory = self._directory(url)
+        meta = self._read_meta(directory)
+        headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        location = url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                if remote_url(location) is None:
+                    raise RemoteError(f"redirected to {location}")
+                with self.connections.get(location, headers) as response:
+                    if response.status in REDIRECT_STATUSES and response.getheader(
+                        "Location"
+                    ):
+                        location = urljoin(location, response.getheader("Location"))
+                        continue
+                    if response.status == 304 and meta:
+                        incr("remote_hits")
+                        return os.path.join(directory, meta["filename"])
+                    if response.status != 200:
+                        raise RemoteError(f"HTTP {response.status} {response.reason}")
+                    incr("remote_misses")
+                    return self._save(directory, url, location, response)
+            raise RemoteError("too many redirects")
+        except (OSError, HTTPException, RemoteError) as e:
+            incr("remote_failed")
+            if meta:
+                warnings.warn(
+                    f"Could not revalidate {url}, using the cached copy: {e}",
+                    stacklevel=2,
+                )
+                return os.path.join(directory, meta["filename"])
+            warnings.warn(
+                f"Could not download {url}, it stays remote: {e}", stacklevel=2
+            )
+            return None
+
+    def download_all(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Fetch urls concurrently, see download"""
+        futures = {}
+        with self._lock:
+            for url in urls:
+                if url not in self._downloads:
+                    # Tasks run in a copy of this context to account their work to the active build stats
+                    self._downloads[url] = self._executor.submit(
+                        copy_context().run, self.download, url
+                    )
+                futures[url] = self._downloads[url]
+        return {url: future.result() for url, future in futures.items()}
+
+    def _target(self, match: re.Match) -> Optional[str]:
+        """Remote url of the tag to download, if any"""
+        tag = match.group(0)
+        if KEEP_ATTR in tag:
+            return None
+        name = match.group(1).lower()
+        attrs = tag_attrs(tag)
+        if name == "link" and not LINK_RELS & set(attrs.get("rel", "").lower().split()):
+            return None
+        url = attrs.get(REMOTE_ATTRS[name])
+        return url and remote_url(url)
+
+    def _embed_references(
+        self, url: str, path: str, importing: Tuple[str, ...] = ()
+    ) -> str:
+        """
+        Path of a copy of the stylesheet downloaded from url to path, with its url() and @import
+        targets embedded as data URIs. References that can't be downloaded become absolute urls.
+
+        :param importing: Urls of the stylesheets importing this one, to stop at import cycles
+        """
+        with self._lock:
+            if url in self._stylesheets:
+                return self._stylesheets[url]
+        meta = self._read_meta(os.path.dirname(path)) or {}
+        base = meta.get("location") or url
+        with open(path, "rb") as f:
+            # Keeps bytes that aren't utf-8 as they are
+            css = f.read().decode("utf-8", errors="surrogateescape")
+
+        references = {}
+        for match in RE_CSS_REF.finditer(css):
+            reference = match.group(2) if match.group(4) is None else match.group(4)
+            if reference and not reference.startswith(("data:", "#")):
+                references[reference] = urljoin(base, reference)
+        urls = [target for target in references.values() if remote_url(target)]
+        paths = self.download_all(urls)
+
+        def embedded(reference: str, imported: bool) -> Optional[str]:
+            """Replacement of reference, None to leave it as is"""
+            target = references.get(reference)
+            if target is None:
+                return None
+            target_path = paths.get(target)
+            if target_path is None:
+                return target
+            if imported:
+                if target == url or target in importing:
+                    return target
+                target_path = self._embed_references(
+                    target, target_path, importing + (url,)
+                )
+                return data_uri(target_path, "text/css")
+            return data_uri(target_path)
+
+        def replace(match: re.Match) -> str:
+            if match.group(4) is not None:
+                replacement = embedded(match.group(4), True)
+                if replacement is None:
+                    return match.group(0)
+                return f'@import "{replacement}"'
+            # url() of an @import rule
+            before = css[max(0, match.start() - 32) : match.start()]
+            imported = before.rstrip().endswith("@import")
+            replacement = embedded(match.group(2), imported)
+            return match.group(0) if replacement is None else f'url("{replacement}")'
+
+        localized = RE_CSS_REF.sub(replace, css)
+        if localized != css:
+            directory, filename = os.path.split(path)
+            localized_path = os.path.join(directory, LOCALIZED_DIR, filename)
+            data = localized.encode("utf-8", errors="surrogateescape")
+            try:
+                with open(localized_path, "rb") as f:
+                    unchanged = f.read() == data
+            except OSError:
+                unchanged = False
+            # Left untouched when unchanged, its mtime names the copy in the output
+            if not unchanged:
+                os.makedirs(os.path.dirname(localized_path), exist_ok=True)
+                temporary = temporary_path(localized_path)
+                with open(temporary, "wb") as f:
+                    f.write(data)
+                os.replace(temporary, localized_path)
+            path = localized_path
+        with self._lock:
+            self._stylesheets[url] = path
+        return path
+
+    def _localize(self, match: re.Match, url: str, path: str) -> str:
+        """Tag of match referring to path instead of url"""
+        tag = match.group(0)
+        name = match.group(1).lower()
+        attrs = tag_attrs(tag)
+        integrity = attrs.get("integrity")
+        if integrity and not matches_integrity(path, integrity):
+            incr("remote_failed")
+            warnings.warn(
+                f"{url} doesn't match its integrity attribute, it stays remote",
+                stacklevel=2,
+            )
+            return tag
+        if is_stylesheet(name, attrs):
+            path = self._embed_references(url, path)
+        attr = REMOTE_ATTRS[name]
+
+        def replace(attr_match: re.Match) -> str:
+            key = attr_match.group(2).lower()
+            if key == attr:
+                return f'{attr_match.group(1)}{attr_match.group(2)}="{path}"'
+            # The local copy is checked already, and is not cross-origin
+            if key in ("integrity", "crossorigin"):
+                return ""
+            return attr_match.group(0)
+
+        return RE_ATTR.sub(replace, tag)
+
+    def __call__(self, chunk: str) -> str:
+        matches = list(RE_REMOTE_TAG.finditer(chunk))
+        urls = [self._target(match) for match in matches]
+        paths = self.download_all(url for url in urls if url)
+
+        parts = []
+        pos = 0
+        for match, url in zip(matches, urls):
+            path = paths.get(url) if url else None
+            if path is None:
+                continue
+            parts.append(chunk[pos : match.start()])
+            parts.append(self._localize(match, url, path))
+            pos = match.end()
+        parts.append(chunk[pos:])
+        return "".join(parts)
@@ -0,0 +1,145 @@
+"""
+Build-time estimate of how much the content of a slide must shrink to fit, seeding autoScale in main.js.
+Heights are estimated from the markdown and the chunk layout with the metrics of the base theme,
+the browser then corrects the estimate with one or two measurements.
+"""
+
+import math
+import re
+from typing import Optional, Tuple
+
+from moffee.compositor import Chunk, Direction, Page, Type
+
+# Metrics of templates/base/css/styles.css, in CSS pixels
+FONT_SIZE = 26
+LINE_HEIGHT = 1.5 * FONT_SIZE
+# Average advance of a character in proportional fonts
+CHAR_WIDTH = 0.5 * FONT_SIZE
+PARAGRAPH_GAP = FONT_SIZE
+CODE_LINE_HEIGHT = 1.3 * 0.9 * FONT_SIZE
+CODE_PADDING = 2 * 10 + FONT_SIZE
+TABLE_ROW_HEIGHT = LINE_HEIGHT + 2 * 12
+TABLE_MARGIN = 2 * 20
+# Images and diagrams fill the space left to them, down to --min-element-height
+MIN_ELEMENT_HEIGHT = 100
+CHUNK_GAP = 20
+# Horizontal padding of .slide-content and margins of .content
+SLIDE_PADDING_X = 2 * 20 + 2 * 15
+CONTENT_MARGIN_BOTTOM = 30
+# Heights of the h1, h2 and h3 of a slide with their margins and paddings
+HEADING_HEIGHTS = {
+    1: 2.2 * 16 * 1.2 + 20,
+    2: 1.8 * 16 * 1.2 + 20 + 2 * 16,
+    3: 1.6 * 16 * 1.2 + 2 * 16,
+}
+# Scales closer to 1 than this are not worth a hint
+MAX_HINT = 0.98
+MIN_HINT = 0.1
+
+RE_FENCE = re.compile(r"^(`{3,}|~{3,})")
+RE_HEADING = re.compile(r"^(#{1,6})\s")
+RE_TABLE_SEPARATOR = re.compile(r"^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?$")
+RE_IMAGE_LINE = re.compile(r"^(!\[[^\]]*\]\([^)]*\)\s*|!\[\[[^\]]*\]\]\s*)+$")
+RE_LIST_MARKER = re.compile(r"^([-*+]|\d+[.)])\s+")
+RE_MATH_FENCE = re.compile(r"^\$\$")
+RE_INLINE_MARKUP = re.compile(r"\[([^\]]*)\]\([^)]*\)|[*_`]")
+
+
+def _text_lines(text: str, width: float) -> int:
+    text = RE_INLINE_MARKUP.sub(r"\1", text)
+    chars_per_line = max(1, int(width / CHAR_WIDTH))
+    return max(1, math.ceil(len(text) / chars_per_line))
+
+
+def paragraph_height(markdown: str, width: float) -> float:
+    """Estimated height of the html of a markdown paragraph laid out in width"""
+    height = 0.0
+    fence = None
+    in_math = in_table = False
+    blank = True
+    for line in markdown.splitlines():
+        stripped = line.strip()
+        if fence:
+            if stripped.startswith(fence):
+                fence = None
+            else:
+                height += CODE_LINE_HEIGHT
+            continue
+        if in_math:
+            in_math = not RE_MATH_FENCE.match(stripped)
+            height += LINE_HEIGHT
+            continue
+
+        if not stripped:
+            blank = True
+            in_table = False
+            continue
+        if blank and height:
+            height += PARAGRAPH_GAP
+        blank = False
+
+        match = RE_FENCE.match(stripped)
+        if match:
+            fence = match.group(1)
+            height += CODE_PADDING
+        elif RE_MATH_FENCE.match(stripped):
+            in_math = not stripped.endswith("$$") or stripped == "$$"
+            height += LINE_HEIGHT
+        elif stripped.startswith("|"):
+            if not in_table:
+                height += TABLE_MARGIN
+                in_table = True
+            if not RE_TABLE_SEPARATOR.match(stripped):
+                height += TABLE_ROW_HEIGHT
+        elif RE_IMAGE_LINE.match(stripped):
+            height += MIN_ELEMENT_HEIGHT
+        elif RE_HEADING.match(stripped):
+            level = len(RE_HEADING.match(stripped).group(1))
+            scale = max(1.0, 1.6 - 0.15 * (level - 1))
+            height += scale * LINE_HEIGHT
+        else:
+            text = RE_LIST_MARKER.sub("", stripped.lstrip("> "))
+            indent = 40 if text != stripped else 0
+            height += _text_lines(text, width - indent) * LINE_HEIGHT
+    return height
+
+
+def chunk_height(chunk: Chunk, width: float) -> float:
+    """Estimated height of a chunk tree laid out in width"""
+    if chunk.type == Type.PARAGRAPH:
+        return paragraph_height(chunk.paragraph or "", width)
+    if not chunk.children:
+        return 0.0
+    if chunk.direction == Direction.VERTICAL:
+        return sum(chunk_height(child, width) for child in chunk.children)
+    child_width = (width - CHUNK_GAP * (len(chunk.children) - 1)) / len(chunk.children)
+    return max(chunk_height(child, child_width) for child in chunk.children)
+
+
+def scale_hint(page: Page, slide_size: Tuple[float, float]) -> Optional[float]:
+    """
+    Estimated scale fitting the content of page in a slide, see autoScale in main.js.
+    Content laid out at a smaller scale gets more width, which shortens wrapped text.
+
+    :param slide_size: Slide width and height in CSS pixels
+    :return: Scale rounded to two decimals, None when the content is expected to fit unscaled
+    """
+    width, height = slide_size
+    available_width = width - SLIDE_PADDING_X
+    available_height = height - CONTENT_MARGIN_BOTTOM
+    for level, heading in ((1, page.h1), (2, page.h2), (3, page.h3)):
+        if heading:
+            available_height -= HEADING_HEIGHTS[level]
+    if available_height <= 0 or available_width <= 0:
+        return None
+
+    scale = 1.0
+    # Few iterations converge, as wider layouts only ever shorten the content
+    for _ in range(4):
+        content_height = chunk_height(page.chunk, available_width / scale)
+        if content_height <= 0:
+            return None
+        scale = min(1.0, available_height / content_height)
+    if scale > MAX_HINT:
+        return None
+    return round(max(MIN_HINT, scale), 2)
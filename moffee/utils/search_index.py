@@ -0,0 +1,88 @@
+"""
+Search index of a deck, embedded in the html for the search overlay of main.js.
+
+The index lists the heading path and a text snippet of every slide, and a sorted token list with the
+slides containing each token, so that prefix lookups are binary searches instead of DOM walks.
+It is embedded as gzip compressed base64, decoded the first time the overlay opens.
+"""
+
+import base64
+import gzip
+import json
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set
+
+from moffee.compositor import Page
+
+SNIPPET_LENGTH = 160
+PATH_SEPARATOR = " › "
+
+RE_TOKEN = re.compile(r"\w+")
+RE_IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)|!\[\[([^\]|]*)[^\]]*\]\]")
+RE_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+RE_HTML_TAG = re.compile(r"<[^>]+>")
+RE_MARKUP = re.compile(r"^\s*(#{1,6}|>|[-*+]|\d+[.)])\s+|[*_`~|=]+|:?-{3,}:?", re.M)
+RE_SPACE = re.compile(r"\s+")
+
+
+def plain_text(markdown: str) -> str:
+    """Readable text of markdown, without markup, urls and html tags"""
+    text = RE_IMAGE.sub(lambda m: m.group(1) or m.group(2) or "", markdown)
+    text = RE_LINK.sub(r"\1", text)
+    text = RE_HTML_TAG.sub(" ", text)
+    text = RE_MARKUP.sub(" ", text)
+    return RE_SPACE.sub(" ", text).strip()
+
+
+def tokens(text: str) -> List[str]:
+    """
+    Search tokens of text: lowercase words without accents.
+    Must match searchTokens in main.js.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(
+        char for char in text if not unicodedata.category(char).startswith("M")
+    )
+    return RE_TOKEN.findall(text.lower())
+
+
+def utf16_key(token: str) -> bytes:
+    """
+    Sort key ordering tokens like JavaScript compares strings, by UTF-16 code units.
+    Code point order differs for characters outside of the BMP, which would break lookups in main.js
+    """
+    return token.encode("utf-16-be")
+
+
+def build_search_index(
+    pages: List[Page], page_meta: List[Dict[str, Optional[str]]]
+) -> dict:
+    """
+    :param page_meta: Current headings of each page, see retrieve_structure
+    :return: Index with "slides", a [heading path, snippet] pair per slide,
+             and "tokens", sorted by utf16_key, with "postings", the ids of the slides containing each token
+    """
+    slides = []
+    postings: Dict[str, Set[int]] = {}
+    for i, (page, meta) in enumerate(zip(pages, page_meta)):
+        headings = [meta[key] for key in ("h1", "h2", "h3") if meta[key]]
+        text = plain_text(page.raw_md)
+        slides.append([PATH_SEPARATOR.join(headings), text[:SNIPPET_LENGTH]])
+        for token in tokens(" ".join(headings + [text])):
+            postings.setdefault(token, set()).add(i)
+    sorted_tokens = sorted(postings, key=utf16_key)
+    return {
+        "slides": slides,
+        "tokens": sorted_tokens,
+        "postings": [sorted(postings[token]) for token in sorted_tokens],
+    }
+
+
+def encode_search_index(index: dict) -> str:
+    """Gzip compressed base64 of the index json, which has no quotes or markup to escape in html"""
+    data = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # mtime=0 keeps the output reproducible
+    return base64.b64encode(gzip.compress(data, compresslevel=9, mtime=0)).decode(
+        "ascii"
+    )
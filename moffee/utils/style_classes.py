@@ -0,0 +1,128 @@
+"""
+Sharing of slide styles through generated classes: front matter styles, which every slide inherits,
+become one stylesheet rule, and so do deco styles repeated on several slides.
+Only styles specific to one slide stay inline.
+
+Generated rules are !important, so that they win over theme rules of any specificity like style
+attributes do. Unlike style attributes, they would also win over !important theme rules, so
+properties set with !important in the theme or the document always stay inline.
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+DECK_CLASS = "deck-style"
+SLIDE_CLASS = "slide-style-{}"
+
+RE_IMPORTANT = re.compile(r"([\w-]+)\s*:[^;{}]*!\s*important", re.IGNORECASE)
+
+
+@dataclass
+class SlideStyle:
+    # Generated classes applying shared styles, separated by spaces
+    classes: str = ""
+    # Styles left for the style attribute
+    inline: Dict[str, object] = field(default_factory=dict)
+
+
+def _shareable(value) -> bool:
+    """Whether a value can be moved from a style attribute to a <style> element as is"""
+    return isinstance(value, (str, int, float)) and not any(
+        char in str(value) for char in "<>{};"
+    )
+
+
+def _family(key: str) -> str:
+    """Shorthand a property belongs to, e.g. background for background-color"""
+    return key.split("-", 1)[0]
+
+
+def important_properties(css: str) -> Set[str]:
+    """Properties declared with !important in css, or any text holding stylesheets"""
+    return {match.group(1).lower() for match in RE_IMPORTANT.finditer(css)}
+
+
+def _same_cascade(
+    deck: Dict[str, object], styles: Dict[str, object], overrides: List[str]
+) -> bool:
+    """
+    Whether styles applied as the deck rule followed by a rule with overrides cascade like the style attribute.
+    They don't when an overridden property precedes a related one from the deck,
+    e.g. background-color before background.
+    """
+    keys = list(styles)
+    for key in overrides:
+        if key in deck and any(
+            _family(later) == _family(key) for later in keys[keys.index(key) + 1 :]
+        ):
+            return False
+    return True
+
+
+def _related(keys: Iterable[str], deck: Dict[str, object]) -> bool:
+    families = {_family(key) for key in deck}
+    return any(_family(key) in families for key in keys)
+
+
+def _rule(selector: str, styles: Dict[str, object]) -> str:
+    declarations = " ".join(
+        f"{key}: {value} !important;" for key, value in styles.items()
+    )
+    return f"{selector} {{ {declarations} }}"
+
+
+def share_styles(
+    deck: Dict[str, object],
+    slides: List[Dict[str, object]],
+    important: Iterable[str] = (),
+) -> Tuple[str, List[SlideStyle]]:
+    """
+    Split the styles of slides into shared rules and inline styles.
+
+    :param deck: Styles from the front matter, inherited by every slide
+    :param slides: Complete styles of each slide
+    :param important: Properties set with !important by the theme or the document, see important_properties.
+                      Styles of the same shorthand family stay inline
+    :return: Stylesheet rules for the generated classes, and how to style each slide
+    """
+    kept_inline = {_family(key) for key in important}
+
+    def shareable(key: str, value) -> bool:
+        return _shareable(value) and _family(key) not in kept_inline
+
+    if not all(shareable(key, value) for key, value in deck.items()):
+        return "", [SlideStyle(inline=dict(styles)) for styles in slides]
+
+    overrides: List[Optional[Tuple[Tuple[str, object], ...]]] = []
+    for styles in slides:
+        changed = [key for key in styles if key not in deck or styles[key] != deck[key]]
+        if (
+            not all(key in styles for key in deck)
+            or not all(shareable(key, styles[key]) for key in changed)
+            or not _same_cascade(deck, styles, changed)
+        ):
+            overrides.append(None)
+        else:
+            overrides.append(tuple((key, styles[key]) for key in changed))
+
+    counts = Counter(override for override in overrides if override)
+    classes: Dict[Tuple[Tuple[str, object], ...], str] = {}
+    rules = [_rule(f".{DECK_CLASS}", deck)] if deck else []
+    for override, count in counts.items():
+        if count > 1:
+            classes[override] = SLIDE_CLASS.format(len(classes) + 1)
+            rules.append(_rule(f".{classes[override]}", dict(override)))
+
+    result = []
+    for styles, override in zip(slides, overrides):
+        names = [DECK_CLASS] if deck else []
+        if override in classes:
+            result.append(SlideStyle(" ".join(names + [classes[override]])))
+        elif override is not None and not _related((key for key, _ in override), deck):
+            result.append(SlideStyle(" ".join(names), dict(override)))
+        else:
+            # The deck rule would take precedence over inline styles for the same properties
+            result.append(SlideStyle(inline=dict(styles)))
+    return "\n".join(rules), result
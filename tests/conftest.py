@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def template_dir():
+    """Directory of a bundled template, the base templates by default or a theme by name"""
+
+    def template_dir(name="base"):
+        return os.path.join(
+            os.path.dirname(__file__), "..", "moffee", "templates", name
+        )
+
+    return template_dir
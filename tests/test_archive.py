@@ -0,0 +1,103 @@
+import os
+import tarfile
+import tempfile
+import zipfile
+
+import pytest
+
+from moffee.builder import build, build_archive, theme_dirs
+from moffee.utils.archive import archive_suffix
+
+DOC = """
+---
+theme: beam
+---
+# Archive
+![Image](image.png)
+---
+## Second
+![Image](image.png)
+"""
+
+
+@pytest.fixture
+def deck():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "deck.md")
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write(DOC)
+        with open(os.path.join(temp_dir, "image.png"), "wb") as f:
+            f.write(b"fake image content")
+        output_dir = os.path.join(temp_dir, "output")
+        build(doc_path, output_dir, *theme_dirs("beam"))
+        yield temp_dir, doc_path, output_dir
+
+
+def output_files(output_dir):
+    files = {}
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            rel_path = os.path.relpath(os.path.join(root, name), output_dir).replace(
+                os.sep, "/"
+            )
+            if rel_path.startswith("layouts/") or rel_path.startswith("."):
+                continue
+            with open(os.path.join(root, name), "rb") as f:
+                files[rel_path] = f.read()
+    return files
+
+
+@pytest.mark.parametrize(
+    "path, suffix",
+    [
+        ("deck.zip", ".zip"),
+        ("out/deck.TAR.GZ", ".tar.gz"),
+        ("deck.tgz", ".tgz"),
+        ("deck.tar", ".tar"),
+        ("deck.html", None),
+        ("output", None),
+    ],
+)
+def test_archive_suffix(path, suffix):
+    assert archive_suffix(path) == suffix
+
+
+def test_build_zip(deck):
+    temp_dir, doc_path, output_dir = deck
+    archive_path = os.path.join(temp_dir, "deck.zip")
+    stats = build_archive(doc_path, archive_path, *theme_dirs("beam"))
+
+    assert not os.path.exists(os.path.join(temp_dir, "deck"))
+    assert stats.counters["assets_copied"] == 1
+    assert stats.counters["bytes_written"] == os.path.getsize(archive_path)
+    with zipfile.ZipFile(archive_path) as archive:
+        assert {
+            info.filename: archive.read(info) for info in archive.infolist()
+        } == output_files(output_dir)
+        for info in archive.infolist():
+            expected = (
+                zipfile.ZIP_STORED
+                if info.filename.endswith(".png")
+                else zipfile.ZIP_DEFLATED
+            )
+            assert info.compress_type == expected
+
+
+def test_build_tar(deck):
+    temp_dir, doc_path, output_dir = deck
+    archive_path = os.path.join(temp_dir, "deck.tar.gz")
+    build_archive(doc_path, archive_path, *theme_dirs("beam"))
+
+    with tarfile.open(archive_path, "r:gz") as archive:
+        files = {member.name: archive.extractfile(member).read() for member in archive}
+    assert files == output_files(output_dir)
+
+
+def test_build_archive_failure(deck):
+    temp_dir, doc_path, _ = deck
+    archive_path = os.path.join(temp_dir, "deck.zip")
+    with pytest.raises(ValueError, match="Unknown markdown backend: missing"):
+        build_archive(
+            doc_path, archive_path, *theme_dirs("beam"), markdown_backend="missing"
+        )
+    assert not os.path.exists(archive_path)
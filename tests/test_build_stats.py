@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+from moffee.utils.build_stats import (
+    BuildStats,
+    collect_stats,
+    current_stats,
+    incr,
+    stage,
+    timed,
+)
+
+
+def test_noop_without_active_stats():
+    assert current_stats() is None
+    with stage("noop"):
+        incr("noop")
+    assert current_stats() is None
+
+
+def test_stages_accumulate():
+    with collect_stats() as stats:
+        with stage("a"):
+            pass
+        with stage("a"):
+            with stage("b"):
+                pass
+        timed("c", lambda x: x)(1)
+
+    assert list(stats.stages) == ["a", "b", "c"]
+    assert stats.stages["a"].calls == 2
+    assert stats.stages["a"].wall >= stats.stages["b"].wall
+    assert stats.stages["c"].calls == 1
+    assert current_stats() is None
+
+
+def test_stage_cpu_excludes_other_threads():
+    done = threading.Event()
+
+    def spin():
+        while not done.is_set():
+            pass
+
+    busy = threading.Thread(target=spin)
+    busy.start()
+    try:
+        with collect_stats() as stats:
+            with stage("wait"):
+                time.sleep(0.2)
+    finally:
+        done.set()
+        busy.join()
+
+    assert stats.stages["wait"].cpu < stats.stages["wait"].wall / 2
+
+
+def test_counters_and_hit_rate():
+    with collect_stats(BuildStats()) as stats:
+        incr("slides", 3)
+        incr("slides")
+        incr("converter_hits", 3)
+        incr("converter_misses")
+
+    assert stats.counters["slides"] == 4
+    assert stats.hit_rate("converter") == 0.75
+    assert stats.hit_rate("unknown") is None
+    assert stats.caches == ["converter"]
+
+    exported = stats.as_dict()
+    assert exported["counters"]["slides"] == 4
+    assert exported["hit_rates"] == {"converter": 0.75}
+    assert "converter hit rate" in stats.format()
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -2,7 +2,20 @@ import os
 import tempfile
 import pytest
 import re
-from moffee.builder import build, render_jinja2, read_options, retrieve_structure
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from moffee.builder import (
+    build,
+    build_single_file,
+    build_site,
+    build_themes,
+    theme_dirs,
+    render,
+    render_jinja2,
+    read_options,
+    retrieve_structure,
+    site_layout,
+)
 from moffee.compositor import composite
 
 
@@ -99,6 +112,234 @@ def test_build(setup_test_env):
         assert len(f.readlines()) > 2
 
 
+def test_build_stats_hook(setup_test_env):
+    temp_dir, doc_path, res_dir, output_dir = setup_test_env
+    received = []
+    stats = build(doc_path, output_dir, template_dir(), hooks=[received.append])
+
+    assert received == [stats]
+    for name in ["total", "templates", "composite", "markdown", "jinja"]:
+        assert stats.stages[name].calls >= 1
+    assert stats.stages["redirect_paths"].calls == 1
+    assert stats.stages["copy_assets"].calls == 1
+    assert stats.counters["slides"] == 2
+    assert stats.counters["chunks"] == 5
+    # Assets unchanged since an earlier build of output_dir are linked from it
+    assert (
+        stats.counters.get("assets_copied", 0) + stats.counters.get("assets_linked", 0)
+        == 2
+    )
+    assert stats.counters["bytes_written"] == os.path.getsize(
+        os.path.join(output_dir, "index.html")
+    )
+
+
+def test_build_themes(setup_test_env):
+    temp_dir, doc_path, res_dir, output_dir = setup_test_env
+    themes_dir = os.path.join(temp_dir, "themes")
+    stats = build_themes(doc_path, themes_dir, ["default", "beam", "gaia"])
+    j = os.path.join
+
+    # Markdown is converted once, assets are copied once and shared
+    assert stats.counters["markdown_hits"] == 3 * stats.counters["chunks"]
+    assert "markdown_misses" not in stats.counters
+    assert stats.counters["assets_copied"] == 2
+    assert len(os.listdir(j(themes_dir, "assets"))) == 2
+
+    for theme in ["default", "beam", "gaia"]:
+        single_dir = j(temp_dir, f"single-{theme}")
+        build(doc_path, single_dir, *theme_dirs(theme))
+        with open(j(themes_dir, theme, "index.html"), encoding="utf8") as f:
+            html = f.read()
+        with open(j(single_dir, "index.html"), encoding="utf8") as f:
+            assert html.replace('"../assets/', '"assets/') == f.read()
+        for name in os.listdir(j(themes_dir, "assets")):
+            assert f"../assets/{name}" in html
+
+    stats = build_themes(doc_path, themes_dir, ["default", "beam", "gaia"])
+    assert stats.counters["manifest_hits"] == 3
+    stats = build_themes(doc_path, themes_dir, ["default", "robo"])
+    assert stats.counters["manifest_hits"] == 1
+    assert stats.counters["manifest_misses"] == 1
+
+    with pytest.raises(ValueError):
+        build_themes(doc_path, themes_dir, ["default", "missing"])
+
+
+def test_build_site(setup_test_env):
+    temp_dir, doc_path, res_dir, _ = setup_test_env
+    j = os.path.join
+    site_dir = j(temp_dir, "site")
+    os.makedirs(j(temp_dir, "talks"), exist_ok=True)
+    other_path = j(temp_dir, "talks", "other.md")
+    with open(other_path, "w", encoding="utf8") as f:
+        f.write("# Other\n![Image](../image.png)\n")
+
+    stats = build_site([doc_path, other_path], site_dir)
+    runtime_files = [
+        Path(os.path.relpath(j(root, name), j(site_dir, "runtime"))).as_posix()
+        for root, _, names in os.walk(j(site_dir, "runtime"))
+        for name in names
+    ]
+    # beam and default share the base files, each has its own extension.css
+    assert len(runtime_files) == 6
+    assert stats.counters["runtime_misses"] == 6
+    assert stats.counters["runtime_hits"] == 4
+    assert len(os.listdir(j(site_dir, "assets"))) == 2
+
+    for deck_dir, prefix in [
+        (j(site_dir, "test"), "../"),
+        (j(site_dir, "talks", "other"), "../../"),
+    ]:
+        assert not os.path.exists(j(deck_dir, "css"))
+        assert not os.path.exists(j(deck_dir, "js"))
+        with open(j(deck_dir, "index.html"), encoding="utf8") as f:
+            html = f.read()
+        assert 'href="css/' not in html
+        assert 'src="js/' not in html
+        for url in re.findall(r'(?:href|src)="([^":]*)"', html):
+            assert url.startswith(f"{prefix}runtime/") or url.startswith(
+                f"{prefix}assets/"
+            )
+            assert os.path.isfile(os.path.normpath(j(deck_dir, url)))
+    with open(j(site_dir, "test", "index.html"), encoding="utf8") as f:
+        assert appeared(f.read(), 'src="../assets/') == 2
+
+    stats = build_site([doc_path, other_path], site_dir)
+    assert stats.counters["manifest_hits"] == 2
+    assert "runtime_misses" not in stats.counters
+
+    with pytest.raises(ValueError):
+        site_layout([doc_path, doc_path], site_dir)
+    with pytest.raises(ValueError):
+        site_layout([j(temp_dir, "runtime.md")], site_dir)
+
+
+def test_build_single_file(setup_test_env):
+    temp_dir, doc_path, res_dir, _ = setup_test_env
+    output_file = os.path.join(temp_dir, "single", "deck.html")
+    options = read_options(doc_path)
+    stats = build_single_file(
+        doc_path, output_file, template_dir(), template_dir(options.theme)
+    )
+
+    assert os.listdir(os.path.dirname(output_file)) == ["deck.html"]
+    with open(output_file, encoding="utf8") as f:
+        output_html = f.read()
+    assert 'href="css/' not in output_html
+    assert 'src="js/' not in output_html
+    assert "<style>" in output_html
+    assert appeared(output_html, 'src="data:image/png;base64,') == 2
+    assert res_dir not in output_html
+    assert stats.counters["assets_inlined"] == 2
+
+
+def test_build_up_to_date(setup_test_env):
+    temp_dir, doc_path, res_dir, _ = setup_test_env
+    output_dir = os.path.join(temp_dir, "output_manifest")
+    j = os.path.join
+
+    stats = build(doc_path, output_dir, template_dir(), template_dir("beam"))
+    assert stats.counters["manifest_misses"] == 1
+    assert os.path.exists(j(output_dir, ".moffee-manifest.json"))
+    index_mtime = os.stat(j(output_dir, "index.html")).st_mtime_ns
+
+    # Nothing changed: no work, no writes
+    stats = build(doc_path, output_dir, template_dir(), template_dir("beam"))
+    assert stats.counters["manifest_hits"] == 1
+    assert "render" not in stats.stages
+    assert os.stat(j(output_dir, "index.html")).st_mtime_ns == index_mtime
+
+    # Different theme, modified asset, forced build and missing output all rebuild
+    stats = build(doc_path, output_dir, template_dir(), template_dir("robo"))
+    assert stats.counters["manifest_misses"] == 1
+    with open(j(res_dir, "image2.png"), "a") as f:
+        f.write("modified")
+    stats = build(doc_path, output_dir, template_dir(), template_dir("robo"))
+    assert stats.counters["manifest_misses"] == 1
+    stats = build(
+        doc_path, output_dir, template_dir(), template_dir("robo"), force=True
+    )
+    assert stats.counters["manifest_misses"] == 1
+    os.remove(j(output_dir, "index.html"))
+    stats = build(doc_path, output_dir, template_dir(), template_dir("robo"))
+    assert stats.counters["manifest_misses"] == 1
+    stats = build(doc_path, output_dir, template_dir(), template_dir("robo"))
+    assert stats.counters["manifest_hits"] == 1
+
+
+def test_build_missing_asset_added():
+    j = os.path.join
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = j(temp_dir, "deck.md")
+        output_dir = j(temp_dir, "output")
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write("# Title\n![](pic.png)\n")
+
+        build(doc_path, output_dir, template_dir(), template_dir("beam"))
+        stats = build(doc_path, output_dir, template_dir(), template_dir("beam"))
+        assert stats.counters["manifest_hits"] == 1
+
+        # The image referred to appears
+        with open(j(temp_dir, "pic.png"), "w") as f:
+            f.write("fake image content")
+        stats = build(doc_path, output_dir, template_dir(), template_dir("beam"))
+        assert stats.counters["manifest_misses"] == 1
+        with open(j(output_dir, "index.html"), encoding="utf8") as f:
+            assert re.search(r'src="assets/\w+_pic\.png"', f.read())
+
+        # Touched but unchanged assets don't rebuild
+        os.utime(j(temp_dir, "pic.png"), ns=(0, 0))
+        stats = build(doc_path, output_dir, template_dir(), template_dir("beam"))
+        assert stats.counters["manifest_hits"] == 1
+
+
+def test_render_in_memory(setup_test_env):
+    temp_dir, doc_path, res_dir, output_dir = setup_test_env
+    with open(doc_path, encoding="utf8") as f:
+        doc = f.read()
+
+    before = set(os.listdir(temp_dir))
+    result = render(doc)
+    assert set(os.listdir(temp_dir)) == before
+
+    assert appeared(result.html, "chunk-paragraph") == 5
+    # Theme from front matter, templates are not shipped
+    assert result.assets["css/extension.css"].endswith(
+        os.path.join("beam", "css", "extension.css")
+    )
+    assert "css/styles.css" in result.assets
+    assert not any(path.startswith("layouts") for path in result.assets)
+    # Local paths are left alone without document_path
+    assert not any(path.startswith("assets/") for path in result.assets)
+
+    result = render(doc, theme="default", document_path=doc_path)
+    assert result.assets["css/extension.css"].endswith(
+        os.path.join("default", "css", "extension.css")
+    )
+    doc_assets = {k: v for k, v in result.assets.items() if k.startswith("assets/")}
+    assert sorted(os.path.basename(v) for v in doc_assets.values()) == [
+        "image.png",
+        "image2.png",
+    ]
+    for path in doc_assets:
+        assert f'"{path}"' in result.html
+
+    with pytest.raises(ValueError):
+        render(doc, theme="../base")
+
+
+def test_render_thread_safety(setup_test_env):
+    _, doc_path, _, _ = setup_test_env
+    with open(doc_path, encoding="utf8") as f:
+        doc = f.read()
+    expected = render(doc).html
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: render(doc).html, range(32)))
+    assert all(html == expected for html in results)
+
+
 def test_retrieve_structure():
     doc = """
 # Title
@@ -0,0 +1,65 @@
+from moffee.markdown import md
+from moffee.utils.build_stats import collect_stats
+from moffee.utils.cache import Cache, cache_key
+from moffee.utils.md_highlight_ext import highlight_cache
+
+
+def test_cache_key_stable():
+    assert cache_key("a", {"x": 1, "y": 2}) == cache_key("a", {"y": 2, "x": 1})
+    assert cache_key("a", 1) != cache_key("a", "1")
+
+
+def test_cache_lru_eviction():
+    cache = Cache("test", maxsize=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_cache_persistent(tmp_path, monkeypatch):
+    monkeypatch.setenv("MOFFEE_CACHE_DIR", str(tmp_path))
+    cache = Cache("test")
+    cache.set("key", "value")
+    assert Cache("test").get("key") == "value"
+
+    monkeypatch.delenv("MOFFEE_CACHE_DIR")
+    assert Cache("test").get("key") is None
+
+
+def test_cache_get_or_compute_counts():
+    cache = Cache("test")
+    calls = []
+    with collect_stats() as stats:
+        for _ in range(3):
+            cache.get_or_compute("k", lambda: calls.append(1) or "v")
+    assert calls == [1]
+    assert stats.counters["test_misses"] == 1
+    assert stats.counters["test_hits"] == 2
+
+
+def test_highlight_cached():
+    highlight_cache.clear()
+    text = "```python\nprint('cached')\n```\n\nand `#!python x = 1`"
+    with collect_stats() as stats:
+        first = md(text)
+        second = md(text)
+    assert first == second
+    assert '<span class="nb">print</span>' in first
+    assert stats.counters["highlight_misses"] == 2
+    assert stats.counters["highlight_hits"] == 2
+
+
+def test_highlight_cache_output_unchanged():
+    from markdown import markdown
+    from moffee.markdown import extension_configs, extensions
+
+    uncached = [e for e in extensions if e != "moffee.utils.md_highlight_ext"]
+    text = '```python hl_lines="2" linenums="1"\na = 1\nb = 2\n```\n\n`#!js var x` `#!nope y`'
+    expected = markdown(text, extensions=uncached, extension_configs=extension_configs)
+    highlight_cache.clear()
+    assert md(text) == expected
+    assert md(text) == expected
@@ -2,9 +2,16 @@ import os
 import pytest
 import shutil
 import tempfile
+import threading
+import time
 
+from moffee.utils.build_stats import collect_stats
 from moffee.utils.file_helper import (
+    AssetRewriter,
+    StatCache,
     copy_assets,
+    copy_files,
+    path_redirector,
 )
 
 
@@ -163,3 +170,94 @@ def test_copy_assets_ignores_urls_in_text_content():
     assert updated_doc.count(sample_file_path) == 2
 
     shutil.rmtree(temp_dir)
+
+
+def test_copy_assets_stable_names(setup_test_environment):
+    temp_dir, sample_image_path, _ = setup_test_environment
+    html_doc = f'<img src="{sample_image_path}">'
+
+    first = copy_assets(html_doc, os.path.join(temp_dir, "out1"))
+    second = copy_assets(html_doc, os.path.join(temp_dir, "out2"))
+    assert os.listdir(os.path.join(temp_dir, "out1")) == os.listdir(
+        os.path.join(temp_dir, "out2")
+    )
+    assert first.replace("out1", "out2") == second
+
+
+@pytest.fixture
+def counted_stats(monkeypatch):
+    """Record the paths stat'ed, slowly as on a network file system, and the most stats at once"""
+    real_stat = os.stat
+    calls = []
+    running = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def stat(path, *args, **kwargs):
+        with lock:
+            calls.append(os.fspath(path))
+            running.append(path)
+            peak[0] = max(peak[0], len(running))
+        try:
+            time.sleep(0.002)
+            return real_stat(path, *args, **kwargs)
+        finally:
+            with lock:
+                running.remove(path)
+
+    monkeypatch.setattr(os, "stat", stat)
+    return calls, peak
+
+
+def test_assets_probed_once_and_concurrently(setup_test_environment, counted_stats):
+    temp_dir, _, _ = setup_test_environment
+    for i in range(20):
+        with open(os.path.join(temp_dir, f"{i}.png"), "w") as f:
+            f.write(str(i))
+    document_path = os.path.join(temp_dir, "deck.md")
+    html = "".join(
+        f'<img src="{i}.png">\n<a href="{i}.png">{i}</a>\n' for i in range(20)
+    )
+    calls, peak = counted_stats
+
+    stat_cache = StatCache()
+    with collect_stats() as stats:
+        redirected = path_redirector(document_path, stat_cache=stat_cache)(html)
+        rewrite = AssetRewriter(
+            os.path.join(temp_dir, "assets"), url_prefix="assets", stat_cache=stat_cache
+        )
+        rewritten = rewrite(redirected)
+    images = [os.path.join(temp_dir, f"{i}.png") for i in range(20)]
+    # Found next to the document, other base paths aren't probed
+    assert sorted(calls) == sorted(images)
+    assert stats.counters["paths_probed"] == 20
+    assert peak[0] > 1
+    assert len(rewrite.mapping) == 20
+    assert rewritten.count('="assets/') == 40
+
+
+def test_missing_paths_probe_every_base(setup_test_environment, counted_stats):
+    temp_dir, _, _ = setup_test_environment
+    document_path = os.path.join(temp_dir, "deck.md")
+    calls, _ = counted_stats
+    html = '<img src="missing.png">'
+    assert path_redirector(document_path, "res")(html) == html
+    assert len(set(calls)) == 3
+
+
+def test_copy_files_concurrently(setup_test_environment):
+    temp_dir, sample_image_path, _ = setup_test_environment
+    target_dir = os.path.join(temp_dir, "copies")
+    os.makedirs(target_dir)
+    mapping = {
+        os.path.join(target_dir, f"{i}.png"): sample_image_path for i in range(30)
+    }
+    with collect_stats() as stats:
+        copy_files(mapping)
+    assert sorted(os.listdir(target_dir)) == sorted(
+        os.path.basename(p) for p in mapping
+    )
+    assert stats.counters["assets_copied"] == 30
+
+    with pytest.raises(FileNotFoundError):
+        copy_files({os.path.join(target_dir, name): "missing" for name in ["a", "b"]})
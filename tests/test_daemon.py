@@ -0,0 +1,231 @@
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+from moffee import daemon
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="Unix sockets are not available"
+)
+
+
+@pytest.fixture
+def socket_file():
+    # Keep the path short, Unix socket paths are limited to ~100 characters
+    fd, path = tempfile.mkstemp(suffix=".sock", dir="/tmp")
+    os.close(fd)
+    os.unlink(path)
+    yield path
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+@pytest.fixture
+def deck():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "deck.md")
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write("---\ntheme: beam\n---\n# Title\n![img](image.png)\n")
+        with open(os.path.join(temp_dir, "image.png"), "w") as f:
+            f.write("fake image content")
+        yield doc_path, os.path.join(temp_dir, "output")
+
+
+def start_server(path, idle_timeout=60):
+    server = daemon.DaemonServer(path, idle_timeout=idle_timeout)
+    thread = threading.Thread(target=server.serve_until_idle, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def test_forward_without_daemon(socket_file, deck):
+    doc_path, output_dir = deck
+    assert daemon.forward_make(doc_path, output_dir, path=socket_file) is None
+    assert not os.path.exists(output_dir)
+
+
+def test_forward_make(socket_file, deck):
+    doc_path, output_dir = deck
+    server, thread = start_server(socket_file)
+    try:
+        response = daemon.forward_make(doc_path, output_dir, path=socket_file)
+        assert response["ok"]
+        assert response["stats"]["counters"]["assets_copied"] == 1
+        with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+            assert "assets/" in f.read()
+        with open(
+            os.path.join(output_dir, "css", "extension.css"), encoding="utf8"
+        ) as f:
+            assert len(f.readlines()) > 2
+
+        response = daemon.forward_make(
+            doc_path, output_dir, themes=["default", "robo"], path=socket_file
+        )
+        assert response["ok"]
+        for theme in ["default", "robo"]:
+            assert os.path.isfile(os.path.join(output_dir, theme, "index.html"))
+
+        # Failed builds are left to the caller
+        missing = os.path.join(os.path.dirname(doc_path), "missing.md")
+        assert daemon.forward_make(missing, output_dir, path=socket_file) is None
+        # Another version's daemon is not used
+        assert (
+            daemon.request(
+                {
+                    "command": "make",
+                    "version": "0",
+                    "markdown": doc_path,
+                    "output": output_dir,
+                    "cwd": ".",
+                },
+                path=socket_file,
+            )["ok"]
+            is False
+        )
+    finally:
+        server.shutdown()
+        thread.join()
+    assert not os.path.exists(socket_file)
+
+
+def test_forward_environment(socket_file, deck, monkeypatch):
+    pytest.importorskip("PIL")
+    from PIL import Image
+
+    doc_path, output_dir = deck
+    Image.new("RGB", (16, 16), "red").save(
+        os.path.join(os.path.dirname(doc_path), "image.png")
+    )
+    monkeypatch.setenv("MOFFEE_CACHE_DIR", "/client/cache")
+    assert daemon.build_environment()["MOFFEE_CACHE_DIR"] == "/client/cache"
+    monkeypatch.delenv("MOFFEE_CACHE_DIR")
+
+    server, thread = start_server(socket_file)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            response = daemon.request(
+                {
+                    "command": "make",
+                    "version": daemon.__version__,
+                    "markdown": doc_path,
+                    "output": output_dir,
+                    "cwd": os.path.dirname(doc_path),
+                    "optimize_images": True,
+                    "env": {"MOFFEE_CACHE_DIR": cache_dir},
+                },
+                path=socket_file,
+            )
+            assert response["ok"]
+            assert os.listdir(os.path.join(cache_dir, "images"))
+        # The client's environment only applies to its build
+        assert "MOFFEE_CACHE_DIR" not in os.environ
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+@pytest.mark.parametrize("reply", [b'{"ok": true, "sta', b"[]\n", b"not json\n"])
+def test_malformed_reply(socket_file, deck, reply):
+    doc_path, output_dir = deck
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_file)
+    listener.listen()
+
+    def answer():
+        conn, _ = listener.accept()
+        with conn, conn.makefile("rb") as f:
+            f.readline()
+            conn.sendall(reply)
+
+    thread = threading.Thread(target=answer, daemon=True)
+    thread.start()
+    try:
+        assert daemon.forward_make(doc_path, output_dir, path=socket_file) is None
+    finally:
+        thread.join(timeout=5)
+        listener.close()
+
+
+def test_idle_shutdown(socket_file):
+    server, thread = start_server(socket_file, idle_timeout=0.2)
+    assert daemon.request({"command": "ping"}, path=socket_file)["ok"]
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert not os.path.exists(socket_file)
+
+
+def test_stale_socket_is_replaced(socket_file):
+    # Simulate a daemon that died without cleaning up
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_file)
+    stale.close()
+    assert os.path.exists(socket_file)
+
+    server, thread = start_server(socket_file)
+    try:
+        assert daemon.request({"command": "ping"}, path=socket_file)["ok"]
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_socket_only_accessible_to_user(socket_file):
+    server, thread = start_server(socket_file)
+    try:
+        assert os.stat(socket_file).st_mode & 0o777 == 0o600
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_private_socket_dir(monkeypatch):
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        monkeypatch.delenv("MOFFEE_DAEMON_SOCKET", raising=False)
+        monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+        monkeypatch.setattr(tempfile, "tempdir", temp_dir)
+        path = daemon.socket_path()
+        assert os.path.dirname(path) == daemon.private_dir()
+        server, thread = start_server(path)
+        try:
+            assert os.stat(daemon.private_dir()).st_mode & 0o777 == 0o700
+            assert daemon.request({"command": "ping"})["ok"]
+        finally:
+            server.shutdown()
+            thread.join()
+
+        # A directory other users can write to is refused
+        os.chmod(daemon.private_dir(), 0o777)
+        with pytest.raises(RuntimeError):
+            daemon.DaemonServer(path)
+
+
+def test_foreign_socket_is_ignored(socket_file):
+    # Not a socket
+    with open(socket_file, "w") as f:
+        f.write("")
+    assert daemon.request({"command": "ping"}, path=socket_file) is None
+    os.unlink(socket_file)
+
+    if os.getuid() != 0:
+        pytest.skip("creating a socket of another user requires root")
+    # A listener of another user, which would answer like a daemon
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_file)
+    listener.listen()
+    os.chown(socket_file, 12345, 12345)
+    try:
+        assert daemon.request({"command": "ping"}, path=socket_file) is None
+    finally:
+        listener.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_PEERCRED"), reason="Linux only")
+def test_peer_uid():
+    left, right = socket.socketpair(socket.AF_UNIX)
+    with left, right:
+        assert daemon._peer_uid(left) == os.getuid()
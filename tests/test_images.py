@@ -0,0 +1,113 @@
+import os
+import tempfile
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image  # noqa: E402
+
+from moffee.builder import build, build_single_file, read_options  # noqa: E402
+from moffee.utils.build_stats import collect_stats  # noqa: E402
+from moffee.utils.images import optimize_images  # noqa: E402
+
+
+@pytest.fixture
+def images(monkeypatch):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setenv("MOFFEE_CACHE_DIR", os.path.join(temp_dir, "cache"))
+        photo = os.path.join(temp_dir, "photo.jpg")
+        # Gradients with some noise, roughly like a real photo
+        noise = Image.effect_noise((3000, 2000), 5)
+        gradient = Image.linear_gradient("L").resize((3000, 2000))
+        Image.merge("RGB", (gradient, noise, gradient.rotate(90))).save(
+            photo, quality=95
+        )
+        # GIFs are left untouched
+        icon = os.path.join(temp_dir, "icon.gif")
+        Image.new("RGB", (16, 16), "red").save(icon)
+        yield temp_dir, photo, icon
+
+
+def test_optimize_images(images):
+    _, photo, icon = images
+    html = f'<img alt="photo" src="{photo}"><img src="{icon}"><img src="https://x.y/z.jpg">'
+    with collect_stats() as stats:
+        result, originals = optimize_images(html, (720, 405))
+
+    optimized = next(path for path, source in originals.items() if source == photo)
+    assert f'src="{optimized}"' in result
+    assert f'src="{icon}"' in result
+    assert 'src="https://x.y/z.jpg"' in result
+    with Image.open(optimized) as image:
+        assert image.size == (1215, 810)
+    assert os.path.getsize(optimized) < os.path.getsize(photo)
+    assert stats.counters["images_optimized"] == 1
+    assert stats.counters["images_misses"] == 1
+
+    with collect_stats() as stats:
+        assert optimize_images(html, (720, 405)) == (result, originals)
+    assert stats.counters["images_hits"] == 1
+    assert "images_misses" not in stats.counters
+
+
+def test_optimize_images_webp(images):
+    _, photo, _ = images
+    result, originals = optimize_images(f'<img src="{photo}">', (720, 405), webp=True)
+    webp = next(path for path in originals if path.endswith(".webp"))
+    assert result.startswith(
+        f'<picture><source srcset="{webp}" type="image/webp"><img '
+    )
+    assert result.endswith("</picture>")
+
+
+def test_build_optimize_images(images, template_dir):
+    temp_dir, photo, _ = images
+    doc_path = os.path.join(temp_dir, "deck.md")
+    output_dir = os.path.join(temp_dir, "output")
+    with open(doc_path, "w", encoding="utf8") as f:
+        f.write("# Photo\n![photo](photo.jpg)\n")
+    theme = template_dir(read_options(doc_path).theme)
+
+    build(doc_path, output_dir, template_dir(), theme, optimize_images=True, webp=True)
+    assets = sorted(os.listdir(os.path.join(output_dir, "assets")))
+    assert {os.path.splitext(name)[1] for name in assets} == {".jpg", ".webp"}
+    with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+        html = f.read()
+    assert all(f"assets/{name}" in html for name in assets)
+    # Cached images are readable like the other files of the output
+    umask = os.umask(0)
+    os.umask(umask)
+    for name in assets:
+        mode = os.stat(os.path.join(output_dir, "assets", name)).st_mode & 0o777
+        assert mode == 0o666 & ~umask
+
+    stats = build(
+        doc_path, output_dir, template_dir(), theme, optimize_images=True, webp=True
+    )
+    assert stats.counters["manifest_hits"] == 1
+
+    # Changing the source image invalidates the build
+    Image.new("RGB", (3000, 2000), "blue").save(photo)
+    stats = build(
+        doc_path, output_dir, template_dir(), theme, optimize_images=True, webp=True
+    )
+    assert stats.counters["manifest_misses"] == 1
+
+
+def test_single_file_without_webp(images, template_dir):
+    temp_dir, photo, _ = images
+    doc_path = os.path.join(temp_dir, "deck.md")
+    output_file = os.path.join(temp_dir, "deck.html")
+    with open(doc_path, "w", encoding="utf8") as f:
+        f.write("# Photo\n![photo](photo.jpg)\n")
+    theme = template_dir(read_options(doc_path).theme)
+
+    build_single_file(
+        doc_path, output_file, template_dir(), theme, optimize_images=True, webp=True
+    )
+    with open(output_file, encoding="utf8") as f:
+        html = f.read()
+    # Each image is embedded once
+    assert "<picture>" not in html
+    assert "data:image/webp" not in html
+    assert html.count("data:image/jpeg;base64,") == 1
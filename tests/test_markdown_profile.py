@@ -0,0 +1,47 @@
+import pytest
+from markdown import markdown
+from moffee.markdown import extension_configs, extension_profile, extensions, md
+from moffee.utils.build_stats import collect_stats
+from tests.test_md_backends import PARITY_CORPUS
+
+# Documents whose syntax sits right at the edge of the extension triggers
+EDGE_CORPUS = [
+    "Plain prose without any markup at all.",
+    "Title\n=====\n\nSub\n---",
+    "Indented code:\n\n    #!python print(1)",
+    "Contact: someone@example.org",
+    "Emphasis *only* and **strong**",
+    "A [!note] inside text",
+    "<h2>Raw heading</h2>",
+    "[TOC]\n\n# One\n## Two",
+    "1^st^ and 2~nd~",
+    "a == b and c != d",
+]
+
+
+@pytest.mark.parametrize("text", PARITY_CORPUS + EDGE_CORPUS)
+def test_adaptive_profile_output_unchanged(text):
+    expected = markdown(
+        text, extensions=extensions, extension_configs=extension_configs
+    )
+    assert md(text) == expected
+
+
+def test_profile_plain_prose():
+    profile = extension_profile("Just some *plain* prose.\n\nAnother paragraph.")
+    assert "pymdownx.magiclink" not in profile
+    assert "toc" not in profile
+    assert "wikilinks" not in profile
+    assert "pymdownx.extra" in profile
+    assert "nl2br" in profile
+
+
+def test_profile_keeps_order():
+    profile = extension_profile("# [[Link]] ==mark== https://x.y")
+    assert list(profile) == [ext for ext in extensions if ext in profile]
+
+
+def test_profile_skips_counted():
+    with collect_stats() as stats:
+        md("plain text")
+    assert stats.counters["extensions_skipped"] > 0
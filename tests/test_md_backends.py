@@ -0,0 +1,55 @@
+import pytest
+from moffee.builder import render
+from moffee.markdown import get_backend, md, md_it
+
+# Both backends must produce identical html for these documents.
+# Known differences: footnotes, abbreviations, attribute lists and markdown="1" html blocks
+# are only supported by the python-markdown backend.
+PARITY_CORPUS = [
+    "Hello **world** and *em* __strong__ _em_",
+    "==mark== ^^insert^^ ~~delete~~ H~2~O x^2^ and x^2 y^",
+    "**bold ==mark==** and ==mark **bold**==",
+    "- [ ] todo\n- [x] done",
+    "1. [ ] one\n2. [x] two",
+    "- plain\n- list",
+    '!!! note "Custom title"\n    body\n\n!!! warning\n    text',
+    "> [!tip] Title\n> body",
+    "> [!note]\n> no title",
+    "> [!danger]",
+    "> [!tip] Outer\n> body\n> > [!note]\n> > inner\n\nafter",
+    "> plain quote",
+    "```python\nprint(1)\n```",
+    "```\nplain <x>\n```",
+    "```mermaid\ngraph TD; A-->B\n```",
+    "`code` and `#!python print(1)`",
+    "See https://example.com, www.example.org. or (https://a.com/x)",
+    "Mail me@example.com",
+    "[[Wiki Link]] and [link](http://x.y)",
+    "# Héllo World!\n# Héllo World!\n## Title *em*",
+    "| a | b |\n|---|---|\n| 1 | 2 |",
+    "term\n: definition",
+    "line1\nline2",
+    "x <b>raw</b> html",
+    "![img](image.png)",
+]
+
+
+@pytest.mark.parametrize("text", PARITY_CORPUS)
+def test_backend_parity(text):
+    assert str(md_it(text)).strip() == str(md(text)).strip()
+
+
+def test_get_backend():
+    assert get_backend("python-markdown") is md
+    assert get_backend("markdown-it") is md_it
+    with pytest.raises(ValueError):
+        get_backend("commonmark")
+
+
+def test_backend_selection():
+    doc = "---\nmarkdown_backend: markdown-it\n---\n# Title\nText[^1]\n\n[^1]: note"
+    # footnote markup tells the backends apart
+    assert 'class="footnotes"' in render(doc).html
+    assert 'class="footnote"' in render(doc, markdown_backend="python-markdown").html
+    with pytest.raises(ValueError):
+        render(doc, markdown_backend="nope")
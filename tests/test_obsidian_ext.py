@@ -166,3 +166,33 @@ def test_admonition_with_code_block():
 </div>
 """
     check_markdown_conversion(text, expected)
+
+
+def test_directly_nested():
+    text = """
+> [!note] Outer
+> > [!tip] Inner
+> > inner text
+> outer text
+"""
+    expected = """
+<div class="admonition note">
+<p class="admonition-title">Outer</p>
+<div class="admonition tip">
+<p class="admonition-title">Inner</p>
+<p>inner text</p>
+</div>
+<p>outer text</p>
+</div>
+"""
+    check_markdown_conversion(text, expected)
+
+
+def test_deeply_nested_chain():
+    depth = 400
+    text = "\n".join(
+        "> " * level + f"[!note] Level {level}" for level in range(1, depth + 1)
+    )
+    md = markdown(text, extensions=["moffee.utils.md_obsidian_ext"])
+    assert md.count('<div class="admonition note">') == depth
+    assert md.index("Level 1<") < md.index(f"Level {depth}<")
@@ -0,0 +1,219 @@
+import gzip
+import os
+import re
+import tempfile
+
+import pytest
+from moffee.builder import build
+from moffee.utils.build_stats import collect_stats
+from moffee.utils.manifest import MANIFEST_NAME
+from moffee.utils.optimize import (
+    minify_css,
+    minify_html,
+    minify_js,
+    precompress,
+    prune_css,
+    selector_used,
+    used_selectors,
+)
+
+HTML = """<!DOCTYPE html>
+<html>
+    <head>
+        <!-- comment -->
+        <style>
+            :root { --slide-width: 720px; }
+        </style>
+    </head>
+    <body>
+        <div   class="chunk">
+            <p>Some    text
+               <em>kept</em> apart</p>
+            <pre><code>def f():
+    return   1</code></pre>
+            <p><code>a   b</code></p>
+            <div class="mermaid">graph TD
+    A--&gt;B</div>
+            <textarea>  keep  </textarea>
+        </div>
+        <script>
+            if (a < b) { x = "  y  "; }
+        </script>
+    </body>
+</html>
+"""
+
+
+def test_minify_html():
+    result = "".join(minify_html([HTML]))
+    assert "comment" not in result
+    assert '<div class="chunk">' in result
+    assert "<p>Some text\n<em>kept</em> apart</p>" in result
+    assert "<pre><code>def f():\n    return   1</code></pre>" in result
+    assert "<code>a   b</code>" in result
+    assert '<div class="mermaid">graph TD\n    A--&gt;B</div>' in result
+    assert "<textarea>  keep  </textarea>" in result
+    assert 'if (a < b) { x = "  y  "; }' in result
+    assert ":root{--slide-width: 720px}" in result
+    assert len(result) < len(HTML)
+
+
+def test_minify_html_streaming():
+    expected = "".join(minify_html([HTML]))
+    assert "".join(minify_html(HTML)) == expected
+    chunks = [HTML[i : i + 7] for i in range(0, len(HTML), 7)]
+    assert "".join(minify_html(chunks)) == expected
+
+
+def test_minify_css():
+    css = """/* comment */
+.a > .b ,
+.c  :hover {
+    content: " { ; } ";
+    margin: 0 auto;
+}
+@media (max-width: 600px) { .d { width: calc(100% - 2px); } }
+"""
+    assert minify_css(css) == (
+        '.a>.b,.c :hover{content: " { ; } ";margin: 0 auto}'
+        "@media (max-width: 600px){.d{width: calc(100% - 2px)}}"
+    )
+    # Only the last semicolon of a block is dropped, not those in strings or url() values
+    assert minify_css('a { content: ";}"; background: url(data:x;}) ; }') == (
+        'a{content: ";}";background: url(data:x;})}'
+    )
+
+
+def test_used_selectors():
+    used = used_selectors(
+        '<div class="slide  chunk" id="s1"><P>text</P></div>',
+        ["el.classList.add('visible'); x = \"a b\""],
+    )
+    assert {".slide", ".chunk", "#s1", "div", "p", ".visible", ".a", ".b"} <= used
+    assert ".text" not in used
+
+
+@pytest.mark.parametrize(
+    "selector, expected",
+    [
+        ("div.slide > p", True),
+        ("div.slide .missing", False),
+        ("#s1:hover::before", True),
+        ("p:not(.missing)", True),
+        ("a[href$='.pdf']", False),
+        ("body.presentation-mode .slide.active", True),
+        (".mermaid .node rect", True),
+        ("mjx-container", True),
+        (":root", True),
+        ("*", True),
+    ],
+)
+def test_selector_used(selector, expected):
+    assert (
+        selector_used(selector, {".slide", "#s1", "div", "p", "body", ".mermaid"})
+        == expected
+    )
+
+
+def test_prune_css():
+    css = """@import url('https://example.com/font.css?a=1;b=2');
+/* Header */
+.used, .unused { content: "}"; }
+.unused { color: red; }
+@media print {
+    .used { color: blue; }
+}
+@media (max-width: 600px) {
+    .unused { color: green; }
+}
+@page { margin: 0; }
+"""
+    assert minify_css(prune_css(css, {".used"})) == (
+        "@import url('https://example.com/font.css?a=1;b=2');"
+        '.used{content: "}"}'
+        "@media print{.used{color: blue}}"
+        "@page{margin: 0}"
+    )
+
+
+@pytest.mark.parametrize(
+    "js, expected",
+    [
+        ("var a = b / c;  // divide\nvar r = /a b/g;", "var a=b/c;\nvar r=/a b/g;"),
+        ("return /x/.test(y)", "return/x/.test(y)"),
+        ("a + +b; c - -d", "a+ +b;c- -d"),
+        ("s = 'a // b' /* c */ + `${x}  y`", "s='a // b'+`${x}  y`"),
+        ("if (a) {\n    b()\n}\n\n(c)", "if(a){\nb()\n}\n(c)"),
+    ],
+)
+def test_minify_js(js, expected):
+    assert minify_js(js) == expected
+
+
+def test_build_optimize(template_dir):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "deck.md")
+        output_dir = os.path.join(temp_dir, "output")
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write("# Title\n\n```python\nx  =  1\n```\n")
+        stats = build(doc_path, output_dir, template_dir(), optimize=True)
+
+        assert not os.path.exists(os.path.join(output_dir, "layouts"))
+        assert not os.path.exists(os.path.join(output_dir, "css", "styles.css"))
+        with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+            html = f.read()
+        references = re.findall(r'(?:href|src)="((?:css|js)/[^"]+)"', html)
+        assert len(references) == 5
+        for path in references:
+            assert re.search(r"\.[0-9a-f]{10}\.(css|js)$", path)
+            assert os.path.isfile(os.path.join(output_dir, path))
+        assert '<span class="n">x</span>  <span' in html
+
+        with gzip.open(
+            os.path.join(output_dir, "index.html.gz"), "rt", encoding="utf8"
+        ) as f:
+            assert f.read() == html
+        assert stats.counters["files_precompressed"] >= 3
+        assert stats.counters["css_selectors_pruned"] > 0
+        with open(os.path.join(output_dir, references[1]), encoding="utf8") as f:
+            css = f.read()
+        assert "div.admonition" not in css
+        assert "body.presentation-mode .slide-container.active" in css
+
+
+def test_precompress_incremental(tmp_path):
+    def write(path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf8")
+
+    page = tmp_path / "index.html"
+    write(page, "<p>deck</p>" * 100)
+    write(tmp_path / MANIFEST_NAME, '{"assets": {}}' * 100)
+    # A deck nested in the output, compressed by its own build
+    write(tmp_path / "part" / MANIFEST_NAME, "{}")
+    write(tmp_path / "part" / "index.html", "<p>part</p>" * 100)
+
+    with collect_stats() as stats:
+        precompress(str(tmp_path))
+    assert (tmp_path / "index.html.gz").exists()
+    assert not (tmp_path / "part" / "index.html.gz").exists()
+    assert not (tmp_path / (MANIFEST_NAME + ".gz")).exists()
+    compressed = stats.counters["files_precompressed"]
+
+    # Files compressed already are skipped
+    with collect_stats() as stats:
+        precompress(str(tmp_path))
+    assert "files_precompressed" not in stats.counters
+
+    # Changed files are compressed again, and copies that don't save space anymore removed
+    write(page, "<p>changed</p>" * 100)
+    # Written in the same clock tick as the compressed copy otherwise
+    os.utime(page, ns=(0, 1))
+    with collect_stats() as stats:
+        precompress(str(tmp_path))
+    assert stats.counters["files_precompressed"] == compressed
+    with gzip.open(tmp_path / "index.html.gz", "rt", encoding="utf8") as f:
+        assert f.read() == page.read_text(encoding="utf8")
+    write(page, "<p>small</p>")
+    precompress(str(tmp_path))
+    assert not (tmp_path / "index.html.gz").exists()
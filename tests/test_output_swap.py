@@ -0,0 +1,196 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from moffee.builder import build, build_site, theme_dirs
+from moffee.utils.output_swap import (
+    CARRIED_NAME,
+    GRACE_PERIOD,
+    generations_dir,
+    staged_output,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield temp_dir
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf8") as f:
+        f.write(content)
+
+
+def read(path):
+    with open(path, encoding="utf8") as f:
+        return f.read()
+
+
+def test_staged_output_swap(temp_dir, monkeypatch):
+    output_dir = os.path.join(temp_dir, "output")
+    with staged_output(output_dir) as staging_dir:
+        write(os.path.join(staging_dir, "index.html"), "first")
+        write(os.path.join(staging_dir, "css", "styles.0123.css"), "old")
+        assert not os.path.exists(output_dir)
+    assert os.path.islink(output_dir)
+    assert read(os.path.join(output_dir, "index.html")) == "first"
+
+    with staged_output(output_dir) as staging_dir:
+        write(os.path.join(staging_dir, "index.html"), "second")
+        write(os.path.join(staging_dir, "css", "styles.4567.css"), "new")
+        assert read(os.path.join(output_dir, "index.html")) == "first"
+    assert read(os.path.join(output_dir, "index.html")) == "second"
+    # Files of the previous generation are still served during the grace period
+    assert read(os.path.join(output_dir, "css", "styles.0123.css")) == "old"
+    assert os.path.exists(os.path.join(output_dir, CARRIED_NAME))
+
+    with staged_output(output_dir, grace_period=0) as staging_dir:
+        write(os.path.join(staging_dir, "index.html"), "third")
+    assert os.listdir(os.path.join(output_dir, "css")) == ["styles.0123.css"]
+
+    # Once the grace period is over, carried files and replaced generations are gone
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + GRACE_PERIOD + 1)
+    with staged_output(output_dir) as staging_dir:
+        write(os.path.join(staging_dir, "index.html"), "fourth")
+    assert os.listdir(output_dir) == ["index.html"]
+
+
+def test_staged_output_failure(temp_dir):
+    output_dir = os.path.join(temp_dir, "output")
+    with staged_output(output_dir) as staging_dir:
+        write(os.path.join(staging_dir, "index.html"), "first")
+    with pytest.raises(RuntimeError):
+        with staged_output(output_dir) as staging_dir:
+            write(os.path.join(staging_dir, "index.html"), "partial")
+            raise RuntimeError()
+    assert read(os.path.join(output_dir, "index.html")) == "first"
+    assert len(os.listdir(generations_dir(output_dir))) == 1
+
+
+def test_staged_output_replaces_directory(temp_dir):
+    output_dir = os.path.join(temp_dir, "output")
+    write(os.path.join(output_dir, "index.html"), "plain directory")
+    with staged_output(output_dir) as staging_dir:
+        write(os.path.join(staging_dir, "index.html"), "generation")
+    assert os.path.islink(output_dir)
+    assert read(os.path.join(output_dir, "index.html")) == "generation"
+
+
+def test_build_never_partial(temp_dir):
+    doc_path = os.path.join(temp_dir, "deck.md")
+    write(doc_path, "# Deck\n![Image](image.png)\n")
+    write(os.path.join(temp_dir, "image.png"), "fake image content")
+    output_dir = os.path.join(temp_dir, "output")
+    build(doc_path, output_dir, *theme_dirs("default"))
+
+    missing = []
+    done = threading.Event()
+
+    def poll():
+        while not done.is_set():
+            for name in ["index.html", "css/styles.css", "js/main.js"]:
+                if not os.path.isfile(os.path.join(output_dir, name)):
+                    missing.append(name)
+
+    reader = threading.Thread(target=poll)
+    reader.start()
+    try:
+        # Concurrent builds of the same output
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [
+                pool.submit(
+                    build, doc_path, output_dir, *theme_dirs("default"), force=True
+                )
+                for _ in range(8)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        done.set()
+        reader.join()
+
+    assert missing == []
+    assert "Deck" in read(os.path.join(output_dir, "index.html"))
+    assert len(os.listdir(os.path.join(output_dir, "assets"))) == 1
+
+
+def test_output_readable(temp_dir):
+    output_dir = os.path.join(temp_dir, "output")
+    with staged_output(output_dir) as staging_dir:
+        write(os.path.join(staging_dir, "index.html"), "first")
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(output_dir).st_mode & 0o777 == 0o777 & ~umask
+
+
+def test_site_swapped(temp_dir):
+    intro = os.path.join(temp_dir, "talks", "intro.md")
+    # A deck nested in the directory of another one
+    nested = os.path.join(temp_dir, "talks", "intro", "part.md")
+    write(intro, "# Intro\n")
+    write(nested, "# Part\n")
+    site_dir = os.path.join(temp_dir, "public")
+    build_site([intro, nested], site_dir)
+    assert os.path.islink(site_dir)
+    first_generation = os.path.realpath(site_dir)
+
+    # A failing build leaves the whole site untouched
+    write(intro, "# Intro, updated\n")
+    os.unlink(nested)
+    with pytest.raises(FileNotFoundError):
+        build_site([intro, nested], site_dir)
+    assert os.path.realpath(site_dir) == first_generation
+    assert "updated" not in read(os.path.join(site_dir, "intro", "index.html"))
+
+    # Up to date decks are kept in the new generation, and nested decks too
+    write(nested, "# Part\n")
+    stats = build_site([intro, nested], site_dir)
+    assert stats.counters["manifest_hits"] == 1
+    assert os.path.realpath(site_dir) != first_generation
+    assert "updated" in read(os.path.join(site_dir, "intro", "index.html"))
+    assert "Part" in read(os.path.join(site_dir, "intro", "part", "index.html"))
+    # The previous generation is unchanged by the build
+    assert "updated" not in read(os.path.join(first_generation, "intro", "index.html"))
+
+
+def test_user_symlink_written_through(temp_dir):
+    served = os.path.join(temp_dir, "srv", "deck")
+    os.makedirs(served)
+    output_dir = os.path.join(temp_dir, "output")
+    os.symlink(served, output_dir)
+
+    for content in ["first", "second"]:
+        with staged_output(output_dir) as staging_dir:
+            write(os.path.join(staging_dir, "index.html"), content)
+        # The user's link is kept, the build goes where it points to
+        assert os.readlink(output_dir) == served
+        assert read(os.path.join(served, "index.html")) == content
+    assert os.path.isdir(generations_dir(served))
+    assert not os.path.exists(generations_dir(output_dir))
+
+
+def test_unchanged_assets_linked(temp_dir):
+    doc_path = os.path.join(temp_dir, "deck.md")
+    write(doc_path, "# Deck\n![img](image.png)\n")
+    write(os.path.join(temp_dir, "image.png"), "image")
+    output_dir = os.path.join(temp_dir, "output")
+    build(doc_path, output_dir, *theme_dirs("beam"))
+    first_generation = os.path.realpath(output_dir)
+
+    write(doc_path, "# Deck, updated\n![img](image.png)\n")
+    stats = build(doc_path, output_dir, *theme_dirs("beam"))
+    assert stats.counters["assets_linked"] == 1
+    assert stats.counters.get("assets_copied", 0) == 0
+    (name,) = os.listdir(os.path.join(output_dir, "assets"))
+    # The replaced generation shares the asset instead of holding a copy of it
+    assert os.path.samefile(
+        os.path.join(output_dir, "assets", name),
+        os.path.join(first_generation, "assets", name),
+    )
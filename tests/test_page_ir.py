@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from moffee.builder import deck_data, retrieve_structure
+from moffee.compositor import Chunk, Direction, Type, composite
+from moffee.utils.build_stats import collect_stats
+from moffee.utils.page_ir import (
+    chunk_from_ir,
+    chunk_to_ir,
+    document_to_ir,
+    dumps_ir,
+    pages_from_ir,
+    parse_document,
+)
+
+DOC = """
+---
+theme: beam
+background-color: red
+---
+# Intro
+@(layout=centered, color=blue)
+Left
+<->
+Right
+===
+Bottom
+## Details
+- one
+- two
+---
+@(default_h2=false)
+No inherited h2
+"""
+
+
+def test_chunk_round_trip():
+    paragraph = Chunk(paragraph="text\n")
+    assert chunk_to_ir(paragraph) == "text\n"
+    tree = Chunk(
+        children=[Chunk(children=[paragraph, paragraph], type=Type.NODE), paragraph],
+        direction=Direction.VERTICAL,
+        type=Type.NODE,
+    )
+    assert chunk_from_ir(json.loads(json.dumps(chunk_to_ir(tree)))) == tree
+
+
+def test_pages_round_trip():
+    pages = composite(DOC)
+    loaded = pages_from_ir(json.loads(dumps_ir(document_to_ir(DOC))))
+    assert loaded == pages
+    assert [page.chunk for page in loaded] == [page.chunk for page in pages]
+
+
+def test_ir_layout():
+    ir = document_to_ir(DOC)
+    assert ir["title"] == "Intro"
+    assert ir["options"]["theme"] == "beam"
+    assert ir["options"]["styles"] == {"background-color": "red"}
+    assert ir["struct"] == retrieve_structure(composite(DOC))
+
+    first, second, third = ir["pages"]
+    # Pages only record what their decos change
+    assert first["options"] == {
+        "layout": "centered",
+        "styles": {"background-color": "red", "color": "blue"},
+    }
+    assert "options" not in second
+    assert third["options"] == {"default_h2": False}
+    # Missing headings are left out
+    assert second["h2"] == "Details" and "h1" not in second
+    assert "h2" not in third
+    assert first["chunk"]["direction"] == Direction.VERTICAL
+
+
+def test_parse_cache():
+    document = DOC + "\nA paragraph only in this test"
+    with collect_stats() as stats:
+        first = parse_document(document)
+        second = parse_document(document)
+    assert first == second
+    assert stats.counters["parse_misses"] == 1
+    assert stats.counters["parse_hits"] == 1
+
+
+def test_parse_cache_persistent(tmp_path, monkeypatch):
+    monkeypatch.setenv("MOFFEE_CACHE_DIR", str(tmp_path))
+    document = DOC + "\nA paragraph only in the persistent test"
+    parse_document(document)
+    assert (tmp_path / "parse").is_dir()
+
+
+def test_deck_data_from_ir():
+    data = deck_data(DOC)
+    assert [slide["h2"] for slide in data["slides"]] == [None, "Details", None]
+    assert data["slides"][0]["layout"] == "centered"
+    assert data["struct"] == retrieve_structure(composite(DOC))
+
+
+def test_unsupported_version():
+    ir = document_to_ir(DOC)
+    ir["version"] = 0
+    with pytest.raises(ValueError):
+        pages_from_ir(ir)
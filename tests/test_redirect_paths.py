@@ -75,3 +75,12 @@ invalid: "invalid.txt"
 """
     redirected_document = redirect_paths(document, doc_path)
     assert redirected_document == document
+
+
+def test_redirect_paths_after_empty_attribute(setup_test_env):
+    temp_dir, doc_path, res_dir = setup_test_env
+
+    redirected_document = redirect_paths('<img alt="" src="image.png" />', doc_path)
+
+    expected_path_image1 = os.path.abspath(os.path.join(temp_dir, "image.png"))
+    assert redirected_document == f'<img alt="" src="{expected_path_image1}" />'
@@ -0,0 +1,262 @@
+import base64
+import hashlib
+import os
+import re
+import shutil
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from moffee.builder import build
+from moffee.utils.build_stats import collect_stats
+from moffee.utils.remote import ConnectionPool, RemoteDownloader, cached_filename
+
+TEMPLATE_ROOT = os.path.join(os.path.dirname(__file__), "..", "moffee", "templates")
+
+
+class Files(dict):
+    """Files served by the stand-in server, by path, with the requests it received"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+        self.clients = set()
+
+    def put(self, path, content, content_type="image/png"):
+        etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+        self[path] = (content, content_type, etag)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Local HTTP server standing in for remote hosts, with an empty download cache"""
+    monkeypatch.setenv("MOFFEE_CACHE_DIR", str(tmp_path / "cache"))
+    files = Files()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            files.requests.append((self.path, self.headers.get("If-None-Match")))
+            files.clients.add(self.client_address)
+            if self.path == "/moved.png":
+                self.send_response(302)
+                self.send_header("Location", "/logo.png")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if self.path not in files:
+                self.send_error(404)
+                return
+            content, content_type, etag = files[self.path]
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(usegmt=True))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    files.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    files.stop = lambda: (httpd.shutdown(), httpd.server_close())
+    yield files
+    files.stop()
+
+
+def read(path, mode="rb"):
+    with open(path, mode) as f:
+        return f.read()
+
+
+def test_download_and_revalidate(server):
+    server.put("/logo.png", b"logo")
+    server.put("/style.css", b"body {}", "text/css")
+    server.put("/app.js", b"let a;", "text/javascript")
+    html = (
+        f'<img src="{server.url}/logo.png" alt="logo">\n'
+        f'<link rel="stylesheet" href="{server.url}/style.css">\n'
+        f'<script src="{server.url}/app.js"></script>\n'
+        f'<a href="{server.url}/logo.png">page</a>\n'
+        f'<link rel="canonical" href="{server.url}/style.css">\n'
+    )
+
+    with collect_stats() as stats, RemoteDownloader() as download:
+        localized = download(html)
+    assert stats.counters["remote_misses"] == 3
+    lines = localized.splitlines()
+    assert read(lines[0].split('"')[1]) == b"logo"
+    assert read(lines[1].split('"')[3]) == b"body {}"
+    assert read(lines[2].split('"')[1]) == b"let a;"
+    # Links to pages stay remote
+    assert lines[3:] == html.splitlines()[3:]
+
+    # Cached copies are revalidated, not downloaded again
+    with collect_stats() as stats, RemoteDownloader() as download:
+        assert download(html) == localized
+    assert stats.counters["remote_hits"] == 3
+    assert "remote_misses" not in stats.counters
+    assert server.requests[-1][1] is not None
+
+    server.put("/logo.png", b"new logo")
+    with collect_stats() as stats, RemoteDownloader() as download:
+        assert read(download(html).split('"')[1]) == b"new logo"
+    assert stats.counters["remote_misses"] == 1
+
+
+def test_download_once_per_downloader(server):
+    server.put("/logo.png", b"logo")
+    html = f'<img src="{server.url}/logo.png">\n'
+    with RemoteDownloader() as download:
+        assert download(html * 3) == download(html) * 3
+    assert len(server.requests) == 1
+
+
+def test_redirects_and_failures(server):
+    server.put("/logo.png", b"logo")
+    with RemoteDownloader() as download:
+        localized = download(f'<img src="{server.url}/moved.png">')
+        assert read(localized.split('"')[1]) == b"logo"
+
+        missing = f'<img src="{server.url}/missing.png">'
+        with collect_stats() as stats, pytest.warns(UserWarning, match="stays remote"):
+            assert download(missing) == missing
+        assert stats.counters["remote_failed"] == 1
+
+    # Without the server, the cached copy is used
+    server.stop()
+    with RemoteDownloader() as download, pytest.warns(UserWarning, match="cached copy"):
+        assert download(f'<img src="{server.url}/moved.png">') == localized
+
+
+def test_integrity(server):
+    server.put("/style.css", b"body {}", "text/css")
+    digest = base64.b64encode(hashlib.sha384(b"body {}").digest()).decode()
+    tag = (
+        f'<link href="{server.url}/style.css" rel="stylesheet" integrity="sha384-{digest}" '
+        'crossorigin="anonymous">'
+    )
+    with RemoteDownloader() as download:
+        localized = download(tag)
+        assert 'integrity="' not in localized and 'crossorigin="' not in localized
+        assert server.url not in localized
+
+        tampered = tag.replace(digest, "x" + digest[1:])
+        with pytest.warns(UserWarning, match="integrity"):
+            assert download(tampered) == tampered
+
+
+def test_stylesheet_references(server):
+    server.put(
+        "/css/style.css",
+        b'@import "parts/more.css";\n'
+        b"@font-face { src: url(fonts/font.woff2) format('woff2'); }\n"
+        b".a { background: url('/missing.png'), url(data:image/png;base64,AA==); }\n"
+        b".b { mask: url(#mask); }",
+        "text/css",
+    )
+    more_css = b'.c { background: url("../../logo.png"); }'
+    server.put("/css/parts/more.css", more_css, "text/css")
+    server.put("/css/fonts/font.woff2", b"font", "font/woff2")
+    server.put("/logo.png", b"logo")
+    tag = f'<link rel="stylesheet" href="{server.url}/css/style.css">'
+
+    with RemoteDownloader() as download, pytest.warns(UserWarning, match="missing.png"):
+        css = read(download(tag).split('"')[3], "r")
+    more = b'.c { background: url("data:image/png;base64,bG9nbw=="); }'
+    more = base64.b64encode(more)
+    assert f'@import "data:text/css;base64,{more.decode()}";' in css
+    assert 'url("data:font/woff2;base64,Zm9udA==")' in css
+    # References that can't be downloaded stay remote, with an absolute url
+    assert f'url("{server.url}/missing.png")' in css
+    assert "url(data:image/png;base64,AA==)" in css
+    assert "url(#mask)" in css
+
+    # The copy with embedded references keeps its mtime while unchanged
+    with RemoteDownloader() as download, pytest.warns(UserWarning):
+        path = download(tag).split('"')[3]
+    mtime = os.stat(path).st_mtime_ns
+    with RemoteDownloader() as download, pytest.warns(UserWarning):
+        assert download(tag).split('"')[3] == path
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_keep_remote(server):
+    server.put("/app.js", b"let a;")
+    tag = f'<script src="{server.url}/app.js" data-moffee-remote="keep"></script>'
+    with RemoteDownloader() as download:
+        assert download(tag) == tag
+    assert server.requests == []
+
+
+def test_connections_reused(server):
+    server.put("/logo.png", b"logo")
+    pool = ConnectionPool()
+    for _ in range(3):
+        with pool.get(f"{server.url}/logo.png", {}) as response:
+            assert response.read() == b"logo"
+    pool.close()
+    assert len(server.clients) == 1
+
+
+def test_cached_filename():
+    assert cached_filename("https://x.org/a/logo.png?v=2", "image/png") == "logo.png"
+    assert cached_filename("https://x.org/avatar", "image/jpeg; q=1") == "avatar.jpg"
+    assert cached_filename("https://x.org/", None) == "index"
+    assert cached_filename("https://x.org/my%20logo%3F.svg", None) == "my_logo_.svg"
+
+
+def test_build_download_remote(server, tmp_path):
+    server.put("/logo.png", b"logo")
+    server.put("/bootstrap.css", b"body {}", "text/css")
+    # Templates referring to the stand-in server instead of the CDN
+    template_dir = tmp_path / "base"
+    shutil.copytree(os.path.join(TEMPLATE_ROOT, "base"), template_dir)
+    index = read(template_dir / "index.html", "r")
+    index = re.sub(
+        r'https://cdn.jsdelivr.net/npm/bootstrap[^"]*"',
+        f'{server.url}/bootstrap.css"',
+        index,
+    )
+    index = re.sub(r'\s*integrity="[^"]*"', "", index)
+    (template_dir / "index.html").write_text(index, encoding="utf-8")
+    doc_path = tmp_path / "deck.md"
+    doc_path.write_text(f"# Remote\n![Logo]({server.url}/logo.png)\n", encoding="utf-8")
+    output_dir = tmp_path / "output"
+
+    stats = build(
+        str(doc_path), str(output_dir), str(template_dir), download_remote=True
+    )
+    html = read(output_dir / "index.html", "r")
+    assert f"{server.url}/logo.png" not in html
+    assert f"{server.url}/bootstrap.css" not in html
+    # MathJax loads further files relative to its url
+    assert "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-chtml.js" in html
+    assets = sorted(name.split("_", 1)[1] for name in os.listdir(output_dir / "assets"))
+    assert assets == ["bootstrap.css", "logo.png"]
+    umask = os.umask(0)
+    os.umask(umask)
+    for name in os.listdir(output_dir / "assets"):
+        assert (output_dir / "assets" / name).stat().st_mode & 0o777 == 0o666 & ~umask
+    assert stats.counters["remote_misses"] == 2
+
+    # The option is part of the manifest
+    stats = build(
+        str(doc_path), str(output_dir), str(template_dir), download_remote=True
+    )
+    assert stats.counters["manifest_hits"] == 1
+    stats = build(str(doc_path), str(output_dir), str(template_dir))
+    assert stats.counters["manifest_misses"] == 1
+    assert f"{server.url}/logo.png" in read(output_dir / "index.html", "r")
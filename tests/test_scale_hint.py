@@ -0,0 +1,60 @@
+from moffee.builder import render_jinja2
+from moffee.compositor import Chunk, Direction, Type, composite
+from moffee.utils.scale_hint import chunk_height, paragraph_height, scale_hint
+
+SLIDE_SIZE = (720, 405)
+
+
+def code_block(lines):
+    return "```python\n" + "\n".join(f"x = {i}" for i in range(lines)) + "\n```"
+
+
+def test_short_slide_has_no_hint():
+    (page,) = composite("## Title\nA short paragraph.")
+    assert scale_hint(page, SLIDE_SIZE) is None
+
+
+def test_hint_shrinks_with_content():
+    hints = []
+    for lines in [10, 20, 40]:
+        (page,) = composite(f"## Code\n{code_block(lines)}")
+        hints.append(scale_hint(page, SLIDE_SIZE))
+    assert hints[0] > hints[1] > hints[2] > 0
+    # Twice the code needs about half the scale
+    assert abs(hints[2] / hints[1] - 0.5) < 0.1
+
+
+def test_hint_grows_with_slide_size():
+    (page,) = composite("## List\n" + "\n".join(f"- item {i}" for i in range(12)))
+    assert scale_hint(page, SLIDE_SIZE) < scale_hint(page, (720, 540))
+
+
+def test_paragraph_height():
+    text = "word " * 40
+    assert paragraph_height(text, 300) > paragraph_height(text, 600)
+    table = "| a | b |\n|---|---|\n" + "\n".join(f"| {i} | {i} |" for i in range(5))
+    # Separator rows take no space
+    assert paragraph_height(table, 600) < 7 * paragraph_height("| a | b |", 600)
+    # Code lines don't wrap
+    assert paragraph_height(code_block(3), 100) == paragraph_height(code_block(3), 600)
+
+
+def test_chunk_layout():
+    text = Chunk(paragraph="word " * 60)
+    horizontal = Chunk(
+        children=[text, text], direction=Direction.HORIZONTAL, type=Type.NODE
+    )
+    vertical = Chunk(
+        children=[text, text], direction=Direction.VERTICAL, type=Type.NODE
+    )
+    single = chunk_height(text, 600)
+    assert chunk_height(vertical, 600) == 2 * single
+    # Side by side, each paragraph gets half the width
+    assert chunk_height(horizontal, 600) == chunk_height(text, 290) > single
+
+
+def test_rendered_hint(template_dir):
+    html = render_jinja2(f"## Short\nText\n\n## Long\n{code_block(30)}", template_dir())
+    hints = html.count("data-scale-hint=")
+    assert hints == 1
+    assert 'class="auto-sizing" data-scale-hint="0.' in html
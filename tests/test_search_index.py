@@ -0,0 +1,109 @@
+import base64
+import gzip
+import json
+import os
+import re
+
+from moffee.builder import render_jinja2, retrieve_structure
+from moffee.compositor import composite
+from moffee.utils.search_index import (
+    build_search_index,
+    encode_search_index,
+    plain_text,
+    tokens,
+    utf16_key,
+)
+
+DOC = """
+# Intro
+## Goals
+Learn **moffee** with [links](https://example.com) and ![a diagram](diagram.png)
+---
+Still the goals, with `code`
+# Café
+## Crème brûlée
+| Step | Time |
+|------|------|
+| Bake | 40 |
+"""
+
+
+def index_of(document):
+    pages = composite(document)
+    return build_search_index(pages, retrieve_structure(pages)["page_meta"])
+
+
+def decode(encoded):
+    return json.loads(gzip.decompress(base64.b64decode(encoded)))
+
+
+def test_plain_text():
+    assert plain_text("## Title\n- **bold** [link](http://x.org)\n![alt](a.png)") == (
+        "Title bold link alt"
+    )
+    assert plain_text("| a | b |\n|---|---|\n| 1 | 2 |") == "a b 1 2"
+
+
+def test_tokens():
+    assert tokens("Crème Brûlée, ÜBER-naïve 2024") == [
+        "creme",
+        "brulee",
+        "uber",
+        "naive",
+        "2024",
+    ]
+
+
+def test_build_search_index():
+    index = index_of(DOC)
+    paths = [path for path, _ in index["slides"]]
+    assert paths == ["Intro › Goals", "Intro › Goals", "Café › Crème brûlée"]
+    assert index["slides"][0][1] == "Learn moffee with links and a diagram"
+    assert index["tokens"] == sorted(index["tokens"], key=utf16_key)
+
+    postings = dict(zip(index["tokens"], index["postings"]))
+    assert postings["goals"] == [0, 1]
+    assert postings["cafe"] == [2]
+    assert postings["bake"] == [2]
+    # Urls are not searchable
+    assert "example" not in postings
+    assert "png" not in postings
+
+
+def lower_bound(sorted_tokens, prefix):
+    """lowerBound of main.js, comparing strings like JavaScript"""
+    low, high = 0, len(sorted_tokens)
+    while low < high:
+        middle = (low + high) // 2
+        if utf16_key(sorted_tokens[middle]) < utf16_key(prefix):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def test_tokens_outside_bmp():
+    # U+20000 sorts after U+FA0E by code point, but before it in UTF-16
+    words = ["\ufa0e", "\U00020000", "a\ufa0e", "a\U00020000", "b"]
+    index = index_of("# Words\n" + " ".join(words))
+    assert index["tokens"].index("\U00020000") < index["tokens"].index("\ufa0e")
+    for word in words:
+        assert index["tokens"][lower_bound(index["tokens"], word)] == word
+
+
+def test_encode_search_index():
+    index = index_of(DOC)
+    encoded = encode_search_index(index)
+    assert decode(encoded) == index
+    assert re.fullmatch(r"[A-Za-z0-9+/=]+", encoded)
+
+
+def test_rendered_search_index():
+    template_dir = os.path.join(
+        os.path.dirname(__file__), "..", "moffee", "templates", "base"
+    )
+    html = render_jinja2(DOC, template_dir)
+    match = re.search(
+        r'<script type="application/gzip" id="search-index">([^<]*)</script>', html
+    )
+    assert decode(match.group(1)) == index_of(DOC)
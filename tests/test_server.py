@@ -0,0 +1,131 @@
+import json
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+from moffee.loadgen import percentile, run_load
+from moffee.server import RenderServer, apply_frontmatter
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = RenderServer(("127.0.0.1", 0), workers=1, queue_size=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, payload=None):
+    conn = HTTPConnection(*server.server_address, timeout=30)
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    conn.request(method, path, body=body)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response, data
+
+
+def test_render_deck(server):
+    response, data = request(
+        server,
+        "POST",
+        "/render",
+        {"markdown": "# Title\nHello **world**", "frontmatter": {"theme": "beam"}},
+    )
+    assert response.status == 200
+    result = json.loads(data)
+    assert "<strong>world</strong>" in result["html"]
+    assert result["assets"]["css/extension.css"] == "/runtime/beam/css/extension.css"
+
+    response, data = request(server, "GET", "/runtime/beam/css/extension.css")
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "text/css"
+
+
+def test_render_single_html(server):
+    response, data = request(
+        server, "POST", "/render", {"markdown": "# Title", "format": "html"}
+    )
+    assert response.status == 200
+    html = data.decode("utf-8")
+    assert 'href="css/styles.css"' not in html
+    assert 'src="js/main.js"' not in html
+    assert "<style>" in html
+
+
+def test_bad_requests(server):
+    response, _ = request(server, "POST", "/render", {"markdown": "x", "theme": "nope"})
+    assert response.status == 400
+    response, _ = request(server, "POST", "/render", {"markdown": "x", "format": "pdf"})
+    assert response.status == 400
+    response, data = request(server, "POST", "/render", {"markdown": ["# T"]})
+    assert response.status == 400
+    assert "markdown must be a string" in json.loads(data)["error"]
+    response, _ = request(server, "GET", "/runtime/beam/../../pyproject.toml")
+    assert response.status == 404
+    response, data = request(server, "GET", "/health")
+    assert json.loads(data)["workers"] == 1
+
+
+def test_invalid_content_length(server):
+    for value, status in [("abc", 400), ("-1", 400), ("1_0", 400), (str(1 << 30), 413)]:
+        conn = HTTPConnection(*server.server_address, timeout=5)
+        conn.putrequest("POST", "/render")
+        conn.putheader("Content-Length", value)
+        conn.endheaders()
+        response = conn.getresponse()
+        assert response.status == status
+        assert "error" in json.loads(response.read())
+        conn.close()
+
+
+def test_load_generator(server):
+    url = "http://%s:%d" % server.server_address
+    result = run_load(url, "# Title\nHello", requests=20, concurrency=4)
+    assert result["statuses"] == {200: 20}
+    assert result["throughput"] > 0
+    assert result["p50"] <= result["p99"]
+
+
+def test_apply_frontmatter():
+    doc = apply_frontmatter(
+        "---\ntheme: beam\nlayout: centered\n---\n# T", {"theme": "robo"}
+    )
+    assert doc.startswith("---\n")
+    assert "theme: robo" in doc and "layout: centered" in doc and doc.endswith("# T")
+    assert apply_frontmatter("# T", None) == "# T"
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 99) == 0.0
+
+
+def test_every_worker_warmed():
+    server = RenderServer(("127.0.0.1", 0), workers=2, queue_size=0)
+    try:
+        assert len(server.pool._processes) == 2
+    finally:
+        server.server_close()
+
+
+def test_backpressure():
+    server = RenderServer(
+        ("127.0.0.1", 0), workers=1, queue_size=0, queue_timeout=0.001
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://%s:%d" % server.server_address
+        document = "\n---\n".join(f"# Slide {i}\n`code` ==mark==" for i in range(200))
+        result = run_load(url, document, requests=16, concurrency=8)
+        assert result["statuses"].get(200, 0) >= 1
+        assert result["statuses"].get(503, 0) >= 1
+    finally:
+        server.shutdown()
+        server.server_close()
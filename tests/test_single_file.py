@@ -0,0 +1,100 @@
+import base64
+import io
+import os
+import tempfile
+
+import pytest
+from moffee.utils.file_helper import (
+    inline_runtime,
+    safe_chunks,
+    write_inlined,
+    write_inlined_chunks,
+)
+
+
+@pytest.fixture
+def files():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = {}
+        for name, content in [
+            ("main.js", "console.log('</script>');"),
+            ("styles.css", "body { color: red; }"),
+            ("image.png", "fake image content" * 100000),
+            (
+                "icon.svg",
+                '<svg xmlns="http://www.w3.org/2000/svg"><text>#1 & "2"</text></svg>',
+            ),
+        ]:
+            paths[name] = os.path.join(temp_dir, name)
+            with open(paths[name], "w", encoding="utf8") as f:
+                f.write(content)
+        yield paths
+
+
+def inlined(document, runtime_files, **kwargs):
+    out = io.StringIO()
+    write_inlined(document, runtime_files, out, **kwargs)
+    return out.getvalue()
+
+
+def test_inline_runtime_files(files):
+    runtime_files = {
+        "css/styles.css": files["styles.css"],
+        "js/main.js": files["main.js"],
+    }
+    html = """<html><head><link rel="stylesheet" href="css/styles.css">
+<link rel="stylesheet" href="https://cdn.example.com/x.css"></head>
+<body><script src="js/main.js"></script></body></html>"""
+    result = inlined(html, runtime_files)
+    assert "<style>\nbody { color: red; }\n</style>" in result
+    assert "console.log('<\\/script>');" in result
+    assert 'href="https://cdn.example.com/x.css"' in result
+    assert 'src="js/main.js"' not in result
+
+
+def test_inline_image_once(files):
+    image = files["image.png"]
+    html = (
+        f'<body><img src="{image}" alt="a"><p>x</p><img alt="b" src="{image}"></body>'
+    )
+    result = inlined(html, {})
+    encoded = base64.b64encode(open(image, "rb").read()).decode("ascii")
+    assert result.count(encoded) == 1
+    assert result.count('data-moffee-src="0"') == 2
+    assert result.index('id="moffee-assets"') < result.index("</body>")
+    assert image not in result
+
+
+def test_inline_single_reference(files):
+    image = files["image.png"]
+    result = inlined(f'<img src="{image}"> <a href="#top">top</a>', {})
+    encoded = base64.b64encode(open(image, "rb").read()).decode("ascii")
+    assert f'<img src="data:image/png;base64,{encoded}">' in result
+    assert 'href="#top"' in result
+    assert "moffee-assets" not in result
+
+
+def test_inline_svg(files):
+    result = inlined(f'<img src="{files["icon.svg"]}">', {})
+    assert result.startswith('<img src="data:image/svg+xml,')
+    assert "#" not in result and "&" not in result and '"2' not in result
+
+
+def test_inline_runtime_leaves_local_files(files):
+    html = f'<img src="{files["image.png"]}">'
+    assert inline_runtime(html, {}) == html
+
+
+@pytest.mark.parametrize("size", [1, 20, 1000])
+def test_inline_chunks(files, size):
+    image = files["image.png"]
+    runtime_files = {"js/main.js": files["main.js"]}
+    html = (
+        "<html>\n<body>\n"
+        + f'<img src="{image}" alt="a">\n<p>x</p>\n<img alt="b" src="{image}">\n'
+        + f'<img src="{files["icon.svg"]}">\n<script src="js/main.js"></script>\n'
+        + "</body>\n</html>\n"
+    )
+    out = io.StringIO()
+    write_inlined_chunks(lambda: safe_chunks([html], size=size), runtime_files, out)
+    assert out.getvalue() == inlined(html, runtime_files)
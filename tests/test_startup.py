@@ -0,0 +1,108 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+import pytest
+
+HEAVY_MODULES = {
+    "jinja2",
+    "markdown",
+    "pymdownx",
+    "yaml",
+    "livereload",
+    "tornado",
+    "moffee.builder",
+}
+
+# Upper bounds on the total import time of each command, as a multiple of the import time of
+# `python -c pass`, so that they scale with the machine. Generous on purpose: they catch heavy
+# imports sneaking back in, not machine noise.
+STARTUP_BUDGETS = {
+    ("--version",): 25,
+    ("--help",): 25,
+    ("make", "--help"): 25,
+    ("live", "--help"): 25,
+    ("serve", "--help"): 25,
+    ("daemon", "--help"): 25,
+    ("daemon", "status"): 30,
+}
+RUNS = 3
+CLI = "import sys; from moffee.cli import cli; cli(sys.argv[1:])"
+
+
+def import_profile(args, env=None, code=CLI):
+    """Run the cli under `python -X importtime`, returns imported modules and total import time in ms"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+    )
+    assert result.returncode == 0, result.stderr
+    modules = set()
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        modules.add(name.strip())
+        total_us += int(self_us)
+    return modules, total_us / 1000
+
+
+def heavy(modules):
+    return {
+        m for m in modules if m.split(".")[0] in HEAVY_MODULES or m in HEAVY_MODULES
+    }
+
+
+@pytest.fixture(scope="module")
+def baseline_ms():
+    return min(import_profile([], code="pass")[1] for _ in range(RUNS))
+
+
+@pytest.mark.parametrize("args", list(STARTUP_BUDGETS))
+def test_startup_imports(args):
+    modules, _ = import_profile(list(args))
+    assert "moffee.cli" in modules
+    assert heavy(modules) == set()
+
+
+@pytest.mark.parametrize("args", list(STARTUP_BUDGETS))
+def test_startup_budget(args, baseline_ms):
+    # The fastest run, a busy machine only makes runs slower
+    total_ms = min(import_profile(list(args))[1] for _ in range(RUNS))
+    assert total_ms < STARTUP_BUDGETS[args] * baseline_ms
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix sockets are not available")
+def test_forwarded_make_skips_pipeline_imports():
+    from moffee.daemon import DaemonServer
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "deck.md")
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write("# Title\ntext")
+        fd, socket_file = tempfile.mkstemp(suffix=".sock", dir="/tmp")
+        os.close(fd)
+        os.unlink(socket_file)
+
+        server = DaemonServer(socket_file)
+        thread = threading.Thread(target=server.serve_until_idle, daemon=True)
+        thread.start()
+        try:
+            output_dir = os.path.join(temp_dir, "out")
+            modules, _ = import_profile(
+                ["make", doc_path, "-o", output_dir],
+                env={"MOFFEE_DAEMON_SOCKET": socket_file},
+            )
+        finally:
+            server.shutdown()
+            thread.join()
+
+        assert os.path.exists(os.path.join(output_dir, "index.html"))
+        assert "moffee.daemon" in modules
+        assert heavy(modules) == set()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+
+import pytest
+from moffee.builder import build, render_jinja2, stream_jinja2
+from moffee.utils.file_helper import (
+    AssetRewriter,
+    path_redirector,
+    redirect_paths,
+    safe_chunks,
+)
+
+HTML = """<html>
+<head>
+    <link rel="stylesheet"
+        href="style.css">
+</head>
+<body>
+    <p>Text with "quotes" and a < b
+    on two lines</p>
+    <img src="image.png" alt="An image">
+    <a href="image.png">Link</a>
+</body>
+</html>
+"""
+
+
+def pieces(text, size=3):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 10, 40, 1000])
+def test_safe_chunks(size):
+    chunks = list(safe_chunks(pieces(HTML), size=size))
+    assert "".join(chunks) == HTML
+    for chunk in chunks[:-1]:
+        assert chunk.endswith("\n")
+    # No chunk ends within a tag
+    assert not any(chunk.endswith('stylesheet"\n') for chunk in chunks)
+    assert not any(chunk.endswith("a < b\n") for chunk in chunks)
+
+
+def test_chunked_rewriting():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ["style.css", "image.png"]:
+            with open(os.path.join(temp_dir, name), "w") as f:
+                f.write(name)
+        document_path = os.path.join(temp_dir, "deck.md")
+        redirected = redirect_paths(HTML, document_path)
+        assert f'src="{os.path.join(temp_dir, "image.png")}"' in redirected
+
+        redirect = path_redirector(document_path)
+        rewrite = AssetRewriter("out/assets", url_prefix="assets")
+        chunks = [
+            rewrite(redirect(chunk)) for chunk in safe_chunks(pieces(HTML), size=10)
+        ]
+        document = "".join(chunks)
+        assert "".join(map(redirect, safe_chunks(pieces(HTML), size=10))) == redirected
+
+        image = rewrite.urls[os.path.join(temp_dir, "image.png")]
+        assert image.startswith("assets/") and image.endswith("_image.png")
+        assert document.count(image) == 2
+        assert f'href="{rewrite.urls[os.path.join(temp_dir, "style.css")]}"' in document
+        assert set(rewrite.mapping.values()) == {
+            os.path.join(temp_dir, "style.css"),
+            os.path.join(temp_dir, "image.png"),
+        }
+        assert all(path.startswith("out/assets/") for path in rewrite.mapping)
+
+
+def test_rewriting_skips_data_attributes(tmp_path):
+    image = tmp_path / "image.png"
+    image.write_text("image")
+    rewrite = AssetRewriter("out/assets", url_prefix="assets")
+    document = rewrite(f'<img data-src="{image}" src="{image}">')
+    assert document == f'<img data-src="{image}" src="{rewrite.urls[str(image)]}">'
+
+
+def test_stream_jinja2(template_dir):
+    doc = "# Title\n\nText\n\n---\n\n## Second\n\n- item\n"
+    assert "".join(stream_jinja2(doc, template_dir())) == render_jinja2(
+        doc, template_dir()
+    )
+
+
+def test_build_streams_large_deck(template_dir):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "deck.md")
+        output_dir = os.path.join(temp_dir, "output")
+        with open(os.path.join(temp_dir, "image.png"), "w") as f:
+            f.write("fake image content")
+        with open(doc_path, "w", encoding="utf8") as f:
+            for i in range(400):
+                f.write(
+                    f"## Slide {i}\n\n{'Some text. ' * 20}\n\n![Image](image.png)\n\n---\n"
+                )
+        stats = build(doc_path, output_dir, template_dir())
+
+        # The html was rewritten in several chunks
+        assert stats.stages["redirect_paths"].calls > 1
+        assert stats.stages["rewrite_assets"].calls > 1
+        (asset,) = os.listdir(os.path.join(output_dir, "assets"))
+        with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+            html = f.read()
+        assert html.count(f'src="assets/{asset}"') == 400
+        assert temp_dir not in html
@@ -0,0 +1,119 @@
+from moffee.builder import render_jinja2
+from moffee.utils.style_classes import SlideStyle, important_properties, share_styles
+
+
+def test_deck_styles():
+    deck = {"background-color": "red", "color": "#333"}
+    rules, styles = share_styles(deck, [dict(deck), dict(deck)])
+    assert (
+        rules
+        == ".deck-style { background-color: red !important; color: #333 !important; }"
+    )
+    assert styles == [SlideStyle("deck-style"), SlideStyle("deck-style")]
+
+
+def test_repeated_overrides():
+    deck = {"color": "red"}
+    slides = [
+        {"color": "red", "background": "blue"},
+        {"color": "red", "background": "blue"},
+        {"color": "red", "border": "1px solid"},
+        {"color": "red"},
+    ]
+    rules, styles = share_styles(deck, slides)
+    assert rules.splitlines() == [
+        ".deck-style { color: red !important; }",
+        ".slide-style-1 { background: blue !important; }",
+    ]
+    assert styles == [
+        SlideStyle("deck-style slide-style-1"),
+        SlideStyle("deck-style slide-style-1"),
+        SlideStyle("deck-style", {"border": "1px solid"}),
+        SlideStyle("deck-style"),
+    ]
+
+
+def test_unique_override_of_deck_property():
+    # An inline color would lose against the !important deck rule
+    deck = {"color": "red"}
+    rules, styles = share_styles(deck, [{"color": "red"}, {"color": "blue"}])
+    assert styles[1] == SlideStyle(inline={"color": "blue"})
+
+
+def test_shorthand_order():
+    # background-color overridden before background: a later rule would change which one wins
+    deck = {"background-color": "red", "background": "white"}
+    slides = [{"background-color": "blue", "background": "white"}] * 2
+    _, styles = share_styles(deck, slides)
+    assert styles == [SlideStyle(inline=slides[0])] * 2
+
+
+def test_unshareable_values():
+    rules, styles = share_styles(
+        {"background": "url(a;b)"}, [{"background": "url(a;b)"}]
+    )
+    assert rules == ""
+    assert styles == [SlideStyle(inline={"background": "url(a;b)"})]
+
+
+def test_render_shared_styles(template_dir):
+    doc = """---
+background-color: red
+---
+# Title
+First
+---
+@(color=blue)
+Second
+---
+@(color=blue)
+Third
+"""
+    html = render_jinja2(doc, template_dir())
+    assert ".deck-style { background-color: red !important; }" in html
+    assert ".slide-style-1 { color: blue !important; }" in html
+    assert html.count('class="slide-content deck-style slide-style-1"') == 2
+    assert "style=" not in html
+
+
+def test_important_properties():
+    css = (
+        ".a { color: red !important; background-color:blue!IMPORTANT } .b { margin: 0 }"
+    )
+    assert important_properties(css) == {"color", "background-color"}
+
+
+def test_theme_important_properties_stay_inline():
+    deck = {"background": "red", "color": "blue"}
+    # An !important background-color in the theme wins over inline backgrounds, not over !important rules
+    rules, styles = share_styles(deck, [dict(deck), dict(deck)], {"background-color"})
+    assert rules == ""
+    assert styles == [SlideStyle(inline=deck)] * 2
+
+    slides = [{"color": "blue", "border": "1px"}] * 2
+    rules, styles = share_styles({"color": "blue"}, slides, {"border-color"})
+    assert rules == ".deck-style { color: blue !important; }"
+    assert styles == [SlideStyle(inline=slides[0])] * 2
+
+
+def test_render_theme_important(tmp_path, template_dir):
+    theme_dir = tmp_path / "theme"
+    (theme_dir / "css").mkdir(parents=True)
+    (theme_dir / "css" / "extension.css").write_text(
+        ".slide-content { background-color: #eee !important; }", encoding="utf-8"
+    )
+    doc = """---
+background-color: red
+color: blue
+---
+# Title
+"""
+    html = render_jinja2(doc, template_dir(), str(theme_dir))
+    assert ".deck-style" not in html
+    assert 'style="background-color: red; color: blue; "' in html
+    # Without the theme rule, both styles are shared
+    html = render_jinja2(doc, template_dir())
+    assert (
+        ".deck-style { background-color: red !important; color: blue !important; }"
+        in html
+    )